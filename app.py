@@ -1,9 +1,9 @@
 import streamlit as st
-import pandas as pd
-import requests
-import folium
-from streamlit_folium import folium_static
-import xmltodict
+
+import cache_warmer
+import config
+import metrics
+import sections
 
 # -------------------------------
 # 1. PAGE CONFIG
@@ -15,6 +15,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Pre-fetches the default and popular searches in the background (once per process).
+cache_warmer.start()
+# Prometheus /metrics for this process, when METRICS_PORT is set.
+metrics.start_server()
+
 # -------------------------------
 # 2. CUSTOM CSS
 # -------------------------------
@@ -242,6 +247,11 @@ st.sidebar.markdown("""
 </ul>
 """, unsafe_allow_html=True)
 
+# Hidden unless the page is opened with ?debug=1.
+if config.DEBUG_PANEL and st.query_params.get("debug") == "1":
+    with st.sidebar.expander("Debug: stage timings", expanded=True):
+        sections.debug_panel()
+
 # -------------------------------
 # 4. HOME SECTION
 # -------------------------------
@@ -269,80 +279,7 @@ st.markdown("""
 Find top-rated cancer hospitals specializing in your area. Use the interactive map below to explore nearby facilities.
 """)
 
-location = st.text_input("Enter your city or ZIP code:", "New York")
-if st.button("Find Hospitals"):
-    with st.spinner("Searching for hospitals..."):
-        headers = {"User-Agent": "CancerSupportApp/1.0 (your_email@example.com)"}
-        geocode_url = "https://nominatim.openstreetmap.org/search"
-        geocode_params = {"q": location, "format": "json", "limit": 1}
-        
-        try:
-            geocode_response = requests.get(geocode_url, headers=headers, params=geocode_params, timeout=10)
-            geocode_response.raise_for_status()
-            geocode_data = geocode_response.json()
-        except Exception as e:
-            st.error(f"Geocoding error: {e}")
-            st.stop()
-        
-        if geocode_data:
-            lat = geocode_data[0].get('lat')
-            lon = geocode_data[0].get('lon')
-            if lat and lon:
-                lat, lon = float(lat), float(lon)
-                overpass_url = "http://overpass-api.de/api/interpreter"
-                overpass_query = f"""
-                [out:json];
-                (
-                  node["amenity"="hospital"](around:50000,{lat},{lon});
-                  way["amenity"="hospital"](around:50000,{lat},{lon});
-                  relation["amenity"="hospital"](around:50000,{lat},{lon});
-                );
-                out center;
-                """
-                try:
-                    overpass_response = requests.get(overpass_url, params={'data': overpass_query}, headers=headers, timeout=10)
-                    overpass_response.raise_for_status()
-                    overpass_data = overpass_response.json()
-                except Exception as e:
-                    st.error(f"Overpass API error: {e}")
-                    st.stop()
-
-                hospitals = []
-                for element in overpass_data.get('elements', []):
-                    tags = element.get('tags', {})
-                    name = tags.get('name', 'Unnamed Hospital')
-                    lat_h = element.get('lat') or (element.get('center', {}).get('lat') if element.get('center') else None)
-                    lon_h = element.get('lon') or (element.get('center', {}).get('lon') if element.get('center') else None)
-                    if lat_h and lon_h:
-                        hospitals.append({"Name": name, "Latitude": lat_h, "Longitude": lon_h})
-                
-                if hospitals:
-                    df_hospitals = pd.DataFrame(hospitals)
-                    # Display map
-                    m = folium.Map(location=[lat, lon], zoom_start=12)
-                    folium.Marker(
-                        [lat, lon],
-                        popup="Your Location",
-                        icon=folium.Icon(color='red', icon='home')
-                    ).add_to(m)
-                    
-                    for _, row in df_hospitals.iterrows():
-                        folium.Marker(
-                            [row['Latitude'], row['Longitude']],
-                            popup=row['Name'],
-                            icon=folium.Icon(color='blue', icon='plus-sign')
-                        ).add_to(m)
-                    
-                    folium_static(m, width=700, height=500)
-                    
-                    st.subheader("List of Hospitals")
-                    st.dataframe(df_hospitals)
-                else:
-                    st.warning("No hospitals found within a 50km radius.")
-            else:
-                st.warning("Could not retrieve latitude/longitude.")
-        else:
-            st.warning("Location not found. Please try again.")
+sections.hospital_finder()
 
 # -------------------------------
 # 6. ACCOMMODATION RESOURCES
@@ -385,58 +322,16 @@ st.markdown("""
 **Stay updated with the latest research, treatment advancements, and breakthroughs related to your specific cancer type.**
 """)
 
-cancer_type = st.text_input("Enter your cancer type (e.g., Breast Cancer):", "Breast Cancer")
-if st.button("Get Latest Research"):
-    with st.spinner("Fetching latest research articles..."):
-        base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-        params = {
-            "db": "pubmed",
-            "term": cancer_type,
-            "retmax": 10,
-            "sort": "pub date",
-            "retmode": "json"
-        }
-        try:
-            response = requests.get(base_url, params=params).json()
-            id_list = response['esearchresult']['idlist']
-        except Exception as e:
-            st.error(f"Error searching PubMed: {e}")
-            st.stop()
-
-        if id_list:
-            fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-            fetch_params = {
-                "db": "pubmed",
-                "id": ",".join(id_list),
-                "retmode": "xml",
-                "rettype": "abstract"
-            }
-            try:
-                fetch_response = requests.get(fetch_url, params=fetch_params).text
-                data_dict = xmltodict.parse(fetch_response)
-                articles = data_dict.get('PubmedArticleSet', {}).get('PubmedArticle', [])
-                if isinstance(articles, dict):
-                    articles = [articles]
-                
-                st.markdown("### Latest Research Articles")
-                for article in articles:
-                    title = article.get('MedlineCitation', {}).get('Article', {}).get('ArticleTitle', 'No Title')
-                    pmid = article.get('MedlineCitation', {}).get('PMID', {}).get('#text', '')
-                    link = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-                    st.markdown(f"#### [{title}]({link})")
-            except Exception as e:
-                st.error(f"Error fetching PubMed abstracts: {e}")
-        else:
-            st.warning("No articles found for the specified cancer type.")
+sections.research_feed()
 
 st.markdown("---")
 st.header("Stay Informed")
 st.markdown("""
 **Subscribe to email notifications** to receive updates on newly published studies and breakthroughs.
-
-*Feature coming soon!*
 """)
 
+sections.subscribe_form()
+
 st.header("AI Chatbot Assistance")
 st.markdown("""
 **Have questions about the latest research or treatments?**
@@ -478,15 +373,7 @@ st.markdown("""
 st.header("Interactive Financial Calculator")
 st.markdown("Estimate potential savings, grants, or tax benefits based on your data.")
 
-with st.form("financial_calculator"):
-    income = st.number_input("Enter your annual income ($):", min_value=0, value=50000, step=1000)
-    retirement_withdraw = st.number_input("Enter amount to withdraw from retirement account ($):", min_value=0, value=10000, step=1000)
-    submitted = st.form_submit_button("Calculate")
-    if submitted:
-        # Placeholder calculation
-        tax = 0  # e.g., 0% for Stage IV
-        st.write(f"**Estimated Tax on Withdrawal:** ${tax}")
-        st.success("Calculation completed. Please consult a financial advisor for accurate information.")
+sections.financial_calculator()
 
 # -------------------------------
 # 9. CLINICAL TRIALS
@@ -497,62 +384,7 @@ st.markdown("""
 **Find relevant clinical trials based on your condition, location, and treatment phase. Participate in studies to access cutting-edge treatments.**
 """)
 
-cancer_type_ct = st.text_input("Enter your cancer type (e.g., Lung Cancer):", "Lung Cancer", key="ct_input")
-location_ct = st.text_input("Enter your location or ZIP code:", "New York", key="ct_loc")
-phase_ct = st.selectbox("Select Trial Phase:", ["All", "Phase 1", "Phase 2", "Phase 3", "Phase 4"], key="ct_phase")
-
-if st.button("Find Clinical Trials", key="ct_button"):
-    with st.spinner("Searching for clinical trials..."):
-        query = f"{cancer_type_ct}[Condition] AND {location_ct}[Location]"
-        if phase_ct != "All":
-            query += f" AND {phase_ct}[Phase]"
-        
-        base_url = "https://clinicaltrials.gov/api/query/study/search/brief"
-        params = {
-            "expr": query,
-            "min_rnk": 1,
-            "max_rnk": 20,
-            "fmt": "xml"
-        }
-        headers = {"User-Agent": "CancerSupportApp/1.0 (your_email@example.com)"}
-        
-        try:
-            response = requests.get(base_url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-        except Exception as e:
-            st.error(f"ClinicalTrials.gov error: {e}")
-            st.stop()
-        
-        try:
-            data_dict = xmltodict.parse(response.content)
-            studies = data_dict.get('clinical_studies', {}).get('clinical_study', [])
-            if isinstance(studies, dict):
-                studies = [studies]
-            
-            if studies:
-                st.markdown("### Found Clinical Trials")
-                for study in studies:
-                    title = study.get('official_title', 'No Title')
-                    status = study.get('overall_status', 'Status Unknown')
-                    
-                    location_info = study.get('location_countries', {}).get('location_country', [])
-                    if isinstance(location_info, dict):
-                        location_info = [location_info]
-                    locations = ", ".join([loc.get('location', 'Unknown') for loc in location_info])
-                    
-                    phase_text = study.get('phase', 'N/A')
-                    nct_id = study.get('id_info', {}).get('nct_id', '')
-                    link = f"https://clinicaltrials.gov/ct2/show/{nct_id}" if nct_id else "#"
-                    
-                    st.markdown(f"#### [{title}]({link})")
-                    st.write(f"**Status:** {status}")
-                    st.write(f"**Phase:** {phase_text}")
-                    st.write(f"**Locations:** {locations}")
-                    st.markdown("---")
-            else:
-                st.warning("No clinical trials found for the given criteria.")
-        except Exception as e:
-            st.error(f"Error parsing clinical trials data: {e}")
+sections.trial_finder()
 
 st.markdown("---")
 st.header("Enrollment Guide")
@@ -602,44 +434,7 @@ st.markdown("""
 st.header("Checklist Generator")
 st.markdown("Create your personalized to-do list based on your needs.")
 
-with st.form("checklist_form"):
-    financial_tasks = st.multiselect("Financial Tasks", [
-        "Apply for insurance",
-        "Meet with financial advisor",
-        "Fill out tax forms",
-        "Explore Corporate Angel Network",
-        "Plan budget for treatments"
-    ])
-    medical_appointments = st.multiselect("Medical Appointments", [
-        "Schedule doctor's visit",
-        "Radiation therapy session",
-        "Chemotherapy session",
-        "Follow-up consultations",
-        "Get second opinion"
-    ])
-    other_tasks = st.multiselect("Other Tasks", [
-        "Call support group",
-        "Arrange transportation",
-        "Update personal documents",
-        "Organize living space",
-        "Plan meals"
-    ])
-    
-    submitted = st.form_submit_button("Generate Checklist")
-    if submitted:
-        st.markdown("### Your Personalized Checklist")
-        if financial_tasks:
-            st.markdown("**Financial Tasks:**")
-            for task in financial_tasks:
-                st.write(f"- [ ] {task}")
-        if medical_appointments:
-            st.markdown("**Medical Appointments:**")
-            for task in medical_appointments:
-                st.write(f"- [ ] {task}")
-        if other_tasks:
-            st.markdown("**Other Tasks:**")
-            for task in other_tasks:
-                st.write(f"- [ ] {task}")
+sections.checklist()
 
 st.markdown("---")
 
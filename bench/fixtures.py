@@ -0,0 +1,464 @@
+"""Local stand-in for Nominatim, Overpass, PubMed E-utilities and ClinicalTrials.gov.
+
+    python bench/fixtures.py serve --size 1000                        # synthetic, 1000 results per search
+    python bench/fixtures.py serve --recordings bench/recordings      # replay what was recorded
+    python bench/fixtures.py record --recordings bench/recordings     # proxy to the live services and save
+    python bench/fixtures.py smtp --port 8025                         # mail sink for notifications.py
+
+Each service is served under its own prefix (``/nominatim/search``,
+``/overpass/api/interpreter``, ``/eutils/<tool>.fcgi``, ``/ct/api/v2/studies``);
+:meth:`FixtureServer.app_env` gives the app's URL settings for them. A request
+that has a recording is replayed byte for byte. Anything else gets a
+synthetic response in the service's real format, with ``size`` results: that
+many hospitals in range, articles found, or matching studies. The same request
+always gets the same answer. ``latency`` delays every response to stand in for
+the network. ``/stats`` returns request and byte counts served so far.
+
+Recording goes through the app's own HTTP layer, so it keeps to the per-host
+rate limits.
+
+:class:`SMTPSink` is a minimal SMTP server that accepts every message and
+keeps it in memory, for sending notification digests without a mail server.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+UPSTREAMS = {
+    "nominatim": "https://nominatim.openstreetmap.org",
+    "overpass": "https://overpass-api.de",
+    "eutils": "https://eutils.ncbi.nlm.nih.gov/entrez/eutils",
+    "ct": "https://clinicaltrials.gov",
+}
+# Left out of recording keys: they identify the caller, not the query.
+_VOLATILE = frozenset({"tool", "email", "api_key"})
+
+
+def _rng(*seed):
+    return random.Random(zlib.crc32(json.dumps(seed, default=str).encode("utf-8")))
+
+
+def _json(value):
+    return "application/json", json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+# -------------------------------
+# Synthetic responses
+# -------------------------------
+_AROUND = re.compile(r"around:(\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)")
+_DISTANCE = re.compile(r"distance\((-?[\d.]+),(-?[\d.]+),([\d.]+)km\)")
+_JOURNALS = ("Journal of Clinical Oncology", "The Lancet Oncology", "JAMA Oncology", "Cancer Research",
+             "Annals of Oncology", "Clinical Cancer Research", "Nature Reviews Clinical Oncology")
+_CITIES = (("New York", "NY", 40.71, -74.01), ("Boston", "MA", 42.36, -71.06), ("Houston", "TX", 29.76, -95.37),
+           ("Chicago", "IL", 41.88, -87.63), ("Seattle", "WA", 47.61, -122.33), ("Los Angeles", "CA", 34.05, -118.24))
+_STATUSES = ("RECRUITING", "RECRUITING", "NOT_YET_RECRUITING", "ACTIVE_NOT_RECRUITING", "COMPLETED")
+_PHASES = ("PHASE1", "PHASE2", "PHASE3", "PHASE4")
+
+
+def _point_within(rng, lat, lon, radius_km):
+    """Uniformly random point within ``radius_km`` of ``(lat, lon)``."""
+    r = radius_km * math.sqrt(rng.random()) / 111.32
+    theta = rng.random() * 2 * math.pi
+    return (round(lat + r * math.sin(theta), 7),
+            round(lon + r * math.cos(theta) / max(0.01, math.cos(math.radians(lat))), 7))
+
+
+def nominatim(params, size):
+    q = params.get("q", "")
+    rng = _rng("nominatim", q.casefold())
+    city, state, lat, lon = rng.choice(_CITIES)
+    lat, lon = _point_within(rng, lat, lon, 10)
+    return _json([{
+        "place_id": rng.randrange(10 ** 8), "licence": "Data © OpenStreetMap contributors, ODbL 1.0.",
+        "osm_type": "relation", "osm_id": rng.randrange(10 ** 7), "lat": f"{lat:.7f}", "lon": f"{lon:.7f}",
+        "class": "boundary", "type": "administrative", "place_rank": 16, "importance": 0.8,
+        "addresstype": "city", "name": q, "display_name": f"{q}, {city}, {state}, United States",
+        "boundingbox": [f"{lat - 0.2:.7f}", f"{lat + 0.2:.7f}", f"{lon - 0.2:.7f}", f"{lon + 0.2:.7f}"],
+    }])
+
+
+def overpass(params, size):
+    """``size`` hospitals spread over the queried circle; a fifth are ways (``out center``)."""
+    match = _AROUND.search(params.get("data", ""))
+    radius_m, lat, lon = (float(g) for g in match.groups()) if match else (5000.0, 40.71, -74.01)
+    rng = _rng("overpass", round(lat, 4), round(lon, 4), radius_m)
+    oncology = "oncology" in params.get("data", "")
+    elements = []
+    for i in range(size):
+        p_lat, p_lon = _point_within(rng, lat, lon, radius_m / 1000)
+        tags = {"amenity": "hospital", "healthcare": "hospital", "name": f"{rng.choice(_CITIES)[0]} Hospital {i}",
+                "addr:street": f"{rng.randrange(1, 999)} Main Street", "beds": str(rng.randrange(20, 900)),
+                "emergency": rng.choice(("yes", "no"))}
+        if oncology or i % 5 == 0:
+            tags["healthcare:speciality"] = "oncology;general"
+        if i % 5 == 4:
+            elements.append({"type": "way", "id": 10 ** 8 + i, "center": {"lat": p_lat, "lon": p_lon}, "tags": tags})
+        else:
+            elements.append({"type": "node", "id": 10 ** 9 + i, "lat": p_lat, "lon": p_lon, "tags": tags})
+    return _json({
+        "version": 0.6, "generator": "Overpass API 0.7.62 (fixture)",
+        "osm3s": {"timestamp_osm_base": "2024-01-01T00:00:00Z", "copyright": "OpenStreetMap contributors"},
+        "elements": elements,
+    })
+
+
+def _pmids(term, size):
+    base = 30_000_000 + zlib.crc32(term.casefold().encode("utf-8")) % 5000 * 20_000
+    return [str(base + size - i) for i in range(size)]  # newest (highest) first
+
+
+def esearch(params, size):
+    term = params.get("term", "")
+    ids = _pmids(term, size)
+    retstart, retmax = int(params.get("retstart", 0)), int(params.get("retmax", 20))
+    result = {"count": str(size), "retmax": str(min(retmax, size)), "retstart": str(retstart),
+              "idlist": ids[retstart:retstart + retmax], "translationset": [], "querytranslation": term}
+    return _json({"header": {"type": "esearch", "version": "0.3"}, "esearchresult": result})
+
+
+def _article_meta(pmid):
+    rng = _rng("article", pmid)
+    year, month, day = 2015 + int(pmid) % 10, rng.randrange(1, 13), rng.randrange(1, 29)
+    return {
+        "title": f"Outcomes of {rng.choice(('adjuvant', 'neoadjuvant', 'targeted', 'immune checkpoint'))} therapy "
+                 f"in a cohort of {rng.randrange(40, 4000)} patients ({pmid})",
+        "journal": rng.choice(_JOURNALS),
+        "year": year, "month": month, "day": day,
+        "authors": [f"{rng.choice(('Smith', 'Chen', 'Garcia', 'Patel', 'Kim', 'Müller'))} {chr(65 + rng.randrange(26))}"
+                    for _ in range(rng.randrange(3, 9))],
+    }
+
+
+def esummary(params, size):
+    ids = [p for p in params.get("id", "").split(",") if p]
+    result = {"uids": ids}
+    for pmid in ids:
+        meta = _article_meta(pmid)
+        month = time.strftime("%b", time.struct_time((2000, meta["month"], 1, 0, 0, 0, 0, 1, 0)))
+        result[pmid] = {
+            "uid": pmid, "pubdate": f"{meta['year']} {month} {meta['day']}", "epubdate": "",
+            "source": meta["journal"][:20], "fulljournalname": meta["journal"], "title": meta["title"] + ".",
+            "authors": [{"name": a, "authtype": "Author", "clusterid": ""} for a in meta["authors"]],
+            "lang": ["eng"], "pubtype": ["Journal Article"], "volume": str(meta["year"] - 1990), "issue": "4",
+            "pages": "101-12", "articleids": [{"idtype": "pubmed", "value": pmid}],
+            "sortpubdate": f"{meta['year']}/{meta['month']:02d}/{meta['day']:02d} 00:00",
+        }
+    return _json({"header": {"type": "esummary", "version": "0.3"}, "result": result})
+
+
+def _article_xml(pmid):
+    meta = _article_meta(pmid)
+    rng = _rng("abstract", pmid)
+    sections = "".join(
+        f'<AbstractText Label="{label}" NlmCategory="{label}">{" ".join(rng.choice(_WORDS) for _ in range(n))}.</AbstractText>'
+        for label, n in (("BACKGROUND", 45), ("METHODS", 60), ("RESULTS", 80), ("CONCLUSIONS", 35))
+    )
+    authors = "".join(f"<Author><LastName>{escape(a.split()[0])}</LastName><Initials>{a.split()[1]}</Initials></Author>"
+                      for a in meta["authors"])
+    return (
+        f'<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">{pmid}</PMID>'
+        f"<Article PubModel=\"Print\"><Journal><JournalIssue CitedMedium=\"Internet\"><PubDate><Year>{meta['year']}</Year>"
+        f"<Month>{meta['month']:02d}</Month><Day>{meta['day']}</Day></PubDate></JournalIssue>"
+        f"<Title>{escape(meta['journal'])}</Title></Journal><ArticleTitle>{escape(meta['title'])}.</ArticleTitle>"
+        f"<Abstract>{sections}</Abstract><AuthorList>{authors}</AuthorList></Article></MedlineCitation>"
+        f"<PubmedData><PublicationStatus>ppublish</PublicationStatus></PubmedData></PubmedArticle>"
+    )
+
+
+_WORDS = ("tumor", "patients", "survival", "median", "cohort", "treatment", "response", "randomized", "versus",
+          "progression-free", "overall", "hazard", "ratio", "confidence", "interval", "biomarker", "expression",
+          "metastatic", "adjuvant", "toxicity", "grade", "events", "significant", "improved", "outcomes", "trial")
+
+
+def efetch(params, size):
+    ids = [p for p in params.get("id", "").split(",") if p]
+    body = ('<?xml version="1.0" ?>\n<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2024//EN" '
+            '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_240101.dtd">\n<PubmedArticleSet>'
+            + "".join(_article_xml(p) for p in ids) + "</PubmedArticleSet>")
+    return "text/xml; charset=UTF-8", body.encode("utf-8")
+
+
+def ct_studies(params, size):
+    """A page of ``size`` matching studies, each with 1-8 sites (near ``filter.geo`` when given)."""
+    condition = params.get("query.cond", "cancer")
+    start = int(params.get("pageToken") or 0)
+    page_size = min(1000, int(params.get("pageSize", 10)))
+    near = _DISTANCE.search(params.get("filter.geo", ""))
+    phase = params.get("filter.advanced", "").rpartition("]")[2] or None
+    status = params.get("filter.overallStatus") or None
+    studies = []
+    for i in range(start, min(size, start + page_size)):
+        rng = _rng("study", condition.casefold(), i)
+        locations = []
+        for s in range(rng.randrange(1, 9)):
+            if near:
+                lat, lon = _point_within(rng, float(near.group(1)), float(near.group(2)), float(near.group(3)))
+                city, state = "Nearby", "NY"
+            else:
+                city, state, lat, lon = rng.choice(_CITIES)
+                lat, lon = _point_within(rng, lat, lon, 25)
+            locations.append({"facility": f"{city} Cancer Center {s}", "status": rng.choice(_STATUSES),
+                              "city": city, "state": state, "country": "United States",
+                              "geoPoint": {"lat": lat, "lon": lon}})
+        nct = f"NCT{(zlib.crc32(condition.casefold().encode()) % 900 + 100) * 100000 + i:08d}"
+        studies.append({"protocolSection": {
+            "identificationModule": {"nctId": nct, "briefTitle": f"{condition} study {i}",
+                                     "officialTitle": f"A Phase {rng.randrange(1, 4)} Study of Drug-{i} in {condition}"},
+            "statusModule": {"overallStatus": status or rng.choice(_STATUSES),
+                             "lastUpdatePostDateStruct": {"date": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+                                                          "type": "ACTUAL"}},
+            "conditionsModule": {"conditions": [condition, rng.choice(("Neoplasms", "Carcinoma", "Solid Tumor"))]},
+            "designModule": {"phases": [phase or rng.choice(_PHASES)]},
+            "contactsLocationsModule": {"locations": locations},
+        }})
+    page = {"studies": studies}
+    if start + page_size < size:
+        page["nextPageToken"] = str(start + page_size)
+    if params.get("countTotal") == "true":
+        page["totalCount"] = size
+    return _json(page)
+
+
+SYNTHESIZERS = {
+    ("nominatim", "search"): nominatim,
+    ("overpass", "api/interpreter"): overpass,
+    ("eutils", "esearch.fcgi"): esearch,
+    ("eutils", "esummary.fcgi"): esummary,
+    ("eutils", "efetch.fcgi"): efetch,
+    ("ct", "api/v2/studies"): ct_studies,
+}
+
+
+# -------------------------------
+# Recordings
+# -------------------------------
+def recording_path(recordings, service, endpoint, params):
+    query = sorted((k, v) for k, v in params.items() if k not in _VOLATILE)
+    digest = hashlib.sha1(json.dumps([endpoint, query]).encode("utf-8")).hexdigest()
+    return os.path.join(recordings, service, digest + ".json")
+
+
+def load_recording(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except OSError:
+        return None
+    return entry["status"], entry["content_type"], entry["body"].encode("utf-8")
+
+
+def record(path, service, endpoint, params):
+    """Fetch a request from the live service and save it at ``path``."""
+    import http_client
+
+    response = http_client.get(f"{UPSTREAMS[service]}/{endpoint}", params=params)
+    entry = {"request": [service, endpoint, params], "status": response.status_code,
+             "content_type": response.headers.get("Content-Type", "application/octet-stream"),
+             "body": response.content.decode("utf-8", errors="replace")}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    return entry["status"], entry["content_type"], entry["body"].encode("utf-8")
+
+
+# -------------------------------
+# Server
+# -------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            with server.lock:
+                self._send(200, *_json(dict(server.stats)))
+            return
+        service, _, endpoint = url.path.lstrip("/").partition("/")
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        synthesize = SYNTHESIZERS.get((service, endpoint))
+        if synthesize is None:
+            self._send(404, "text/plain", b"no such fixture endpoint")
+            return
+        answer = None
+        if server.recordings:
+            path = recording_path(server.recordings, service, endpoint, params)
+            answer = load_recording(path)
+            if answer is None and server.record:
+                answer = record(path, service, endpoint, params)
+        if answer is None:
+            answer = (200, *synthesize(params, server.size))
+        if server.latency:
+            time.sleep(server.latency)
+        self._send(*answer)
+        with server.lock:
+            server.stats[f"{service}/{endpoint}"] += 1
+            server.stats["requests"] += 1
+            server.stats["bytes"] += len(answer[2])
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), size=100, recordings=None, record=False, latency=0.0):
+        super().__init__(address, _Handler)
+        self.size = size
+        self.recordings = recordings
+        self.record = record
+        self.latency = latency
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def app_env(self):
+        """Environment pointing the app at this server."""
+        return {
+            "NOMINATIM_URLS": f"{self.url}/nominatim/search",
+            "OVERPASS_URLS": f"{self.url}/overpass/api/interpreter",
+            "EUTILS_URL": f"{self.url}/eutils",
+            "CT_API_URL": f"{self.url}/ct/api/v2/studies",
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.stats["connections"] += 1
+        self.reply("220 fixture ESMTP")
+        sender, recipients = None, []
+        for raw in self.rfile:
+            command = raw.decode("utf-8", errors="replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 fixture")
+            elif verb == "MAIL":
+                sender, recipients = command.partition(":")[2].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.partition(":")[2].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                with server.lock:
+                    server.messages.append({"from": sender, "to": recipients, "data": b"".join(lines)})
+                    server.stats["messages"] += 1
+                self.reply("250 OK queued")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Accepts every message; ``messages`` holds them as ``{"from", "to", "data"}``."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, _SMTPHandler)
+        self.messages = []
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def app_env(self):
+        host, port = self.server_address[:2]
+        return {"SMTP_HOST": host, "SMTP_PORT": str(port), "SMTP_STARTTLS": "0", "SMTP_USER": ""}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+
+def limits_env(size):
+    """App limits that let a search return ``size`` results."""
+    return {
+        "HOSPITAL_TOP_K": str(max(size, 200)),
+        "RESEARCH_MAX_RESULTS": str(max(size, 200)),
+        "CT_MAX_RESULTS": str(max(size, 1000)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("serve", "record", "smtp"))
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--size", type=int, default=100, help="results per synthetic search")
+    parser.add_argument("--recordings", default=os.path.join(ROOT, "bench", "recordings"))
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args(argv)
+
+    if args.command == "smtp":
+        sink = SMTPSink(("127.0.0.1", args.port))
+        for name, value in sink.app_env().items():
+            print(f"export {name}={value}", flush=True)
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(f"{sink.stats['messages']} messages over {sink.stats['connections']} connections")
+        return 0
+
+    server = FixtureServer(("127.0.0.1", args.port), args.size, args.recordings, args.command == "record",
+                           args.latency)
+    for name, value in {**server.app_env(), **limits_env(args.size)}.items():
+        print(f"export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""Concurrent-session load test of one Streamlit worker, against the fixture server.
+
+    python bench/load.py                              # 1, 2, 4, 8, 16, 32 sessions
+    python bench/load.py --sessions 8,64 --size 1000 --latency 0.2
+    python bench/load.py --same-query                 # every session searches for the same thing
+
+For each concurrency level a fresh ``streamlit run app.py`` (one worker, empty
+cache directory, upstreams pointed at a :class:`fixtures.FixtureServer`) is
+started, and that many sessions connect to it over the same websocket protocol
+the browser uses. Each session loads the page, then runs a hospital, research
+and trial search (``--steps``) by setting the section's inputs and pressing its
+button, one after another, like a user would. A step's latency is from sending
+the button press to the server reporting the run finished.
+
+By default every session searches for something different, so each one costs
+the worker real upstream calls and parsing; ``--same-query`` measures the
+opposite case, where request coalescing and the caches absorb the load.
+
+Reported per level: step latency percentiles, steps per second, requests the
+fixture server got, errors (script exceptions, ``st.error`` messages, timeouts)
+and the worker's resident memory. The worker's limit is the highest level whose
+p95 stays within ``--slo`` seconds without errors; levels stop at the first one
+over it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+
+try:
+    from websockets.asyncio.client import connect
+except ImportError:  # optional: only needed to run this benchmark
+    connect = None
+
+# Inputs and button of each step; ``{q}`` / ``{n}`` are filled in per session.
+STEPS = {
+    "hospitals": ({"Enter your city or ZIP code:": "Town {q}"}, "Find Hospitals"),
+    "research": ({"Enter your cancer type (e.g., Breast Cancer):": "Cancer {q}", "Number of articles:": "{n}"},
+                 "Get Latest Research"),
+    "trials": ({"Enter your cancer type (e.g., Lung Cancer):": "Cancer {q}", "Maximum number of trials:": "{n}"},
+               "Find Clinical Trials"),
+}
+_WIDGETS = ("button", "text_input", "number_input", "checkbox", "selectbox")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _memory_mb(pid):
+    """``(current, peak)`` resident memory of ``pid`` in MB, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None, None
+    return tuple(int(fields[k].split()[0]) / 1024 for k in ("VmRSS", "VmHWM"))
+
+
+class Worker:
+    """``streamlit run app.py`` on a free port, with its upstreams pointed at the fixture server."""
+
+    def __init__(self, fixture_server, size, timeout=60):
+        self.port = _free_port()
+        self._cache_dir = tempfile.TemporaryDirectory(prefix="bench-cache-")
+        env = dict(os.environ, CANCER_APP_CACHE_DIR=self._cache_dir.name, CACHE_WARMER="0", METRICS_PORT="0",
+                   **fixture_server.app_env(), **fixtures.limits_env(size))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "app.py"),
+             "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(self.port),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).status == 200:
+                    break
+            except OSError:
+                pass
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError(f"streamlit did not start:\n{self.process.stderr.read().decode()[-2000:]}")
+            time.sleep(0.2)
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def memory_mb(self):
+        return _memory_mb(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._cache_dir.cleanup()
+
+
+class Session:
+    """One browser tab: keeps the widgets it has been sent and their current values."""
+
+    def __init__(self, ws):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        self.ws = ws
+        self.widgets = {}   # label -> (kind, widget id, fragment id)
+        self.values = {}    # widget id -> WidgetState
+        self._finished = ForwardMsg.ScriptFinishedStatus
+
+    async def run(self, trigger=None, fragment_id="", timeout=60):
+        """Send a rerun (pressing ``trigger`` if given) and read up to its end; returns error messages."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        msg = BackMsg()
+        msg.rerun_script.widget_states.widgets.extend(self.values.values())
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=trigger, trigger_value=True))
+            msg.rerun_script.fragment_id = fragment_id
+        await self.ws.send(msg.SerializeToString())
+        return await asyncio.wait_for(self._read_run(), timeout)
+
+    async def _read_run(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        errors = []
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.ws.recv())
+            kind = msg.WhichOneof("type")
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._element(msg.delta.new_element, msg.delta.fragment_id, errors)
+            elif kind == "script_finished":
+                if msg.script_finished == self._finished.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                if msg.script_finished == self._finished.FINISHED_WITH_COMPILE_ERROR:
+                    errors.append("compile error")
+                return errors
+
+    def _element(self, element, fragment_id, errors):
+        kind = element.WhichOneof("type")
+        if kind in _WIDGETS:
+            widget = getattr(element, kind)
+            self.widgets[widget.label] = (kind, widget.id, fragment_id)
+        elif kind == "exception":
+            errors.append(f"{element.exception.type}: {element.exception.message}")
+        elif kind == "alert" and element.alert.format == element.alert.ERROR:
+            errors.append(element.alert.body)
+
+    def set(self, label, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        kind, widget_id, _ = self.widgets[label]
+        state = WidgetState(id=widget_id)
+        if kind == "number_input":
+            state.int_value = int(value)
+        else:
+            state.string_value = value
+        self.values[widget_id] = state
+
+    async def press(self, label, timeout):
+        _, widget_id, fragment_id = self.widgets[label]
+        return await self.run(widget_id, fragment_id, timeout)
+
+
+async def user(worker_url, number, steps, size, same_query, timeout, results):
+    """One session's page load and steps; appends ``(step, seconds, errors)`` to ``results``."""
+    q = "Springfield" if same_query else f"{number}"
+    async with connect(worker_url, subprotocols=["streamlit"], max_size=None, open_timeout=timeout) as ws:
+        session = Session(ws)
+        started = time.perf_counter()
+        errors = await session.run(timeout=timeout)
+        results.append(("load", time.perf_counter() - started, errors))
+        for step in steps:
+            inputs, button = STEPS[step]
+            for label, value in inputs.items():
+                session.set(label, value.format(q=q, n=size))
+            started = time.perf_counter()
+            try:
+                errors = await session.press(button, timeout)
+            except asyncio.TimeoutError:
+                errors = [f"timed out after {timeout:g}s"]
+            results.append((step, time.perf_counter() - started, errors))
+
+
+async def _level(worker_url, sessions, steps, size, same_query, timeout):
+    results = []
+    outcomes = await asyncio.gather(
+        *(user(worker_url, n, steps, size, same_query, timeout, results) for n in range(sessions)),
+        return_exceptions=True,
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            results.append(("session", 0.0, [f"{type(outcome).__name__}: {outcome}"]))
+    return results
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_level(fixture_server, sessions, steps, size, same_query, timeout):
+    """Start a worker, run ``sessions`` concurrent sessions against it and summarize."""
+    worker = Worker(fixture_server, size)
+    try:
+        idle_mb, _ = worker.memory_mb()
+        upstream = fixture_server.stats["requests"]
+        started = time.perf_counter()
+        results = asyncio.run(_level(worker.url, sessions, steps, size, same_query, timeout))
+        elapsed = time.perf_counter() - started
+        rss_mb, peak_mb = worker.memory_mb()
+        upstream = fixture_server.stats["requests"] - upstream
+    finally:
+        worker.stop()
+    latencies = [seconds for step, seconds, _ in results if step in STEPS]
+    errors = [e for _, _, errs in results for e in errs]
+    row = {
+        "sessions": sessions, "steps": len(latencies), "steps_per_s": round(len(latencies) / elapsed, 2),
+        "upstream": upstream, "errors": len(errors), "error_samples": sorted(set(errors))[:5],
+        "idle_mb": idle_mb, "rss_mb": rss_mb, "peak_mb": peak_mb,
+    }
+    for q in (50, 95, 99):
+        row[f"p{q}_s"] = _percentile(latencies, q)
+    row["by_step"] = {
+        step: round(statistics.median(s for name, s, _ in results if name == step), 3)
+        for step in ("load", *steps) if any(name == step for name, _, _ in results)
+    }
+    return row
+
+
+def _print_row(row):
+    def s(value):
+        return f"{value:7.2f}" if value is not None else f"{'-':>7}"
+
+    def mb(value):
+        return f"{value:7.0f}" if value is not None else f"{'-':>7}"
+
+    print(f"{row['sessions']:>8} {row['steps']:>6} {s(row['p50_s'])} {s(row['p95_s'])} {s(row['p99_s'])} "
+          f"{row['steps_per_s']:>8.2f} {row['upstream']:>8} {row['errors']:>6} {mb(row['rss_mb'])} {mb(row['peak_mb'])}   "
+          + "  ".join(f"{k} {v:.2f}" for k, v in row["by_step"].items()), flush=True)
+    for error in row["error_samples"]:
+        print(f"    error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,2,4,8,16,32", help="concurrency levels, comma-separated")
+    parser.add_argument("--steps", default=",".join(STEPS), help="searches each session runs, in order")
+    parser.add_argument("--size", type=int, default=100, help="results per search")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fixture server adds per response")
+    parser.add_argument("--recordings", default=None, help="replay recorded responses from this directory")
+    parser.add_argument("--same-query", action="store_true", help="every session runs the same searches")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 step latency (seconds) a level must meet")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a step counts as failed")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    args = parser.parse_args(argv)
+    if connect is None:
+        print("bench/load.py needs the websockets package (pip install websockets)", file=sys.stderr)
+        return 2
+    steps = [s for s in args.steps.split(",") if s]
+
+    server = fixtures.FixtureServer(size=args.size, recordings=args.recordings, latency=args.latency).start()
+    rows, limit = [], 0
+    if not args.json:
+        print(f"{'sessions':>8} {'steps':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'steps/s':>8} {'upstream':>8} {'errors':>6} "
+              f"{'RSS MB':>7} {'peak MB':>7}   median per step (s)")
+    try:
+        for sessions in (int(n) for n in args.sessions.split(",")):
+            row = run_level(server, sessions, steps, args.size, args.same_query, args.timeout)
+            rows.append(row)
+            if not args.json:
+                _print_row(row)
+            if row["errors"] or row["p95_s"] is None or row["p95_s"] > args.slo:
+                break
+            limit = sessions
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps({"rows": rows, "limit": limit, "slo_s": args.slo}, indent=2))
+    else:
+        print(f"single-worker limit at p95 <= {args.slo:g}s: {limit or 'below the lowest level'} sessions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
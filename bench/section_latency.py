@@ -0,0 +1,228 @@
+"""Per-section search latency, memory and payload sizes against the fixture server.
+
+    python bench/section_latency.py                                  # 10, 1000 and 10000 results
+    python bench/section_latency.py --sizes 10,1000 --save base.json
+    python bench/section_latency.py --baseline base.json             # exit 1 on a regression
+
+Each (section, size) runs in a fresh interpreter with an empty cache directory,
+pointed at a :class:`fixtures.FixtureServer` that answers every search with
+``size`` hospitals, articles or trials. The app is driven with ``AppTest``: the
+section's search button is pressed once cold (every upstream call goes to the
+fixture server) and then ``--repeat`` more times warm (served from the app's
+caches). Reported per run:
+
+* ``section_ms``: the section's root span (see ``metrics``), i.e. the time
+  spent in that fragment; ``run_ms`` is the whole script run around it;
+* ``results``: hospitals, articles or trials the section ended up with;
+* ``upstream`` / ``upstream_bytes``: requests and bytes the fixture server served;
+* ``payload_bytes``: serialized size of every element the run rendered (what
+  the browser would be sent, map HTML included);
+* ``rss_peak_mb`` / ``rss_growth_mb``: peak resident memory of the process,
+  and how much of it the search added on top of the first render.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+
+SIZES = (10, 1000, 10000)
+SECTIONS = ("hospitals", "research", "trials")
+# Cold runs within this many milliseconds of the baseline are never called a regression.
+SLACK_MS = 25
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _payload_bytes(node):
+    children = getattr(node, "children", None)
+    if children:
+        return sum(_payload_bytes(c) for c in children.values())
+    proto = getattr(node, "proto", None)
+    return proto.ByteSize() if proto is not None else 0
+
+
+def _search(at, section, size, query):
+    """Fill in ``section``'s inputs for a ``size``-result search and press its button."""
+    if section == "hospitals":
+        at.text_input[[w.label for w in at.text_input].index("Enter your city or ZIP code:")].set_value(query)
+        at.button[[b.label for b in at.button].index("Find Hospitals")].click()
+    elif section == "research":
+        at.text_input[[w.label for w in at.text_input].index("Enter your cancer type (e.g., Breast Cancer):")] \
+            .set_value(query)
+        at.number_input[[w.label for w in at.number_input].index("Number of articles:")].set_value(size)
+        at.button[[b.label for b in at.button].index("Get Latest Research")].click()
+    else:
+        at.text_input(key="ct_input").set_value(query)
+        at.number_input(key="ct_max").set_value(size)
+        at.button(key="ct_button").click()
+
+
+def _results(at, section):
+    state = at.session_state
+    try:
+        if section == "hospitals":
+            return len(state["hospital_results"]["df"])
+        if section == "research":
+            return len(state["research_articles"])
+        return len(state["trial_results"]["studies"])
+    except KeyError:
+        return 0
+
+
+def _run_section(section, size, repeat, timeout, fixture_url):
+    """Child process: one cold search and ``repeat`` warm ones; prints one JSON line per run."""
+    from urllib.request import urlopen
+
+    from streamlit.testing.v1 import AppTest
+
+    def served():
+        return json.load(urlopen(f"{fixture_url}/stats"))
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout).run()
+    rss_before = _rss_mb()
+    query = {"hospitals": "Springfield", "research": "Breast Cancer", "trials": "Lung Cancer"}[section]
+    for n in range(1 + repeat):
+        before = served()
+        _search(at, section, size, query)
+        started = time.perf_counter()
+        at.run()
+        run_ms = (time.perf_counter() - started) * 1000
+        after = served()
+        spans = at.session_state["trace_spans"][section]
+        print(json.dumps({
+            "section": section, "size": size, "cold": n == 0,
+            "section_ms": spans[0]["ms"], "run_ms": round(run_ms, 1),
+            "results": _results(at, section),
+            "upstream": after.get("requests", 0) - before.get("requests", 0),
+            "upstream_bytes": after.get("bytes", 0) - before.get("bytes", 0),
+            "payload_bytes": _payload_bytes(at._tree),
+            "rss_peak_mb": round(_rss_mb(), 1), "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+            "errors": [e.value for e in at.exception] + [e.value for e in at.error],
+        }), flush=True)
+
+
+def measure(server, section, size, repeat, timeout):
+    """Runs of one (section, size) in a fresh interpreter: the cold one first."""
+    server.size = size
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        env = dict(os.environ, CANCER_APP_CACHE_DIR=cache_dir, CACHE_WARMER="0", METRICS_PORT="0",
+                   **server.app_env(), **fixtures.limits_env(size))
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", section, "--sizes", str(size),
+             "--repeat", str(repeat), "--timeout", str(timeout), "--fixture-url", server.url],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+    runs = [json.loads(line) for line in out.stdout.splitlines() if line.startswith("{")]
+    if out.returncode or not runs:
+        raise RuntimeError(f"{section} at size {size} failed:\n{out.stderr[-2000:]}")
+    return runs
+
+
+def summarize(runs):
+    """One row per (section, size): the cold run, plus the median of the warm ones."""
+    cold = runs[0]
+    warm = runs[1:]
+    row = dict(cold)
+    row.pop("cold")
+    row["warm_section_ms"] = statistics.median(r["section_ms"] for r in warm) if warm else None
+    row["rss_peak_mb"] = max(r["rss_peak_mb"] for r in runs)
+    row["errors"] = sorted({e for r in runs for e in r["errors"]})
+    return row
+
+
+def regressions(rows, baseline, tolerance):
+    """Messages for rows more than ``tolerance`` times slower (or bigger) than ``baseline``."""
+    before = {(r["section"], r["size"]): r for r in baseline}
+    found = []
+    for row in rows:
+        old = before.get((row["section"], row["size"]))
+        if old is None:
+            continue
+        for field, slack in (("section_ms", SLACK_MS), ("warm_section_ms", SLACK_MS),
+                             ("payload_bytes", 0), ("upstream", 0)):
+            if row.get(field) is None or old.get(field) is None:
+                continue
+            if row[field] > old[field] * tolerance + slack:
+                found.append(f"{row['section']} x{row['size']}: {field} {old[field]:g} -> {row[field]:g}")
+        if row["results"] < old["results"]:
+            found.append(f"{row['section']} x{row['size']}: results {old['results']} -> {row['results']}")
+    return found
+
+
+def _print_table(rows):
+    print(f"{'section':<10} {'size':>6} {'results':>7} {'cold ms':>9} {'warm ms':>8} {'run ms':>9} "
+          f"{'upstream':>8} {'up KB':>8} {'payload KB':>10} {'peak MB':>8} {'+MB':>6}")
+    for r in rows:
+        warm = f"{r['warm_section_ms']:8.1f}" if r["warm_section_ms"] is not None else f"{'-':>8}"
+        print(f"{r['section']:<10} {r['size']:>6} {r['results']:>7} {r['section_ms']:>9.1f} {warm} "
+              f"{r['run_ms']:>9.1f} {r['upstream']:>8} {r['upstream_bytes'] / 1024:>8.0f} "
+              f"{r['payload_bytes'] / 1024:>10.0f} {r['rss_peak_mb']:>8.0f} {r['rss_growth_mb']:>6.0f}")
+        for error in r["errors"]:
+            print(f"    error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", default=",".join(SECTIONS))
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="results per search, comma-separated")
+    parser.add_argument("--repeat", type=int, default=3, help="warm searches after the cold one")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fixture server adds per response")
+    parser.add_argument("--recordings", default=None, help="replay recorded responses from this directory")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    parser.add_argument("--save", help="write the rows to this file (a baseline for later runs)")
+    parser.add_argument("--baseline", help="compare against rows saved with --save")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--child", choices=SECTIONS, help=argparse.SUPPRESS)
+    parser.add_argument("--fixture-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    if args.child:
+        _run_section(args.child, sizes[0], args.repeat, args.timeout, args.fixture_url)
+        return 0
+
+    server = fixtures.FixtureServer(recordings=args.recordings, latency=args.latency).start()
+    rows = []
+    try:
+        for section in args.sections.split(","):
+            for size in sizes:
+                rows.append(summarize(measure(server, section, size, args.repeat, args.timeout)))
+                if not args.json:
+                    print(f"  {section} x{size}: {rows[-1]['section_ms']:.0f} ms", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        _print_table(rows)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    status = 1 if any(r["errors"] for r in rows) else 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(rows, json.load(f), args.tolerance)
+        for message in found:
+            print(f"regression: {message}", file=sys.stderr)
+        status = status or (1 if found else 0)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Cold-start and rerun timings of the Streamlit script, measured with ``AppTest``.
+
+    python bench/startup.py                 # app.py in this checkout
+    python bench/startup.py --app old.py    # e.g. a copy from ``git show <rev>:app.py``
+
+* cold start: a fresh interpreter imports Streamlit, then runs the app once
+  (every module import and the first render), repeated ``--cold`` times;
+* full rerun: the whole script again in the same process (what any widget
+  outside a fragment triggers);
+* section rerun: each ``sections`` fragment run on its own, which is what a
+  widget inside that section costs once it reruns as a fragment.
+
+The cache warmer is switched off and no search button is pressed, so nothing
+here touches the network.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "folium", "streamlit_folium", "pyarrow")
+
+os.environ.setdefault("CACHE_WARMER", "0")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _first_run(app, timeout):
+    """Child process: time the imports and the first run of ``app``; prints one JSON line."""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    imported = time.perf_counter()
+    at = AppTest.from_file(app, default_timeout=timeout).run()
+    finished = time.perf_counter()
+    print(json.dumps({
+        "streamlit_import_s": imported - started,
+        "first_run_s": finished - imported,
+        "errors": [e.value for e in at.exception],
+        "heavy_modules": [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+
+def cold_start(app, repeat, timeout):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--first-run", "--app", app, "--timeout", str(timeout)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return runs
+
+
+def _timed_reruns(at, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def full_reruns(app, repeat, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app, default_timeout=timeout).run()
+    return _timed_reruns(at, repeat)
+
+
+def section_reruns(repeat, timeout):
+    """``{section: [seconds, ...]}`` for every fragment in ``sections.FRAGMENTS``."""
+    from streamlit.testing.v1 import AppTest
+
+    import sections
+
+    timings = {}
+    for name in sections.FRAGMENTS:
+        at = AppTest.from_string(
+            f"import sys\nsys.path.insert(0, {ROOT!r})\nimport sections\nsections.{name}()\n",
+            default_timeout=timeout,
+        ).run()
+        timings[name] = _timed_reruns(at, repeat)
+    return timings
+
+
+def _ms(values):
+    return f"median {statistics.median(values) * 1000:7.1f} ms   max {max(values) * 1000:7.1f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--cold", type=int, default=3, help="cold starts to measure")
+    parser.add_argument("--reruns", type=int, default=10, help="reruns to measure")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--first-run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    app = os.path.abspath(args.app)
+
+    if args.first_run:
+        _first_run(app, args.timeout)
+        return 0
+
+    runs = cold_start(app, args.cold, args.timeout)
+    for run in runs:
+        if run["errors"]:
+            print(f"script raised: {run['errors']}", file=sys.stderr)
+            return 1
+    print(f"cold start ({args.cold}x, {app})")
+    print(f"  import streamlit   {_ms([r['streamlit_import_s'] for r in runs])}")
+    print(f"  first run          {_ms([r['first_run_s'] for r in runs])}")
+    print(f"  heavy modules loaded by the first run: {', '.join(runs[-1]['heavy_modules']) or 'none'}")
+    print(f"full rerun ({args.reruns}x)   {_ms(full_reruns(app, args.reruns, args.timeout))}")
+    try:
+        timings = section_reruns(args.reruns, args.timeout)
+    except ImportError:
+        return 0  # a checkout from before the sections were split out
+    for name, times in timings.items():
+        print(f"  {name:<20} {_ms(times)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
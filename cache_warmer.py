@@ -0,0 +1,136 @@
+"""Background worker that keeps the default and most popular searches in cache.
+
+Each round geocodes and searches hospitals for ``WARM_LOCATIONS``, syncs PubMed
+for ``WARM_TERMS`` and fetches the default trial search, then does the same for
+the ``WARM_TOP_N`` most frequent research and trial queries in the query log
+(``QUERY_TIMINGS_PATH``) over the last ``WARM_LOG_WINDOW`` seconds. Everything
+goes through the same code paths (and shared cache, rate limits and request
+coalescing) as the page, so the first user after a deploy or an expiry gets a
+cached answer.
+
+The app starts it with :func:`start`; a file lock makes sure only one server
+process per host runs it. ``python cache_warmer.py`` runs a single round, e.g.
+from cron when the in-app worker is disabled (``CACHE_WARMER=0``).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import config
+import locks
+import metrics
+from geocoding import geocode, normalize_location
+from hospitals import find_hospitals
+from research import get_store, normalize_term
+from trials import iter_studies
+from trials_index import load_default_index as load_trials_index
+
+_LOG_TAIL_BYTES = 4 * 1024 * 1024
+
+# Outcome of the last round, for the debug view.
+LAST_ROUND = {}
+
+
+def popular_queries(section, n=config.WARM_TOP_N, window=config.WARM_LOG_WINDOW, path=config.QUERY_TIMINGS_PATH):
+    """The ``n`` most frequent successful queries of ``section`` in the recent query log."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - _LOG_TAIL_BYTES))
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    since = time.time() - window
+    counts = Counter()
+    for line in lines[1:] if len(lines) > 1 else lines:  # the first line may be cut off
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get("section") == section and entry.get("ts", 0) >= since and "error" not in entry:
+            counts[entry["query"]] += 1
+    return [query for query, _ in counts.most_common(n)]
+
+
+def _trial_query(query):
+    """"condition | location | phase | status" as logged by the trials section."""
+    parts = [p.strip() for p in query.split("|")] + ["", "All", "All"]
+    return parts[0], parts[1], parts[2] or "All", parts[3] or "All"
+
+
+def warm_once():
+    """One warming round. Returns ``{"ok": n, "failed": n, "seconds": s}``."""
+    started = time.monotonic()
+    result = {"ok": 0, "failed": 0}
+
+    def run(stage, fn, *args):
+        try:
+            with metrics.span(stage):
+                fn(*args)
+            result["ok"] += 1
+        except Exception:
+            result["failed"] += 1
+
+    trial_queries = [(term, location, "All", "All") for term in config.WARM_TERMS for location in config.WARM_LOCATIONS]
+    trial_queries += [_trial_query(q) for q in popular_queries("trials")]
+    terms = config.WARM_TERMS + popular_queries("research")
+    locations = config.WARM_LOCATIONS + [q[1] for q in trial_queries if q[1]]
+
+    for location in dict.fromkeys(normalize_location(x) for x in locations):
+        run("warm.hospitals", _warm_hospitals, location)
+    for term in dict.fromkeys(normalize_term(x) for x in terms):
+        run("warm.research", lambda t: get_store().sync(t, config.RESEARCH_DEFAULT_RESULTS, allow_stale=False), term)
+    if load_trials_index() is None:  # the offline index needs no warming
+        for query in dict.fromkeys(trial_queries):
+            run("warm.trials", _warm_trials, *query)
+
+    result["seconds"] = round(time.monotonic() - started, 1)
+    LAST_ROUND.clear()
+    LAST_ROUND.update(result, finished=time.time())
+    return result
+
+
+def _warm_hospitals(location):
+    coords = geocode(location)
+    if coords:
+        find_hospitals(*coords)
+
+
+def _warm_trials(condition, location, phase, status):
+    # Mirrors the page's default: distance search around the geocoded location.
+    coords = geocode(location) if location else None
+    near = (coords[0], coords[1], config.CT_SEARCH_RADIUS_KM) if coords else None
+    for _ in iter_studies(condition, None if near else location, phase, status=status, near=near):
+        pass
+
+
+def _loop():
+    lock = None
+    while True:
+        # Retried every round, so another process takes over if the warming one exits.
+        lock = lock or locks.hold("cache_warmer.lock")
+        if lock:
+            warm_once()
+        time.sleep(config.WARM_INTERVAL)
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def start():
+    """Start the warmer thread for this process (once; later calls do nothing)."""
+    global _thread
+    with _thread_lock:
+        if _thread is None and config.WARM_ENABLED:
+            _thread = threading.Thread(target=_loop, name="cache-warmer", daemon=True)
+            _thread.start()
+        return _thread
+
+
+if __name__ == "__main__":
+    print(warm_once())
+    sys.exit(0)
@@ -0,0 +1,156 @@
+import os
+
+# -------------------------------
+# Shared settings for the data layer. Everything can be overridden from the
+# environment so deployments (and local stand-in servers) don't need code edits.
+# -------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("CANCER_APP_CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+
+USER_AGENT = os.environ.get("CANCER_APP_USER_AGENT", "CancerSupportApp/1.0 (your_email@example.com)")
+
+
+def _url_list(name, default):
+    return [u.strip() for u in os.environ.get(name, default).split(",") if u.strip()]
+
+
+# HTTP: mirrors are tried in order; a hedged request goes to the next healthy one
+# once the first has been slower than the HEDGE_PERCENTILE of recent latencies.
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))                  # read timeout, seconds
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))                      # single-host services only
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.5))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))                 # keep-alive connections per host
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", 1.0))  # seconds, until enough samples
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.2))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 3))              # consecutive failures to open
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", 30))                 # seconds before a trial request
+
+
+def _rate_limits(spec, workers=1):
+    """"host=rate[:burst],..." -> {host: (requests per second, burst)}, rates split across ``workers``."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            host, _, value = item.partition("=")
+            rate, _, burst = value.partition(":")
+            limits[host.strip().lower()] = (float(rate) / workers, int(burst or 1))
+    return limits
+
+
+# Per-upstream token buckets shared by every session in the process. Requests
+# queue for a token; if the wait would exceed RATE_LIMIT_MAX_WAIT they are turned
+# away with a "busy, retry in N s" message instead. Hosts not listed are not limited.
+# The limits are per upstream client (IP), but buckets are per process: with N
+# server processes on one host, set RATE_LIMIT_WORKERS=N so each gets 1/N of the rate.
+RATE_LIMIT_WORKERS = max(1, int(os.environ.get("RATE_LIMIT_WORKERS", 1)))
+RATE_LIMITS = _rate_limits(os.environ.get("RATE_LIMITS", ",".join((
+    "nominatim.openstreetmap.org=1",
+    "overpass-api.de=1:2",
+    "overpass.kumi.systems=1:2",
+    # NCBI allows 3 requests/s per client, 10 with an API key.
+    f"eutils.ncbi.nlm.nih.gov={10 if os.environ.get('NCBI_API_KEY') else 3}",
+    "clinicaltrials.gov=0.8:5",
+))), RATE_LIMIT_WORKERS)
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 15))   # seconds
+
+# Shared cache for upstream lookups, used by every server process:
+# sqlite:///<path> (default), redis://host:port/db, or "none".
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", os.path.join(CACHE_DIR, "shared_cache.sqlite3"))
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "sqlite:///" + SHARED_CACHE_PATH)
+SHARED_CACHE_MAX_BYTES = int(os.environ.get("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+SHARED_CACHE_STALE_FOR = int(os.environ.get("SHARED_CACHE_STALE_FOR", 24 * 3600))  # served while refreshing
+
+# Geocoding
+NOMINATIM_URLS = _url_list("NOMINATIM_URLS", os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search"))
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(CACHE_DIR, "gazetteer"))  # offline ZIPs/places
+GEOCODE_LRU_SIZE = int(os.environ.get("GEOCODE_LRU_SIZE", 2048))
+GEOCODE_TTL = int(os.environ.get("GEOCODE_TTL", 30 * 24 * 3600))            # found locations
+GEOCODE_NEGATIVE_TTL = int(os.environ.get("GEOCODE_NEGATIVE_TTL", 24 * 3600))  # "Location not found"
+
+# Hospitals
+OVERPASS_URLS = _url_list("OVERPASS_URLS", os.environ.get(
+    "OVERPASS_URL", "https://overpass-api.de/api/interpreter,https://overpass.kumi.systems/api/interpreter"
+))
+HOSPITAL_INDEX_PATH = os.environ.get("HOSPITAL_INDEX_PATH", os.path.join(CACHE_DIR, "hospitals.npz"))
+HOSPITAL_SEARCH_RADIUS_KM = float(os.environ.get("HOSPITAL_SEARCH_RADIUS_KM", 50))
+HOSPITAL_TOP_K = int(os.environ.get("HOSPITAL_TOP_K", 200))
+HOSPITAL_PAGE_SIZE = int(os.environ.get("HOSPITAL_PAGE_SIZE", 25))
+HOSPITAL_DEDUPE_M = float(os.environ.get("HOSPITAL_DEDUPE_M", 150))  # node/way/relation copies closer than this merge
+HOSPITAL_MIN_RESULTS = int(os.environ.get("HOSPITAL_MIN_RESULTS", 20))       # adaptive search stops here
+HOSPITAL_START_RADIUS_KM = float(os.environ.get("HOSPITAL_START_RADIUS_KM", 3))
+HOSPITAL_RADIUS_GROWTH = float(os.environ.get("HOSPITAL_RADIUS_GROWTH", 2.5))
+OVERPASS_CACHE_TTL = int(os.environ.get("OVERPASS_CACHE_TTL", 24 * 3600))
+OVERPASS_STATS_PATH = os.environ.get("OVERPASS_STATS_PATH", os.path.join(CACHE_DIR, "overpass_stats.jsonl"))
+
+# Hospital map
+MAP_CLUSTER_THRESHOLD = int(os.environ.get("MAP_CLUSTER_THRESHOLD", 300))   # above this, cluster markers
+MAP_MAX_MARKERS = int(os.environ.get("MAP_MAX_MARKERS", 5000))             # above this, keep only the nearest
+MAP_MAX_HTML_BYTES = int(os.environ.get("MAP_MAX_HTML_BYTES", 1_500_000))
+MAP_RENDER_BUDGET_MS = float(os.environ.get("MAP_RENDER_BUDGET_MS", 500))
+MAP_VIEWPORT_MAX_MARKERS = int(os.environ.get("MAP_VIEWPORT_MAX_MARKERS", 400))
+MAP_DETAIL_ZOOM = int(os.environ.get("MAP_DETAIL_ZOOM", 12))  # from this zoom on, show individual hospitals
+
+# PubMed (NCBI E-utilities)
+EUTILS_URL = os.environ.get("EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY", "")   # raises NCBI's limit from 3 to 10 req/s
+NCBI_EMAIL = os.environ.get("NCBI_EMAIL", "")
+RESEARCH_DEFAULT_RESULTS = int(os.environ.get("RESEARCH_DEFAULT_RESULTS", 10))
+RESEARCH_MAX_RESULTS = int(os.environ.get("RESEARCH_MAX_RESULTS", 2000))
+EFETCH_BATCH_SIZE = int(os.environ.get("EFETCH_BATCH_SIZE", 200))
+RESEARCH_STORE_PATH = os.path.join(CACHE_DIR, "research.sqlite3")
+RESEARCH_FRESH_FOR = int(os.environ.get("RESEARCH_FRESH_FOR", 3600))  # seconds before a term is re-synced
+RESEARCH_STALE_FOR = int(os.environ.get("RESEARCH_STALE_FOR", 24 * 3600))  # then served while re-syncing
+PUBMED_CACHE_TTL = int(os.environ.get("PUBMED_CACHE_TTL", 30 * 24 * 3600))  # summaries and abstracts per PMID
+ESUMMARY_BATCH_SIZE = int(os.environ.get("ESUMMARY_BATCH_SIZE", 200))
+RESEARCH_INDEX_PATH = os.environ.get("RESEARCH_INDEX_PATH", os.path.join(CACHE_DIR, "research_index.npz"))
+RESEARCH_INDEX_SAVE_DELAY = float(os.environ.get("RESEARCH_INDEX_SAVE_DELAY", 5))  # batches additions into one write
+
+# "Stay Informed" email digests of new PubMed articles
+SUBSCRIPTIONS_PATH = os.environ.get("SUBSCRIPTIONS_PATH", os.path.join(CACHE_DIR, "subscriptions.sqlite3"))
+NOTIFY_INTERVAL = int(os.environ.get("NOTIFY_INTERVAL", 24 * 3600))          # seconds between rounds with --every
+NOTIFY_MAX_PER_TERM = int(os.environ.get("NOTIFY_MAX_PER_TERM", 50))         # newest new articles per term and round
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", 200))            # digests sent before recording delivery
+NOTIFY_SENT_RETENTION = int(os.environ.get("NOTIFY_SENT_RETENTION", 90 * 24 * 3600))  # sent PMIDs remembered
+NOTIFY_FROM = os.environ.get("NOTIFY_FROM", "Cancer Support App <noreply@localhost>")
+NOTIFY_APP_URL = os.environ.get("NOTIFY_APP_URL", "http://localhost:8501").rstrip("/")  # for confirm/unsubscribe links
+NOTIFY_CONFIRM_TTL = int(os.environ.get("NOTIFY_CONFIRM_TTL", 7 * 24 * 3600))  # unconfirmed sign-ups expire
+NOTIFY_CONFIRM_COOLDOWN = int(os.environ.get("NOTIFY_CONFIRM_COOLDOWN", 3600))  # before a confirmation is re-sent
+NOTIFY_CONFIRM_MAX = int(os.environ.get("NOTIFY_CONFIRM_MAX", 3))  # confirmations per address within the cooldown
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 25))
+SMTP_USER = os.environ.get("SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "0") not in ("0", "false", "no", "")
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 4))                    # connections sending in parallel
+SMTP_MAX_PER_CONNECTION = int(os.environ.get("SMTP_MAX_PER_CONNECTION", 100))  # then reconnect
+
+# Clinical trials
+CT_API_URL = os.environ.get("CT_API_URL", "https://clinicaltrials.gov/api/v2/studies")
+CT_PAGE_SIZE = int(os.environ.get("CT_PAGE_SIZE", 100))       # API maximum is 1000
+CT_DEFAULT_RESULTS = int(os.environ.get("CT_DEFAULT_RESULTS", 20))
+CT_MAX_RESULTS = int(os.environ.get("CT_MAX_RESULTS", 1000))
+CT_CACHE_TTL = int(os.environ.get("CT_CACHE_TTL", 6 * 3600))               # one cached page of API results
+CT_SEARCH_RADIUS_KM = float(os.environ.get("CT_SEARCH_RADIUS_KM", 80))
+TRIALS_INDEX_PATH = os.environ.get("TRIALS_INDEX_PATH", os.path.join(CACHE_DIR, "trials.sqlite"))
+
+# Streamlit result caches (per server process; keyed on normalized inputs)
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 15 * 60))
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", 256))
+
+# Background cache warmer (one process per host runs it)
+WARM_ENABLED = os.environ.get("CACHE_WARMER", "1") not in ("0", "false", "no", "")
+WARM_INTERVAL = int(os.environ.get("WARM_INTERVAL", 10 * 60))               # seconds between rounds
+WARM_TOP_N = int(os.environ.get("WARM_TOP_N", 10))                          # popular queries per section
+WARM_LOG_WINDOW = int(os.environ.get("WARM_LOG_WINDOW", 7 * 24 * 3600))     # how far back "popular" looks
+WARM_LOCATIONS = [s.strip() for s in os.environ.get("WARM_LOCATIONS", "New York").split(",") if s.strip()]
+WARM_TERMS = [s.strip() for s in os.environ.get("WARM_TERMS", "Breast Cancer,Lung Cancer").split(",") if s.strip()]
+
+# Metrics
+QUERY_TIMINGS_PATH = os.environ.get("QUERY_TIMINGS_PATH", os.path.join(CACHE_DIR, "query_timings.jsonl"))
+TRACES_PATH = os.environ.get("TRACES_PATH", os.path.join(CACHE_DIR, "traces.jsonl"))  # OTLP/JSON, one trace per line
+TRACES_MAX_BYTES = int(os.environ.get("TRACES_MAX_BYTES", 64 * 1024 * 1024))         # then rotated to .1
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))          # Prometheus /metrics endpoint; 0 = off
+DEBUG_PANEL = os.environ.get("DEBUG_PANEL", "0") not in ("0", "false", "no", "")  # 1 = sidebar spans with ?debug=1
@@ -0,0 +1,231 @@
+"""Offline geocoder for ZIP codes and place names, from a gazetteer file.
+
+Build it once from any mix of
+
+* US Census Gazetteer files (``2020_Gaz_zcta_national.txt``,
+  ``2020_Gaz_place_national.txt``; tab-separated with an ``INTPTLAT`` header),
+* GeoNames place dumps (``cities15000.txt``, ``US.txt``) and GeoNames postal
+  code dumps (``zip/US.txt``),
+
+    python gazetteer.py build 2020_Gaz_zcta_national.txt cities15000.txt -o .cache/gazetteer
+
+The result is a directory of ``.npy`` arrays that are memory-mapped on load:
+normalized lookup keys as one sorted fixed-width byte-string array, with
+coordinates, population and a display label per key. Exact lookups and prefix
+scans are ``np.searchsorted`` calls on that array (all typo variants of a
+prefix in a single call), so nothing is parsed or copied at start-up. Each
+place is stored under its bare name ("springfield") and with its state
+("springfield il"); ties on a bare name go to the most populous place.
+"""
+import argparse
+import csv
+import itertools
+import os
+import re
+import string
+import sys
+import threading
+
+import numpy as np
+
+import config
+from hospital_index import _pack_strings, _unpack_string
+
+_ZIP = re.compile(r"^(\d{5})(?:-\d{4})?$")
+_NON_WORD = re.compile(r"[^\w]+")
+# Census place names end with their legal/statistical area type.
+_LSAD = re.compile(r"\s+(city|town|village|borough|CDP|municipality|city and borough|urban county|"
+                   r"consolidated government|metropolitan government|unified government)(\s*\(.*\))?$", re.I)
+_ALPHABET = string.ascii_lowercase + string.digits + " "
+MAX_KEY_BYTES = 64
+_ARRAYS = ("keys", "lat", "lon", "population", "label_blob", "label_offsets")
+
+
+def normalize(text):
+    """Lookup key: casefolded words separated by single spaces; ZIP+4 becomes the 5-digit ZIP."""
+    text = (text or "").strip()
+    match = _ZIP.match(text)
+    if match:
+        return match.group(1)
+    return " ".join(_NON_WORD.sub(" ", text.casefold()).replace("_", " ").split())
+
+
+class Gazetteer:
+    def __init__(self, keys, lat, lon, population, label_blob, label_offsets):
+        self.keys = keys
+        self.lat = lat
+        self.lon = lon
+        self.population = population
+        self.label_blob = label_blob
+        self.label_offsets = label_offsets
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """``rows`` of ``(label, lat, lon, population, keys)``; every key points at its row."""
+        entries = []
+        for label, lat, lon, population, keys in rows:
+            for key in dict.fromkeys(keys):
+                if key:
+                    entries.append((key.encode("utf-8")[:MAX_KEY_BYTES], -int(population or 0), label, lat, lon))
+        entries.sort(key=lambda e: (e[0], e[1]))
+        width = max((len(e[0]) for e in entries), default=1)
+        label_blob, label_offsets = _pack_strings([e[2] for e in entries])
+        return cls(
+            np.array([e[0] for e in entries], dtype=f"S{width}"),
+            np.array([e[3] for e in entries], dtype=np.float32),
+            np.array([e[4] for e in entries], dtype=np.float32),
+            np.array([-e[1] for e in entries], dtype=np.int64),
+            label_blob, label_offsets,
+        )
+
+    def label(self, i):
+        return _unpack_string(self.label_blob, self.label_offsets, i)
+
+    def lookup(self, text):
+        """``(lat, lon)`` for an exact ZIP or place-name match (most populous on ties), else ``None``."""
+        target = normalize(text).encode("utf-8")[:MAX_KEY_BYTES]
+        if not target:
+            return None
+        i = int(np.searchsorted(self.keys, target))
+        if i < len(self) and self.keys[i] == target:
+            return float(self.lat[i]), float(self.lon[i])
+        return None
+
+    def _prefix_rows(self, prefixes, scan):
+        """Row numbers of keys starting with any of ``prefixes``, at most ``scan`` per prefix."""
+        prefixes = [p.encode("utf-8")[:MAX_KEY_BYTES] for p in prefixes]
+        starts = np.searchsorted(self.keys, np.array(prefixes, dtype=self.keys.dtype))
+        rows = []
+        for prefix, i in zip(prefixes, starts.tolist()):
+            end = min(i + scan, len(self))
+            while i < end and self.keys[i].startswith(prefix):
+                rows.append(i)
+                i += 1
+        return rows
+
+    def complete(self, text, k=5, scan=2000):
+        """Up to ``k`` labels of places whose key starts with ``text``, most populous first.
+
+        When fewer than ``k`` match, keys one edit away from the typed prefix (a
+        deleted, inserted, substituted or swapped character) are suggested after
+        them, so small typos still produce suggestions.
+        """
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        exact = sorted(self._prefix_rows([prefix], scan), key=lambda i: -self.population[i])
+        labels = list(dict.fromkeys(self.label(i) for i in exact))
+        if len(labels) < k:
+            near = sorted(set(self._prefix_rows(sorted(_edits(prefix)), k)), key=lambda i: -self.population[i])
+            labels = list(dict.fromkeys(labels + [self.label(i) for i in near]))
+        return labels[:k]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved gazetteer directory."""
+        return cls(**{name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in _ARRAYS})
+
+
+def _edits(word):
+    """Strings one edit away from ``word`` (deletion, transposition, substitution, insertion)."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    edits = {a + b[1:] for a, b in splits if b}
+    edits |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    edits |= {a + c + b[1:] for a, b in splits if b for c in _ALPHABET}
+    edits |= {a + c + b for a, b in splits for c in _ALPHABET}
+    edits.discard(word)
+    return {e.strip() for e in edits if e.strip()}
+
+
+# -------------------------------
+# Readers
+# -------------------------------
+def _place_keys(name, state, *aliases):
+    keys = [normalize(name)] + [normalize(a) for a in aliases]
+    if state:
+        keys += [f"{k} {state.casefold()}" for k in keys]
+    return keys
+
+
+def read_census(path):
+    """Rows from a Census Gazetteer file (ZCTA or places)."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        reader.fieldnames = [n.strip() for n in reader.fieldnames]
+        for row in reader:
+            lat, lon = float(row["INTPTLAT"]), float(row["INTPTLONG"])
+            if "NAME" in row:
+                name = _LSAD.sub("", row["NAME"].strip())
+                state = row.get("USPS", "").strip()
+                yield f"{name}, {state}" if state else name, lat, lon, 0, _place_keys(name, state)
+            else:
+                zip_code = row["GEOID"].strip()
+                yield f"ZIP {zip_code}", lat, lon, 0, [zip_code]
+
+
+def read_geonames(path):
+    """Rows from a GeoNames place dump (19 columns) or postal code dump (12 columns)."""
+    with open(path, encoding="utf-8", newline="") as f:
+        for cols in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if len(cols) >= 19:
+                if cols[6] != "P":  # populated places only
+                    continue
+                name, ascii_name, state = cols[1], cols[2], cols[10] if cols[8] == "US" else ""
+                label = f"{name}, {state}" if state else f"{name}, {cols[8]}"
+                yield label, float(cols[4]), float(cols[5]), int(cols[14] or 0), _place_keys(name, state, ascii_name)
+            elif len(cols) >= 11 and cols[9] and cols[10]:
+                zip_code, place, state = cols[1], cols[2], cols[4]
+                yield f"{zip_code} ({place}, {state})", float(cols[9]), float(cols[10]), 0, [normalize(zip_code)]
+
+
+def _reader_for(path):
+    with open(path, encoding="utf-8-sig") as f:
+        header = f.readline()
+    return read_census if "INTPTLAT" in header else read_geonames
+
+
+def build_gazetteer(paths):
+    return Gazetteer.from_rows(itertools.chain.from_iterable(_reader_for(p)(p) for p in paths))
+
+
+_loaded = {"mtime": None, "gazetteer": None}
+_load_lock = threading.Lock()
+
+
+def load_default_gazetteer():
+    """The gazetteer at ``config.GAZETTEER_PATH``, reloaded when it is rebuilt; ``None`` if absent."""
+    try:
+        mtime = os.path.getmtime(os.path.join(config.GAZETTEER_PATH, "keys.npy"))
+    except OSError:
+        return None
+    with _load_lock:
+        if _loaded["mtime"] != mtime:
+            _loaded["gazetteer"] = Gazetteer.load(config.GAZETTEER_PATH)
+            _loaded["mtime"] = mtime
+        return _loaded["gazetteer"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build a gazetteer from Census and/or GeoNames files")
+    build.add_argument("inputs", nargs="+")
+    build.add_argument("-o", "--output", default=config.GAZETTEER_PATH)
+    args = parser.parse_args(argv)
+
+    gazetteer = build_gazetteer(args.inputs)
+    gazetteer.save(args.output)
+    print(f"Indexed {len(gazetteer)} keys -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""Small vectorized geometry helpers shared by the hospital and trial-site searches."""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in km from one point to arrays of points, in one NumPy pass."""
+    lat1 = np.radians(lat)
+    lats2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lats2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lats2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing a circle; longitudes may exceed +/-180."""
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    coslat = max(np.cos(np.radians(lat)), 1e-6)
+    dlon = min(np.degrees(radius_km / (EARTH_RADIUS_KM * coslat)), 180.0)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
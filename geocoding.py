@@ -0,0 +1,137 @@
+"""Geocoding for the app: the offline gazetteer for ZIPs and known places, then a two-tier
+(memory LRU + shared cache) cache in front of Nominatim for everything else."""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import http_client
+import metrics
+import shared_cache
+from gazetteer import load_default_gazetteer
+
+_MISSING = object()
+
+
+def normalize_location(location):
+    """Canonical cache key for a free-text location ("  New  York, " -> "new york")."""
+    key = re.sub(r"\s+", " ", (location or "").casefold()).strip()
+    return key.strip(" ,.;")
+
+
+class GeocodeCache:
+    """LRU in memory, backed by the shared cache so every worker sees each lookup. Entries carry their own expiry.
+
+    A value of ``None`` is a negative entry ("Location not found") and is cached
+    like any other result, just with a shorter TTL.
+    """
+
+    def __init__(self, backend, maxsize=1024, ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached ``(lat, lon)``, ``None`` for a negative entry, or ``_MISSING``."""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._lru.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    metrics.annotate(cache="memory")
+                    return value
+                del self._lru[key]
+
+        entry = self.backend.get(shared_cache.make_key("geocode", key))
+        with self._lock:
+            if entry is not None:
+                value = tuple(entry["value"]) if entry["value"] is not None else None
+                self._remember(key, value, entry["expires"])
+                self.stats["shared_hits"] += 1
+                metrics.annotate(cache="hit")
+                return value
+            self.stats["misses"] += 1
+            metrics.annotate(cache="miss")
+            return _MISSING
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+        expires = time.time() + ttl
+        with self._lock:
+            self._remember(key, value, expires)
+        self.backend.set(shared_cache.make_key("geocode", key), {"value": value, "expires": expires}, ttl)
+
+    def purge_expired(self):
+        self.backend.purge_expired()
+
+    def _remember(self, key, value, expires):
+        self._lru[key] = (value, expires)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache instance, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeocodeCache(
+                shared_cache.get_cache(),
+                maxsize=config.GEOCODE_LRU_SIZE,
+                ttl=config.GEOCODE_TTL,
+                negative_ttl=config.GEOCODE_NEGATIVE_TTL,
+            )
+        return _cache
+
+
+def nominatim_lookup(location):
+    """Ask Nominatim for the first match. Returns ``(lat, lon)`` or ``None``."""
+    response = http_client.nominatim.get(params={"q": location, "format": "json", "limit": 1})
+    response.raise_for_status()
+    data = response.json()
+    if data and data[0].get("lat") and data[0].get("lon"):
+        return float(data[0]["lat"]), float(data[0]["lon"])
+    return None
+
+
+def geocode(location):
+    """Resolve a location string to ``(lat, lon)``, or ``None`` if it can't be found.
+
+    Network errors propagate and are never cached.
+    """
+    key = normalize_location(location)
+    if not key:
+        return None
+    with metrics.span("geocode") as span:
+        gazetteer = load_default_gazetteer()
+        if gazetteer is not None:
+            found = gazetteer.lookup(location)
+            if found is not None:
+                span.set(cache="gazetteer")
+                return found
+        cache = get_cache()
+        value = cache.get(key)
+        if value is not _MISSING:
+            return value
+
+        def lookup():
+            value = nominatim_lookup(location)
+            cache.set(key, value)
+            return value
+
+        # Sessions geocoding the same place at the same time share one Nominatim request.
+        return http_client.flights.do(("geocode", key), lookup)
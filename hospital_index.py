@@ -0,0 +1,316 @@
+"""Offline, array-backed spatial index of ``amenity=hospital`` points.
+
+Build it once from a local OSM extract (``.osm``, ``.osm.bz2``, ``.osm.gz``) or a
+GeoJSON file, then answer "hospitals within R km of (lat, lon)" without Overpass:
+
+    python hospital_index.py build north-america.osm.bz2 -o .cache/hospitals.npz
+
+Points are bucketed on a regular lat/lon grid and stored sorted by cell id, so a
+radius query is a handful of ``searchsorted`` slices plus one vectorized distance
+filter. The index remembers the bounding boxes of the data it was built from;
+queries outside them report no coverage so the caller can fall back to Overpass.
+"""
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import config
+from geo import bounding_box, haversine_km
+
+OSM_TYPES = ("node", "way", "relation")
+DEFAULT_CELL_DEG = 0.05  # ~5.5 km north-south
+
+
+def _pack_strings(values):
+    encoded = [(v or "").encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _unpack_string(blob, offsets, i):
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class HospitalIndex:
+    def __init__(self, lat, lon, osm_type, osm_id, names, specialities, coverage, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = float(cell_deg)
+        self.ncols = int(np.ceil(360.0 / self.cell_deg))
+        # Cells are computed from the stored float32 coordinates so a saved index
+        # reloads into exactly the same order.
+        lat = np.asarray(lat, dtype=np.float32)
+        lon = np.asarray(lon, dtype=np.float32)
+        cell = self._cell_ids(lat.astype(np.float64), lon.astype(np.float64))
+        order = np.argsort(cell, kind="stable")
+
+        self.lat = lat[order]
+        self.lon = lon[order]
+        self.cell = cell[order]
+        self.osm_type = np.asarray(osm_type, dtype=np.uint8)[order]
+        self.osm_id = np.asarray(osm_id, dtype=np.int64)[order]
+        if isinstance(names, tuple):
+            self._names, self._specs = names, specialities  # already packed and ordered
+        else:
+            self._names = _pack_strings([names[i] for i in order])
+            self._specs = _pack_strings([specialities[i] for i in order])
+        self.coverage = np.asarray(coverage, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _rows_cols(self, lat, lon):
+        rows = np.floor((np.asarray(lat) + 90.0) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.mod(np.asarray(lon) + 180.0, 360.0)) / self.cell_deg).astype(np.int64)
+        return rows, np.minimum(cols, self.ncols - 1)
+
+    def _cell_ids(self, lat, lon):
+        rows, cols = self._rows_cols(lat, lon)
+        return rows * self.ncols + cols
+
+    def covers(self, lat, lon, radius_km):
+        """True if the whole search circle lies inside the area this index was built from."""
+        if not len(self.coverage):
+            return False
+        min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius_km)
+        c = self.coverage
+        inside = (c[:, 0] <= min_lat) & (c[:, 1] <= min_lon) & (c[:, 2] >= max_lat) & (c[:, 3] >= max_lon)
+        return bool(inside.any())
+
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Positions of all points in grid cells overlapping a lat/lon box."""
+        min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0 - 1e-9)
+        (row0, row1), _ = self._rows_cols([min_lat, max_lat], [0.0, 0.0])
+        if max_lon - min_lon >= 360.0:
+            col_ranges = [(0, self.ncols - 1)]
+        else:
+            _, (col0, col1) = self._rows_cols([0.0, 0.0], [min_lon, max_lon])
+            col_ranges = [(col0, col1)] if col0 <= col1 else [(col0, self.ncols - 1), (0, col1)]
+
+        rows = np.arange(row0, row1 + 1, dtype=np.int64)
+        starts, stops = [], []
+        for col0, col1 in col_ranges:
+            starts.append(np.searchsorted(self.cell, rows * self.ncols + col0, side="left"))
+            stops.append(np.searchsorted(self.cell, rows * self.ncols + col1, side="right"))
+        starts, stops = np.concatenate(starts), np.concatenate(stops)
+        keep = stops > starts
+        if not keep.any():
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts[keep], stops[keep])])
+
+    def within(self, lat, lon, radius_km):
+        """``(positions, distances_km)`` of every hospital within ``radius_km``, unsorted."""
+        idx = self.candidates(*bounding_box(lat, lon, radius_km))
+        if not len(idx):
+            return idx, np.empty(0)
+        dist = haversine_km(lat, lon, self.lat[idx], self.lon[idx])
+        mask = dist <= radius_km
+        return idx[mask], dist[mask]
+
+    def name(self, i):
+        return _unpack_string(*self._names, i) or "Unnamed Hospital"
+
+    def speciality(self, i):
+        return _unpack_string(*self._specs, i)
+
+    def records(self, positions, distances=None):
+        """Hospital dicts (same shape as the Overpass path) for the given positions."""
+        out = []
+        for n, i in enumerate(positions):
+            rec = {
+                "Name": self.name(i),
+                "Latitude": float(self.lat[i]),
+                "Longitude": float(self.lon[i]),
+                "osm_type": OSM_TYPES[self.osm_type[i]],
+                "osm_id": int(self.osm_id[i]),
+                "speciality": self.speciality(i),
+            }
+            if distances is not None:
+                rec["Distance (km)"] = float(distances[n])
+            out.append(rec)
+        return out
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                lat=self.lat, lon=self.lon, osm_type=self.osm_type, osm_id=self.osm_id,
+                name_blob=self._names[0], name_offsets=self._names[1],
+                spec_blob=self._specs[0], spec_offsets=self._specs[1],
+                coverage=self.coverage, cell_deg=np.array(self.cell_deg),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["lat"], data["lon"], data["osm_type"], data["osm_id"],
+                (data["name_blob"], data["name_offsets"]),
+                (data["spec_blob"], data["spec_offsets"]),
+                data["coverage"], cell_deg=float(data["cell_deg"]),
+            )
+
+
+# -------------------------------
+# Ingestion
+# -------------------------------
+def _open(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _speciality(tags):
+    return tags.get("healthcare:speciality", "")
+
+
+def read_osm_xml(path):
+    """Yield ``(osm_type, osm_id, lat, lon, name, speciality)`` for hospitals in an OSM XML extract.
+
+    Also yields ``("bounds", ...)`` tuples for any ``<bounds>`` elements. Ways are
+    placed at the mean of their nodes; relations at the mean of member nodes and
+    the centres of member ways seen earlier in the file (OSM files list ways before
+    relations). The outer ways of a multipolygon hospital usually carry no tags, so
+    the centre of every way is kept, along with every node coordinate: use regional
+    extracts rather than the planet file.
+    """
+    nodes = {}
+    way_centers = {}
+    with _open(path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            tag = elem.tag
+            if tag == "bounds":
+                yield ("bounds", float(elem.get("minlat")), float(elem.get("minlon")),
+                       float(elem.get("maxlat")), float(elem.get("maxlon")))
+            elif tag in OSM_TYPES:
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                osm_id = int(elem.get("id"))
+                point = None
+                if tag == "node":
+                    point = (float(elem.get("lat")), float(elem.get("lon")))
+                    nodes[osm_id] = point
+                elif tag == "way":
+                    refs = [nodes[int(nd.get("ref"))] for nd in elem.iter("nd") if int(nd.get("ref")) in nodes]
+                    if refs:
+                        point = (sum(p[0] for p in refs) / len(refs), sum(p[1] for p in refs) / len(refs))
+                else:
+                    refs = []
+                    for m in elem.iter("member"):
+                        ref = int(m.get("ref"))
+                        if m.get("type") == "node" and ref in nodes:
+                            refs.append(nodes[ref])
+                        elif m.get("type") == "way" and ref in way_centers:
+                            refs.append(way_centers[ref])
+                    if refs:
+                        point = (sum(p[0] for p in refs) / len(refs), sum(p[1] for p in refs) / len(refs))
+                if point and tag == "way":
+                    way_centers[osm_id] = point
+                if point and tags.get("amenity") == "hospital":
+                    yield (tag, osm_id, point[0], point[1], tags.get("name", ""), _speciality(tags))
+                elem.clear()
+
+
+def _geometry_point(geometry):
+    if geometry["type"] == "Point":
+        lon, lat = geometry["coordinates"][:2]
+        return lat, lon
+    coords = np.asarray(
+        [c for c in _flatten_coords(geometry["coordinates"])], dtype=np.float64
+    )
+    if not len(coords):
+        return None
+    return float(coords[:, 1].mean()), float(coords[:, 0].mean())
+
+
+def _flatten_coords(coords):
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords[:2]
+        return
+    for c in coords:
+        yield from _flatten_coords(c)
+
+
+def read_geojson(path):
+    """Yield the same tuples as :func:`read_osm_xml` from a GeoJSON FeatureCollection."""
+    with _open(path) as f:
+        data = json.load(f)
+    if "bbox" in data:
+        min_lon, min_lat, max_lon, max_lat = data["bbox"][:4]
+        yield ("bounds", min_lat, min_lon, max_lat, max_lon)
+    for n, feature in enumerate(data.get("features", [])):
+        props = feature.get("properties") or {}
+        tags = props.get("tags", props)
+        if tags.get("amenity", "hospital") != "hospital" or not feature.get("geometry"):
+            continue
+        point = _geometry_point(feature["geometry"])
+        if point is None:
+            continue
+        osm_type, osm_id = "node", n
+        ident = str(feature.get("id") or props.get("@id") or "")
+        if "/" in ident:
+            kind, _, num = ident.partition("/")
+            if kind in OSM_TYPES and num.isdigit():
+                osm_type, osm_id = kind, int(num)
+        yield (osm_type, osm_id, point[0], point[1], tags.get("name", ""), _speciality(tags))
+
+
+def build_index(path, cell_deg=DEFAULT_CELL_DEG):
+    reader = read_geojson if ".geojson" in path or ".json" in path else read_osm_xml
+    lat, lon, types, ids, names, specs, coverage = [], [], [], [], [], [], []
+    for row in reader(path):
+        if row[0] == "bounds":
+            coverage.append(row[1:])
+            continue
+        osm_type, osm_id, la, lo, name, spec = row
+        types.append(OSM_TYPES.index(osm_type))
+        ids.append(osm_id)
+        lat.append(la)
+        lon.append(lo)
+        names.append(name)
+        specs.append(spec)
+    if not coverage and lat:
+        coverage.append((min(lat), min(lon), max(lat), max(lon)))
+    return HospitalIndex(lat, lon, types, ids, names, specs, coverage, cell_deg=cell_deg)
+
+
+_loaded = {"mtime": None, "index": None}
+
+
+def load_default_index():
+    """The index at ``config.HOSPITAL_INDEX_PATH``, reloaded when the file changes; ``None`` if absent."""
+    try:
+        mtime = os.path.getmtime(config.HOSPITAL_INDEX_PATH)
+    except OSError:
+        return None
+    if _loaded["mtime"] != mtime:
+        _loaded["index"] = HospitalIndex.load(config.HOSPITAL_INDEX_PATH)
+        _loaded["mtime"] = mtime
+    return _loaded["index"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build an index from an OSM XML or GeoJSON file")
+    build.add_argument("input")
+    build.add_argument("-o", "--output", default=config.HOSPITAL_INDEX_PATH)
+    build.add_argument("--cell-deg", type=float, default=DEFAULT_CELL_DEG)
+    args = parser.parse_args(argv)
+
+    index = build_index(args.input, cell_deg=args.cell_deg)
+    index.save(args.output)
+    print(f"Indexed {len(index)} hospitals ({len(index.coverage)} coverage boxes) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
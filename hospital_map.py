@@ -0,0 +1,216 @@
+"""Folium map for the hospital finder, built as one layer from columnar arrays.
+
+Small result sets become a single GeoJSON layer; larger ones a FastMarkerCluster,
+whose markers are created in the browser from a compact ``[lat, lon, name]`` array.
+Above ``MAP_MAX_MARKERS`` only the nearest hospitals are drawn, and if the rendered
+HTML still breaks the size or render-time budget the marker count is halved until
+it fits.
+
+The interactive mode instead draws only what is inside the current Leaflet
+viewport, aggregated to a level of detail that suits the zoom.
+"""
+import math
+import time
+from html import escape
+
+import folium
+import numpy as np
+from folium.plugins import FastMarkerCluster
+
+import config
+from hospital_index import OSM_TYPES
+from hospitals import dedupe_mask
+
+# Popup text is set with textContent so hospital names from OSM are never parsed as HTML.
+_CLUSTER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    var label = document.createElement('span');
+    label.textContent = row[2];
+    marker.bindPopup(label);
+    return marker;
+}
+"""
+
+
+def _geojson(lats, lons, names):
+    # GeojsonPopup inserts property values as HTML, so names are escaped here.
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(float(lo), 5), round(float(la), 5)]},
+                "properties": {"name": escape(str(name))},
+            }
+            for la, lo, name in zip(lats, lons, names)
+        ],
+    }
+
+
+def hospital_layer(lats, lons, names, mode):
+    """One folium layer holding every hospital marker."""
+    if mode == "cluster":
+        data = [[round(float(la), 5), round(float(lo), 5), str(name)] for la, lo, name in zip(lats, lons, names)]
+        return FastMarkerCluster(data, callback=_CLUSTER_CALLBACK, name="Hospitals")
+    return folium.GeoJson(
+        _geojson(lats, lons, names),
+        name="Hospitals",
+        marker=folium.CircleMarker(radius=6, color="#1f6feb", fill=True, fill_opacity=0.8),
+        popup=folium.GeoJsonPopup(fields=["name"], labels=False),
+    )
+
+
+def base_map(lat, lon, zoom_start=12):
+    m = folium.Map(location=[lat, lon], zoom_start=zoom_start)
+    folium.Marker(
+        [lat, lon],
+        popup="Your Location",
+        icon=folium.Icon(color='red', icon='home')
+    ).add_to(m)
+    return m
+
+
+def render_hospital_map(lat, lon, lats, lons, names, mode="auto"):
+    """Render the map to HTML within the configured budgets.
+
+    ``lats``/``lons``/``names`` are arrays sorted nearest first. Returns
+    ``(html, info)`` where ``info`` records the mode used, markers shown vs
+    available, payload bytes and render time.
+    """
+    total = len(lats)
+    shown = min(total, config.MAP_MAX_MARKERS)
+    while True:
+        layer_mode = mode if mode != "auto" else ("cluster" if shown > config.MAP_CLUSTER_THRESHOLD else "geojson")
+        start = time.perf_counter()
+        m = base_map(lat, lon)
+        hospital_layer(lats[:shown], lons[:shown], names[:shown], layer_mode).add_to(m)
+        html = folium.Figure().add_child(m).render()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        size = len(html.encode("utf-8"))
+        over_budget = size > config.MAP_MAX_HTML_BYTES or elapsed_ms > config.MAP_RENDER_BUDGET_MS
+        if not over_budget or shown <= config.MAP_CLUSTER_THRESHOLD:
+            break
+        shown //= 2
+    return html, {"mode": layer_mode, "shown": shown, "total": total, "bytes": size, "render_ms": elapsed_ms}
+
+
+# -------------------------------
+# Viewport-driven loading (interactive st_folium mode)
+# -------------------------------
+class ViewportSource:
+    """Columnar hospital points that can be queried by map bounds.
+
+    Backed either by the offline :class:`hospital_index.HospitalIndex` (any
+    viewport, independent of the search radius) or by the arrays of a finished
+    Overpass search. ``speciality`` limits index points the same way
+    ``hospitals.find_hospitals`` does, so the map matches the filtered list.
+    """
+
+    def __init__(self, lats=None, lons=None, names=None, index=None, speciality=None):
+        self.index = index
+        self.speciality = (speciality or "").casefold()
+        if index is None:
+            self.lats = np.asarray(lats, dtype=np.float64)
+            self.lons = np.asarray(lons, dtype=np.float64)
+            self.names = np.asarray(names, dtype=object)
+
+    @classmethod
+    def from_records(cls, hospitals):
+        return cls(
+            [h["Latitude"] for h in hospitals],
+            [h["Longitude"] for h in hospitals],
+            [h["Name"] for h in hospitals],
+        )
+
+    def in_bounds(self, south, west, north, east):
+        """``(ids, lats, lons, names)`` of the points inside a bounding box."""
+        if self.index is not None:
+            idx = self.index.candidates(south, west, north, east)
+            if self.speciality:
+                idx = idx[np.array([self.speciality in self.index.speciality(i).casefold() for i in idx], dtype=bool)]
+            lats = self.index.lat[idx].astype(np.float64)
+            lons = self.index.lon[idx].astype(np.float64)
+            inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+            idx, lats, lons = idx[inside], lats[inside], lons[inside]
+            names = np.array([self.index.name(i) for i in idx], dtype=object)
+            types = [OSM_TYPES[t] for t in self.index.osm_type[idx]]
+            keep = dedupe_mask(lats, lons, names, types)
+            return idx[keep], lats[keep], lons[keep], names[keep]
+        inside = (self.lats >= south) & (self.lats <= north) & (self.lons >= west) & (self.lons <= east)
+        ids = np.flatnonzero(inside)
+        return ids, self.lats[ids], self.lons[ids], self.names[ids]
+
+
+def estimate_bounds(lat, lon, zoom, width=700, height=500):
+    """Approximate Leaflet bounds before the browser has reported any."""
+    lon_span = width / 256.0 * 360.0 / 2 ** zoom
+    lat_span = lon_span * height / width * math.cos(math.radians(lat))
+    return lat - lat_span / 2, lon - lon_span / 2, lat + lat_span / 2, lon + lon_span / 2
+
+
+def level_of_detail(ids, lats, lons, names, zoom, max_markers=config.MAP_VIEWPORT_MAX_MARKERS):
+    """Markers to draw for one viewport as ``{key: (lat, lon, label, count)}``.
+
+    From ``MAP_DETAIL_ZOOM`` on (and whenever few enough points are visible) every
+    hospital is its own marker. Below that, points are aggregated into grid cells
+    of roughly 64 screen pixels, so the marker count stays bounded at any zoom.
+    """
+    if len(ids) <= max_markers and (zoom >= config.MAP_DETAIL_ZOOM or len(ids) <= max_markers // 4):
+        return {("p", int(i)): (float(la), float(lo), str(n), 1) for i, la, lo, n in zip(ids, lats, lons, names)}
+
+    cell_deg = 360.0 / 2 ** zoom / 4
+    while True:
+        rows = np.floor(lats / cell_deg).astype(np.int64)
+        cols = np.floor(lons / cell_deg).astype(np.int64)
+        cells, inverse, counts = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True, return_counts=True)
+        if len(cells) <= max_markers:
+            break
+        cell_deg *= 2
+    inverse = inverse.ravel()
+    lat_c = np.bincount(inverse, weights=lats) / counts
+    lon_c = np.bincount(inverse, weights=lons) / counts
+    first = np.empty(len(cells), dtype=np.int64)
+    first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+    markers = {}
+    for (row, col), la, lo, count, i in zip(cells, lat_c, lon_c, counts, first):
+        label = f"{count} hospitals" if count > 1 else str(names[i])
+        markers[("c", round(cell_deg, 8), int(row), int(col))] = (float(la), float(lo), label, int(count))
+    return markers
+
+
+def viewport_delta(loaded, visible):
+    """Keys to add and to drop when moving from the ``loaded`` marker set to ``visible``."""
+    loaded, visible = set(loaded), set(visible)
+    return visible - loaded, loaded - visible
+
+
+def viewport_layer(markers):
+    """A FeatureGroup for st_folium's ``feature_group_to_add`` holding the given markers."""
+    fg = folium.FeatureGroup(name="Hospitals in view")
+    for la, lo, label, count in markers.values():
+        if count > 1:
+            folium.CircleMarker(
+                [la, lo], radius=min(8 + 3 * math.log2(count), 30), color="#7928ca",
+                fill=True, fill_opacity=0.6, tooltip=label,
+            ).add_to(fg)
+        else:
+            folium.CircleMarker(
+                [la, lo], radius=6, color="#1f6feb", fill=True, fill_opacity=0.8,
+                popup=folium.Popup(escape(label)),
+            ).add_to(fg)
+    return fg
+
+
+def leaflet_bounds(bounds):
+    """``(south, west, north, east)`` from the bounds dict st_folium returns, or ``None`` if unknown."""
+    try:
+        sw, ne = bounds["_southWest"], bounds["_northEast"]
+        south, west, north, east = (round(float(v), 6) for v in (sw["lat"], sw["lng"], ne["lat"], ne["lng"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+    # Until the browser reports, st_folium echoes the bounds of the drawn layers,
+    # which for our single home marker is a zero-area box.
+    if south >= north or west == east:
+        return None
+    return south, west, north, east
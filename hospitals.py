@@ -0,0 +1,229 @@
+"""Hospital lookup: the offline spatial index when it covers the area, Overpass otherwise."""
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+
+import numpy as np
+
+import config
+import http_client
+import metrics
+import shared_cache
+from geo import EARTH_RADIUS_KM, haversine_km
+from hospital_index import load_default_index
+
+# Prefer the copy whose coordinates are an actual point over a way/relation centre.
+_TYPE_RANK = {"node": 0, "way": 1, "relation": 2}
+
+
+def overpass_query(lat, lon, radius_m, speciality=None):
+    """Overpass QL for hospitals around a point, trimmed to what we display.
+
+    Nodes are printed as-is (id, coordinates, tags). Ways and relations use
+    ``out tags center`` so their node and member lists, usually most of the
+    payload, are never sent. An optional ``healthcare:speciality`` filter is
+    applied server side.
+    """
+    filters = '["amenity"="hospital"]'
+    if speciality:
+        pattern = re.sub(r"[^\w :;-]", "", speciality)
+        filters += f'["healthcare:speciality"~"{pattern}",i]'
+    around = f"(around:{radius_m},{lat},{lon})"
+    return f"""
+    [out:json][timeout:10];
+    node{filters}{around};
+    out qt;
+    (
+      way{filters}{around};
+      relation{filters}{around};
+    );
+    out tags center qt;
+    """
+
+
+def parse_elements(elements):
+    """Turn Overpass elements into hospital dicts, skipping anything without coordinates."""
+    hospitals = []
+    for element in elements:
+        tags = element.get('tags', {})
+        center = element.get('center') or {}
+        lat_h = element.get('lat', center.get('lat'))
+        lon_h = element.get('lon', center.get('lon'))
+        if lat_h is not None and lon_h is not None:
+            hospitals.append({
+                "Name": tags.get('name', 'Unnamed Hospital'),
+                "Latitude": lat_h,
+                "Longitude": lon_h,
+                "osm_type": element.get('type', 'node'),
+                "osm_id": element.get('id'),
+                "speciality": tags.get('healthcare:speciality', ''),
+            })
+    return hospitals
+
+
+# Per-query Overpass statistics, newest last; also appended to OVERPASS_STATS_PATH.
+QUERY_STATS = deque(maxlen=500)
+
+
+def _record_stats(entry):
+    QUERY_STATS.append(entry)
+    try:
+        os.makedirs(os.path.dirname(config.OVERPASS_STATS_PATH) or ".", exist_ok=True)
+        with open(config.OVERPASS_STATS_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+
+def fetch_overpass(lat, lon, radius_km, speciality=None):
+    """Hospitals from Overpass within ``radius_km``; answered from the shared cache when possible."""
+    radius_m = int(radius_km * 1000)
+
+    def query():
+        start = time.perf_counter()
+        response = http_client.overpass.get(params={'data': overpass_query(lat, lon, radius_m, speciality)})
+        response.raise_for_status()
+        with metrics.span("overpass.parse"):
+            elements = response.json().get('elements', [])
+            hospitals = parse_elements(elements)
+        _record_stats({
+            "ts": time.time(), "radius_m": radius_m, "speciality": speciality or "",
+            "elements": len(elements), "bytes": len(response.content),
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+        return hospitals
+
+    # Coordinates rounded to ~10 m so repeated geocodes of one place share an entry.
+    parts = (round(lat, 4), round(lon, 4), radius_m, (speciality or "").casefold())
+    return shared_cache.cached("overpass", parts, config.OVERPASS_CACHE_TTL, query)
+
+
+def search_overpass_adaptive(lat, lon, min_results=config.HOSPITAL_MIN_RESULTS, speciality=None,
+                             start_km=config.HOSPITAL_START_RADIUS_KM,
+                             max_km=config.HOSPITAL_SEARCH_RADIUS_KM,
+                             growth=config.HOSPITAL_RADIUS_GROWTH):
+    """Query a small radius first and grow it geometrically until ``min_results`` hospitals are found.
+
+    Returns ``(hospitals, radius_km)`` for the last radius queried.
+    """
+    radius = min(start_km, max_km)
+    while True:
+        hospitals = fetch_overpass(lat, lon, radius, speciality)
+        distinct = int(dedupe_mask(
+            [h["Latitude"] for h in hospitals], [h["Longitude"] for h in hospitals],
+            [h["Name"] for h in hospitals], [h["osm_type"] for h in hospitals],
+        ).sum())
+        if distinct >= min_results or radius >= max_km:
+            return hospitals, radius
+        radius = min(radius * growth, max_km)
+
+
+def find_hospitals(lat, lon, speciality=None, min_results=config.HOSPITAL_MIN_RESULTS,
+                   max_radius_km=config.HOSPITAL_SEARCH_RADIUS_KM):
+    """Hospitals around a point. Returns ``(hospitals, source)`` with source "index" or "overpass".
+
+    The offline index answers the whole ``max_radius_km`` circle at once; the
+    Overpass fallback searches adaptively and stops once ``min_results`` are found.
+    """
+    index = load_default_index()
+    if index is not None and index.covers(lat, lon, max_radius_km):
+        with metrics.span("hospital_index.within"):
+            positions, distances = index.within(lat, lon, max_radius_km)
+            if speciality:
+                wanted = speciality.casefold()
+                keep = [n for n, i in enumerate(positions) if wanted in index.speciality(i).casefold()]
+                positions, distances = positions[keep], distances[keep]
+            return index.records(positions, distances), "index"
+    hospitals, _ = search_overpass_adaptive(lat, lon, min_results, speciality, max_km=max_radius_km)
+    return hospitals, "overpass"
+
+
+# -------------------------------
+# Ranking
+# -------------------------------
+def _name_key(name):
+    return re.sub(r"[^a-z0-9]+", " ", (name or "").casefold()).strip()
+
+
+_UNNAMED_KEY = _name_key("Unnamed Hospital")  # placeholder from parse_elements / HospitalIndex.name
+
+
+def _later_duplicates(keys, priority):
+    """True for rows whose key already appeared on a row with better (lower) priority."""
+    order = np.lexsort((priority,) + tuple(keys[:, j] for j in reversed(range(keys.shape[1]))))
+    sorted_keys = keys[order]
+    repeat = np.zeros(len(keys), dtype=bool)
+    repeat[1:] = (sorted_keys[1:] == sorted_keys[:-1]).all(axis=1)
+    out = np.zeros(len(keys), dtype=bool)
+    out[order] = repeat
+    return out
+
+
+def dedupe_mask(lats, lons, names, types, cell_m=config.HOSPITAL_DEDUPE_M):
+    """Boolean mask keeping one element per (spatial hash cell, normalized name).
+
+    OSM often maps the same hospital as a node plus a building way or a site
+    relation; their centres land within ~``cell_m`` of each other under the same
+    name. Hashing on two grids offset by half a cell catches copies that straddle
+    a cell edge. Nodes win over ways over relations. Unnamed hospitals have
+    nothing to match on, so they are never merged.
+    """
+    n = len(lats)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    cell_deg = math.degrees(cell_m / 1000.0 / EARTH_RADIUS_KM)
+    lats = np.asarray(lats, dtype=np.float64) / cell_deg
+    lons = np.asarray(lons, dtype=np.float64) / cell_deg
+    name_keys = np.array([_name_key(x) for x in names], dtype=object)
+    name_ids = np.unique(name_keys, return_inverse=True)[1].astype(np.int64)
+    unnamed = np.flatnonzero((name_keys == "") | (name_keys == _UNNAMED_KEY))
+    name_ids[unnamed] = n + np.arange(len(unnamed))  # a name of their own each
+    # Ties on type fall back to input order so the ranking is deterministic.
+    priority = np.array([_TYPE_RANK.get(t, 3) for t in types], dtype=np.int64) * n + np.arange(n)
+    dropped = np.zeros(n, dtype=bool)
+    for shift in (0.0, 0.5):
+        keys = np.stack([
+            np.floor(lats + shift).astype(np.int64),
+            np.floor(lons + shift).astype(np.int64),
+            name_ids,
+        ], axis=1)
+        dropped |= _later_duplicates(keys, priority)
+    return ~dropped
+
+
+def rank_hospitals(lat, lon, hospitals, k=config.HOSPITAL_TOP_K):
+    """Dedupe and return the ``k`` nearest hospitals, sorted, each with a "Distance (km)" field.
+
+    Also returns the number of distinct hospitals found before the top-k cut.
+    """
+    if not hospitals:
+        return [], 0
+    lats = np.fromiter((h["Latitude"] for h in hospitals), dtype=np.float64, count=len(hospitals))
+    lons = np.fromiter((h["Longitude"] for h in hospitals), dtype=np.float64, count=len(hospitals))
+    keep = np.flatnonzero(dedupe_mask(
+        lats, lons, [h["Name"] for h in hospitals], [h.get("osm_type", "node") for h in hospitals],
+    ))
+    dist = haversine_km(lat, lon, lats[keep], lons[keep])
+    total = len(keep)
+    if k < total:
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top], kind="stable")]
+    else:
+        top = np.argsort(dist, kind="stable")
+    ranked = []
+    for i in top:
+        rec = dict(hospitals[keep[i]])
+        rec["Distance (km)"] = round(float(dist[i]), 2)
+        ranked.append(rec)
+    return ranked, total
+
+
+def paginate(items, page, page_size=config.HOSPITAL_PAGE_SIZE):
+    """Slice for 1-based ``page`` plus the page count."""
+    pages = max(1, -(-len(items) // page_size))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], pages
@@ -0,0 +1,533 @@
+"""Shared HTTP layer for every external call the app makes.
+
+All requests go through one pooled ``requests.Session``, so Streamlit reruns
+reuse keep-alive connections instead of opening new TCP/TLS connections, and
+every call gets the same timeouts. Single-host services (PubMed,
+ClinicalTrials.gov) use :func:`get`, which retries connection errors and
+429/5xx answers with exponential backoff; every attempt, retries included, takes
+a rate-limit token. :func:`aget`/:func:`gather` run independent calls
+(e.g. the ESummary batches of one PubMed sync) concurrently, over HTTP/2 when
+``httpx`` and ``h2`` are installed.
+
+Services that have mirrors (Nominatim, Overpass) go through an
+:class:`EndpointGroup` instead. Each :class:`EndpointGroup` holds an ordered list of mirror URLs. A request goes
+to the first healthy mirror; if it hasn't answered by the time recent requests
+reached their ``HEDGE_PERCENTILE`` latency, a second (hedged) request goes to the
+next healthy mirror and whichever good answer arrives first wins. Mirrors that
+keep failing are skipped by a per-mirror circuit breaker until ``BREAKER_RESET``
+seconds have passed, then get a single trial request.
+
+Every upstream host can have a :class:`TokenBucket` (``RATE_LIMITS``) shared by
+all sessions in the process: requests queue for a token, and are turned away
+with :class:`RateLimited` once the queue is longer than ``RATE_LIMIT_MAX_WAIT``.
+Buckets are per process, so each one gets ``1 / RATE_LIMIT_WORKERS`` of the
+configured rate; set that to the number of server processes sharing an IP.
+:data:`flights` coalesces identical lookups that are in flight at the same
+time, so they cost one upstream call.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+
+try:
+    import httpx
+except ImportError:  # optional: enables HTTP/2 for the async path
+    httpx = None
+
+# Shared by every group; losing hedged requests simply finish in the background.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="http-hedge")
+
+
+def timeout_for(read_timeout=None):
+    return (config.HTTP_CONNECT_TIMEOUT, read_timeout or config.HTTP_TIMEOUT)
+
+
+def _make_session():
+    session = requests.Session()
+    session.headers["User-Agent"] = config.USER_AGENT
+    # No transport-level retries: get() retries itself, so each attempt goes through the rate limiter.
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=config.HTTP_POOL_SIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _make_session()
+        return _session
+
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _retry_delay(attempt, response=None):
+    """Seconds to wait before retrying, or ``None`` to hand ``response`` back as it is.
+
+    A ``Retry-After`` longer than ``RATE_LIMIT_MAX_WAIT`` isn't waited out in the
+    caller's (script) thread; the answer is returned instead.
+    """
+    if attempt >= config.HTTP_RETRIES:
+        return None
+    delay = config.HTTP_BACKOFF * 2 ** attempt
+    if response is None:
+        return delay
+    if response.status_code not in _RETRY_STATUSES:
+        return None
+    retry_after = (response.headers.get("Retry-After") or "").strip()
+    if retry_after.isdigit():
+        if int(retry_after) > config.RATE_LIMIT_MAX_WAIT:
+            return None
+        delay = max(delay, int(retry_after))
+    return delay
+
+
+def get(url, params=None, headers=None, timeout=None, stream=False):
+    """GET through the shared pool with the standard timeouts, retry policy and rate limit."""
+    with metrics.span(f"GET {urlsplit(url).hostname}") as span:
+        attempt = 0
+        while True:
+            acquire(url)
+            try:
+                response = get_session().get(url, params=params, headers=headers, timeout=timeout_for(timeout),
+                                             stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                delay = _retry_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = _retry_delay(attempt, response)
+                if delay is None:
+                    metrics.record_response(span, response)
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+# The httpx client is bound to one event loop, so each gather() call gets its own.
+_async_client = contextvars.ContextVar("http_async_client", default=None)
+
+
+def _new_async_client():
+    limits = httpx.Limits(max_connections=config.HTTP_POOL_SIZE * 4, max_keepalive_connections=config.HTTP_POOL_SIZE)
+    timeout = httpx.Timeout(config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+    headers = {"User-Agent": config.USER_AGENT}
+    try:
+        return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout, headers=headers)
+    except ImportError:  # httpx without the h2 extra
+        return httpx.AsyncClient(limits=limits, timeout=timeout, headers=headers)
+
+
+async def _aget(client, url, params, headers, timeout):
+    timeout = httpx.Timeout(timeout or config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+    attempt = 0
+    while True:
+        await asyncio.to_thread(acquire, url)  # every attempt, retries included, spends a token
+        try:
+            response = await client.get(url, params=params, headers=headers, timeout=timeout)
+        except httpx.TransportError:
+            delay = _retry_delay(attempt)
+            if delay is None:
+                raise
+        else:
+            delay = _retry_delay(attempt, response)
+            if delay is None:
+                return response
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def aget(url, params=None, headers=None, timeout=None):
+    """Async GET. Uses httpx (HTTP/2 if possible) when installed, else the pooled session in a thread.
+
+    Retries with the same backoff policy as :func:`get`.
+    """
+    if httpx is None:
+        return await asyncio.to_thread(get, url, params=params, headers=headers, timeout=timeout)
+    with metrics.span(f"GET {urlsplit(url).hostname}") as span:
+        client = _async_client.get()
+        if client is None:
+            async with _new_async_client() as client:
+                response = await _aget(client, url, params, headers, timeout)
+        else:
+            response = await _aget(client, url, params, headers, timeout)
+        metrics.record_response(span, response)
+        return response
+
+
+def gather(*coros):
+    """Run independent coroutines concurrently from synchronous (Streamlit) code.
+
+    Results come back in order; exceptions are returned in place, not raised.
+    """
+    async def _run():
+        if httpx is None:
+            return await asyncio.gather(*coros, return_exceptions=True)
+        async with _new_async_client() as client:
+            _async_client.set(client)
+            return await asyncio.gather(*coros, return_exceptions=True)
+
+    return asyncio.run(_run())
+
+
+class UpstreamError(Exception):
+    """Raised when every mirror of a group failed or was unavailable."""
+
+
+class RateLimited(UpstreamError):
+    """The upstream's request queue is full; ``retry_after`` is the current wait in seconds."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"{host} is busy right now, please try again in {max(1, round(retry_after))} s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` requests per second with bursts of up to ``burst``.
+
+    Tokens may go negative: each caller reserves the next free slot and sleeps
+    until it comes, so waiting callers are served in arrival order. A caller
+    whose slot is more than ``max_wait`` seconds away gets :class:`RateLimited`
+    instead of joining the queue.
+    """
+
+    def __init__(self, host, rate, burst=1, max_wait=config.RATE_LIMIT_MAX_WAIT):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.stats = {"granted": 0, "queued": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def _reserve(self, max_wait):
+        """Seconds until the reserved token is due, or raise if that is longer than ``max_wait``."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            if delay > max_wait:
+                self.stats["rejected"] += 1
+                raise RateLimited(self.host, delay)
+            self.tokens -= 1
+            self.stats["granted"] += 1
+            if delay:
+                self.stats["queued"] += 1
+            return delay
+
+    def acquire(self, max_wait=None):
+        """Block until a token is available (queueing behind earlier callers)."""
+        delay = self._reserve(self.max_wait if max_wait is None else max_wait)
+        if delay:
+            metrics.annotate(**{"ratelimit.wait_s": round(delay, 3)})
+            time.sleep(delay)
+
+    def try_acquire(self):
+        """Take a token only if one is free right now."""
+        try:
+            self._reserve(0.0)
+        except RateLimited:
+            return False
+        return True
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def limiter_for(url):
+    """The shared :class:`TokenBucket` for ``url``'s host, or ``None`` if the host isn't limited."""
+    host = (urlsplit(url).hostname or "").lower()
+    with _buckets_lock:
+        if host not in _buckets:
+            limit = config.RATE_LIMITS.get(host)
+            _buckets[host] = TokenBucket(host, *limit) if limit else None
+        return _buckets[host]
+
+
+def acquire(url):
+    limiter = limiter_for(url)
+    if limiter is not None:
+        limiter.acquire()
+
+
+def try_acquire(url):
+    limiter = limiter_for(url)
+    return limiter is None or limiter.try_acquire()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Run a call once per key at a time; concurrent callers with the same key share its result or error."""
+
+    def __init__(self):
+        self.stats = {"calls": 0, "shared": 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.stats["calls"] += 1
+                return flight, True
+            self.stats["shared"] += 1
+            return flight, False
+
+    def _land(self, key, flight):
+        with self._lock:
+            del self._flights[key]
+        flight.done.set()
+
+    def do(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            return flight.outcome()
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+
+    async def ado(self, key, fn):
+        """:meth:`do` for a coroutine function; shares flights with :meth:`do` callers in other threads."""
+        flight, leader = self._join(key)
+        if not leader:
+            await asyncio.to_thread(flight.done.wait)
+            return flight.outcome()
+        try:
+            flight.result = await fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+
+
+flights = SingleFlight()
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} from {response.url}")
+        self.response = response
+
+
+class CircuitBreaker:
+    """Closed -> open after ``max_failures`` consecutive failures -> half-open after ``reset_after`` s."""
+
+    def __init__(self, max_failures=config.BREAKER_FAILURES, reset_after=config.BREAKER_RESET):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """May a request be sent now? In half-open state only one trial at a time."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Hand back a trial slot taken by :meth:`allow` for a request that was never sent."""
+        with self._lock:
+            self._trial_running = False
+
+
+class LatencyTracker:
+    """Sliding window of successful request latencies (seconds)."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p, default):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return default
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class EndpointGroup:
+    def __init__(self, name, urls, timeout=config.HTTP_TIMEOUT, hedge_percentile=config.HEDGE_PERCENTILE):
+        self.name = name
+        self.urls = list(urls)
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.breakers = {url: CircuitBreaker() for url in self.urls}
+        self.latency = LatencyTracker()
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "short_circuited": 0}
+
+    def hedge_delay(self):
+        delay = self.latency.percentile(self.hedge_percentile, config.HEDGE_DEFAULT_DELAY)
+        return max(delay, config.HEDGE_MIN_DELAY)
+
+    def _send(self, url, params, headers, timeout):
+        """One request to one mirror; its outcome always updates that mirror's breaker."""
+        start = time.monotonic()
+        try:
+            response = get_session().get(url, params=params, headers=headers, timeout=timeout_for(timeout))
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableStatus(response)
+        except Exception:
+            self.breakers[url].record_failure()
+            self.stats["failures"] += 1
+            raise
+        self.breakers[url].record_success()
+        self.latency.add(time.monotonic() - start)
+        return response
+
+    def _next_mirror(self, tried):
+        """Next untried mirror whose breaker lets a request through, or ``None``."""
+        for url in self.urls:
+            if url in tried:
+                continue
+            tried.add(url)
+            if self.breakers[url].allow():
+                return url
+            self.stats["short_circuited"] += 1
+        return None
+
+    def get(self, params=None, headers=None, timeout=None):
+        """GET from the group, hedging across mirrors. Returns the first good ``requests.Response``.
+
+        4xx answers other than 429 are returned as-is (the caller's request is
+        wrong, another mirror won't help); timeouts, connection errors, 429 and
+        5xx count as mirror failures and move on to the next mirror.
+        """
+        with metrics.span(f"GET {self.name}") as span:
+            response = self._get(params, headers, timeout or self.timeout, span)
+            metrics.record_response(span, response)
+            return response
+
+    def _get(self, params, headers, timeout, span):
+        tried = set()
+        first = self._next_mirror(tried)
+        if first is None:
+            raise UpstreamError(f"{self.name}: all mirrors are temporarily disabled after repeated failures")
+        # Queue for the first mirror's rate limit; hedges and fallbacks only go out if a token is free.
+        try:
+            acquire(first)
+        except RateLimited:
+            self.breakers[first].release_trial()
+            raise
+        self.stats["requests"] += 1
+
+        pending = {}
+        errors = []
+        hedge_url = None
+
+        def launch(url):
+            pending[_executor.submit(self._send, url, params, headers, timeout)] = url
+
+        launch(first)
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = max(0.0, deadline - time.monotonic())
+            wait_for = min(self.hedge_delay(), remaining) if hedge_url is None else remaining
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_url is None and remaining > 0:
+                    hedge_url = self._next_mirror(tried) or ""
+                    if hedge_url and not try_acquire(hedge_url):
+                        self.breakers[hedge_url].release_trial()
+                        hedge_url = ""
+                    if hedge_url:
+                        self.stats["hedges"] += 1
+                        span.set(hedged=True)
+                        launch(hedge_url)
+                    continue
+                break
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    errors.append(f"{url}: {e}")
+                    if not pending:
+                        fallback = self._next_mirror(tried)
+                        if fallback and try_acquire(fallback):
+                            launch(fallback)
+                        elif fallback:
+                            self.breakers[fallback].release_trial()
+                    continue
+                if url == hedge_url:
+                    self.stats["hedge_wins"] += 1
+                return response
+        raise UpstreamError(f"{self.name}: no mirror answered in time ({'; '.join(errors) or 'timeout'})")
+
+
+nominatim = EndpointGroup("nominatim", config.NOMINATIM_URLS)
+overpass = EndpointGroup("overpass", config.OVERPASS_URLS)
@@ -0,0 +1,47 @@
+"""Advisory file locks shared by the server processes on one host.
+
+On platforms without ``fcntl`` (Windows) the locks are no-ops, so every
+process behaves as if it held them.
+"""
+import os
+from contextlib import contextmanager
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on ``path`` (created if missing) for the ``with`` block, waiting for it."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def hold(name):
+    """Take the per-host lock ``name`` (in ``CACHE_DIR``) without blocking.
+
+    Truthy (the open lock file, to keep for as long as the lock is wanted) if
+    this process holds it, ``None`` if another one does.
+    """
+    if fcntl is None:
+        return True
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    handle = open(os.path.join(config.CACHE_DIR, name), "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
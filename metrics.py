@@ -0,0 +1,409 @@
+"""Timing records for the result sections, and tracing spans for the stages behind them.
+
+:class:`ResultTimer` logs the time to first result per query (``QUERY_TIMINGS_PATH``).
+
+:func:`span` times one stage (a geocode, an upstream call, a JSON/XML parse, a
+DataFrame build, a map render) with attributes such as the upstream status
+code, payload bytes and cache hit/miss. A span opened inside another becomes
+its child. When the outermost span ends, its whole trace is appended to
+``TRACES_PATH`` as one OTLP/JSON line, the OpenTelemetry collector's file
+exporter format. Every finished span also goes into per-stage duration
+histograms, which are served in the Prometheus text format on
+``METRICS_PORT``.
+
+    python metrics.py summary       # p50/p95/p99 per stage, from TRACES_PATH
+    python metrics.py prometheus    # the same file as Prometheus text (textfile collector)
+
+Both commands read every process's spans, while the live endpoint covers only
+the process that serves it.
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Newest last; also appended to QUERY_TIMINGS_PATH as JSON lines.
+QUERY_TIMINGS = deque(maxlen=1000)
+_write_lock = threading.Lock()
+
+
+class ResultTimer:
+    """Times one streamed query: call :meth:`hit` for every result shown, then :meth:`finish`."""
+
+    def __init__(self, section, query):
+        self.section = section
+        self.query = query
+        self.started = time.perf_counter()
+        self.first_result = None
+        self.count = 0
+
+    def hit(self):
+        if self.first_result is None:
+            self.first_result = time.perf_counter() - self.started
+        self.count += 1
+
+    def finish(self, error=None):
+        entry = {
+            "ts": time.time(),
+            "section": self.section,
+            "query": self.query,
+            "results": self.count,
+            "first_result_ms": None if self.first_result is None else round(self.first_result * 1000, 1),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        QUERY_TIMINGS.append(entry)
+        try:
+            with _write_lock:
+                os.makedirs(os.path.dirname(config.QUERY_TIMINGS_PATH) or ".", exist_ok=True)
+                with open(config.QUERY_TIMINGS_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        except OSError:
+            pass
+        return entry
+
+
+# -------------------------------
+# Spans
+# -------------------------------
+# Attribute names follow the OpenTelemetry semantic conventions where there is one.
+STATUS_CODE = "http.response.status_code"
+BODY_SIZE = "http.response.body.size"
+SERVER = "server.address"
+CACHE = "cache"  # "hit", "miss" or "stale"; geocoding also reports "memory" and "gazetteer"
+
+_current_span = contextvars.ContextVar("metrics_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace = parent.trace if parent is not None else []  # finished spans of the whole trace
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.seconds = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.seconds * 1e9)
+        STAGES.observe(self.name, self.seconds, self.attributes, self.error)
+        self.trace.append(self)
+        if self.parent is None:
+            export_trace(self.trace)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as stage ``name``; yields the :class:`Span` so attributes can be added.
+
+    Don't hold one open across a ``yield``: the spans of whoever consumes the
+    generator would nest under it.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def record_response(current, response):
+    """Status code, payload size and host of a ``requests``/``httpx`` response on ``current``."""
+    current.set(**{STATUS_CODE: response.status_code, SERVER: _host(str(response.url))})
+    size = response.headers.get("Content-Length")
+    if getattr(response, "_content_consumed", True):  # a streamed body is left for the caller to read
+        size = len(response.content)
+    if size is not None:
+        current.set(**{BODY_SIZE: int(size)})
+
+
+def _host(url):
+    return url.split("://", 1)[-1].split("/", 1)[0]
+
+
+def _depth(s):
+    depth = 0
+    while s.parent is not None:
+        depth, s = depth + 1, s.parent
+    return depth
+
+
+def describe(trace):
+    """One row per span of a finished trace, in start order, stage names indented by depth."""
+    rows = []
+    for s in sorted(trace, key=lambda s: (s.start_ns, _depth(s))):
+        rows.append({
+            "stage": "· " * _depth(s) + s.name,
+            "ms": round(s.seconds * 1000, 1),
+            "status": s.attributes.get(STATUS_CODE),
+            "bytes": s.attributes.get(BODY_SIZE),
+            "cache": s.attributes.get(CACHE),
+            "error": s.error,
+        })
+    return rows
+
+
+# -------------------------------
+# Histograms
+# -------------------------------
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageStats:
+    """Per-stage duration histograms, quantiles over the last ``window`` spans, and outcome counters."""
+
+    def __init__(self, buckets=BUCKETS, window=1000):
+        self.buckets = buckets
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, attributes, error=None):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {
+                    "buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "errors": 0,
+                    "recent": deque(maxlen=self.window), "bytes": 0, "status": Counter(), "cache": Counter(),
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stage["buckets"][i] += 1
+                    break
+            stage["count"] += 1
+            stage["sum"] += seconds
+            stage["recent"].append(seconds)
+            stage["errors"] += error is not None
+            if STATUS_CODE in attributes:
+                stage["status"][str(attributes[STATUS_CODE])] += 1
+            if BODY_SIZE in attributes:
+                stage["bytes"] += int(attributes[BODY_SIZE])
+            if CACHE in attributes:
+                stage["cache"][str(attributes[CACHE])] += 1
+
+    def summary(self):
+        """``{stage: {count, errors, p50, p95, p99, bytes, status, cache}}`` with seconds for the quantiles."""
+        with self._lock:
+            out = {}
+            for name, stage in sorted(self._stages.items()):
+                recent = sorted(stage["recent"])
+                out[name] = {"count": stage["count"], "errors": stage["errors"], "bytes": stage["bytes"],
+                             "status": dict(stage["status"]), "cache": dict(stage["cache"])}
+                for q in QUANTILES:
+                    out[name][f"p{round(q * 100)}"] = recent[min(len(recent) - 1, int(q * len(recent)))]
+            return out
+
+    def prometheus_text(self, prefix="cancer_app"):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        with self._lock:
+            stages = sorted(self._stages.items())
+            family("stage_duration_seconds", "histogram", "Time spent in each stage.")
+            for name, stage in stages:
+                label = f'stage="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, stage["buckets"]):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{{label},le="+Inf"}} {stage["count"]}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{{label}}} {stage["sum"]:.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{{label}}} {stage["count"]}')
+            family("stage_recent_seconds", "summary", f"Stage duration quantiles over the last {self.window} spans.")
+            for name, stage in stages:
+                label = f'stage="{_escape(name)}"'
+                recent = sorted(stage["recent"])
+                for q in QUANTILES:
+                    value = recent[min(len(recent) - 1, int(q * len(recent)))]
+                    lines.append(f'{prefix}_stage_recent_seconds{{{label},quantile="{q:g}"}} {value:.6f}')
+                lines.append(f'{prefix}_stage_recent_seconds_sum{{{label}}} {sum(recent):.6f}')
+                lines.append(f'{prefix}_stage_recent_seconds_count{{{label}}} {len(recent)}')
+            family("stage_errors_total", "counter", "Stages that raised.")
+            for name, stage in stages:
+                lines.append(f'{prefix}_stage_errors_total{{stage="{_escape(name)}"}} {stage["errors"]}')
+            family("upstream_responses_total", "counter", "Upstream responses by HTTP status code.")
+            for name, stage in stages:
+                for code, count in sorted(stage["status"].items()):
+                    lines.append(f'{prefix}_upstream_responses_total{{stage="{_escape(name)}",code="{code}"}} {count}')
+            family("upstream_bytes_total", "counter", "Upstream response payload bytes.")
+            for name, stage in stages:
+                if stage["status"]:
+                    lines.append(f'{prefix}_upstream_bytes_total{{stage="{_escape(name)}"}} {stage["bytes"]}')
+            family("cache_lookups_total", "counter", "Cache lookups by result.")
+            for name, stage in stages:
+                for result, count in sorted(stage["cache"].items()):
+                    lines.append(f'{prefix}_cache_lookups_total{{stage="{_escape(name)}",result="{_escape(result)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Spans finished in this process.
+STAGES = StageStats()
+
+
+# -------------------------------
+# Export
+# -------------------------------
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(s):
+    """``s`` as an OTLP/JSON span."""
+    out = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 3 if STATUS_CODE in s.attributes else 1,  # CLIENT for upstream calls, else INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items() if v is not None],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent is not None:
+        out["parentSpanId"] = s.parent.span_id
+    return out
+
+
+def export_trace(spans, path=None):
+    """Append one finished trace to ``TRACES_PATH`` (rotated to ``.1`` past ``TRACES_MAX_BYTES``)."""
+    path = path or config.TRACES_PATH
+    line = json.dumps({"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": "cancer-support-app"}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "metrics"}, "spans": [otlp_span(s) for s in spans]}],
+    }]}, separators=(",", ":"))
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > config.TRACES_MAX_BYTES:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def read_traces(path=None):
+    """``StageStats`` over every span in a traces file (and its ``.1`` rotation)."""
+    path = path or config.TRACES_PATH
+    stats = StageStats(window=None)
+    for name in (path + ".1", path):
+        try:
+            f = open(name, encoding="utf-8")
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    resource_spans = json.loads(line)["resourceSpans"]
+                except (ValueError, KeyError):
+                    continue  # a line cut short by a crash
+                for rs in resource_spans:
+                    for scope in rs.get("scopeSpans", []):
+                        for s in scope.get("spans", []):
+                            attributes = {a["key"]: next(iter(a["value"].values())) for a in s.get("attributes", [])}
+                            seconds = (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e9
+                            error = s.get("status", {}).get("message") if s.get("status", {}).get("code") == 2 else None
+                            stats.observe(s["name"], seconds, attributes, error)
+    return stats
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = STAGES.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port=None):
+    """Serve ``/metrics`` on ``METRICS_PORT`` for this process (once; skipped if 0 or the port is taken)."""
+    global _server
+    port = config.METRICS_PORT if port is None else port
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+            except OSError:
+                return None  # another server process already exports on this port
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage timings from the traces file.")
+    parser.add_argument("command", choices=("summary", "prometheus"))
+    parser.add_argument("--traces", default=config.TRACES_PATH)
+    args = parser.parse_args(argv)
+
+    stats = read_traces(args.traces)
+    if args.command == "prometheus":
+        sys.stdout.write(stats.prometheus_text())
+        return 0
+    print(f"{'stage':<32} {'count':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  cache")
+    for name, row in stats.summary().items():
+        cache = " ".join(f"{k}={v}" for k, v in sorted(row["cache"].items()))
+        print(f"{name:<32} {row['count']:>7} {row['errors']:>6} {row['p50'] * 1000:>9.1f} "
+              f"{row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}  {cache}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,528 @@
+"""Email digests of new PubMed articles for the "Stay Informed" subscriptions.
+
+Subscribers sign up with an email address and a search term and are sent a
+confirmation link; only confirmed subscriptions get digests, and sign-ups left
+unconfirmed for ``NOTIFY_CONFIRM_TTL`` are dropped. Because the sign-up form is
+public, a confirmation is re-sent at most once per ``NOTIFY_CONFIRM_COOLDOWN``,
+an address gets at most ``NOTIFY_CONFIRM_MAX`` of them in that window, and they
+are sent from a background thread rather than the page's script run. A round
+(:func:`run_once`) polls PubMed once per *distinct* normalized term, not once
+per subscriber: one ESearch for records entered since the term was last polled
+(``mindate`` on the Entrez date), newest first, capped at
+``NOTIFY_MAX_PER_TERM``. The new PMIDs are diffed against what each subscriber
+of that term has already been sent; titles for all of them come from one
+batched (and shared-cached) ESummary pass; and each address gets a single
+digest covering all its terms. Digests go out ``NOTIFY_BATCH_SIZE`` at a time
+over :class:`SMTPPool`, which keeps up to ``SMTP_POOL_SIZE`` connections open
+and sends many messages on each.
+
+A PMID is recorded as sent only once its digest was accepted, and a term's
+poll cursor only moves forward when every digest for it went out, so a failed
+delivery is retried next round without anyone getting an article twice.
+
+    python notifications.py run                      # one round, e.g. from cron
+    python notifications.py run --every 86400        # or keep running
+    python notifications.py subscribe you@example.com "breast cancer"   # emails the confirmation link
+    python notifications.py confirm <token>
+    python notifications.py unsubscribe <token>
+    python notifications.py list
+
+Point ``SMTP_HOST`` / ``SMTP_PORT`` at a local stand-in (``python
+bench/fixtures.py smtp``) to try it without sending real mail.
+"""
+import argparse
+import os
+import queue
+import re
+import secrets
+import smtplib
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import config
+import locks
+import metrics
+from research import esearch, esummary, normalize_term
+
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Outcome of the last round, for the debug view.
+LAST_ROUND = {}
+
+
+def normalize_email(email):
+    email = (email or "").strip().casefold()
+    if not _EMAIL.match(email):
+        raise ValueError(f"not an email address: {email!r}")
+    return email
+
+
+# -------------------------------
+# Subscriptions
+# -------------------------------
+class SubscriptionStore:
+    """Subscribers, the poll cursor of each distinct term, and the PMIDs each subscriber was sent.
+
+    A subscription is pending (``confirmed`` is NULL) until its token comes back
+    through :meth:`confirm`; its term is only polled from then on.
+    """
+
+    def __init__(self, path=config.SUBSCRIPTIONS_PATH):
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS subscribers (
+                id INTEGER PRIMARY KEY, email TEXT, term TEXT, label TEXT, token TEXT UNIQUE, created REAL,
+                confirmed REAL, last_sent REAL, UNIQUE (email, term));
+            CREATE INDEX IF NOT EXISTS subscribers_term ON subscribers (term);
+            CREATE INDEX IF NOT EXISTS subscribers_email ON subscribers (email);
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, polled_since REAL);
+            CREATE TABLE IF NOT EXISTS sent (
+                subscriber INTEGER, pmid TEXT, sent REAL, PRIMARY KEY (subscriber, pmid));
+            CREATE INDEX IF NOT EXISTS sent_pmid ON sent (pmid);
+        """)
+        self._db.commit()
+
+    def subscribe(self, email, term):
+        """Add a pending subscription of ``email`` to ``term``.
+
+        Returns its token if a confirmation link should be mailed now (the
+        existing one if a sign-up is already pending), and records it as sent.
+        Returns ``None`` if ``email`` already has a confirmed subscription to
+        ``term``, or was sent a confirmation too recently (see the module docs).
+        """
+        email, key = normalize_email(email), normalize_term(term)
+        if not key:
+            raise ValueError("empty search term")
+        now = time.time()
+        with self._lock:
+            # An expired sign-up starts over with a new token.
+            self._db.execute(
+                "DELETE FROM subscribers WHERE email = ? AND term = ? AND confirmed IS NULL AND created < ?",
+                (email, key, now - config.NOTIFY_CONFIRM_TTL))
+            self._db.execute(
+                "INSERT OR IGNORE INTO subscribers (email, term, label, token, created) VALUES (?, ?, ?, ?, ?)",
+                (email, key, " ".join(term.split()), secrets.token_urlsafe(16), now),
+            )
+            token, confirmed, last_sent = self._db.execute(
+                "SELECT token, confirmed, last_sent FROM subscribers WHERE email = ? AND term = ?",
+                (email, key)).fetchone()
+            window = now - config.NOTIFY_CONFIRM_COOLDOWN
+            recent = self._db.execute("SELECT COUNT(*) FROM subscribers WHERE email = ? AND last_sent > ?",
+                                      (email, window)).fetchone()[0]
+            if confirmed or (last_sent or 0) > window or recent >= config.NOTIFY_CONFIRM_MAX:
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE subscribers SET last_sent = ? WHERE token = ?", (now, token))
+            self._db.commit()
+            return token
+
+    def confirmation_failed(self, token):
+        """Forget that a confirmation went out for ``token``, so the next sign-up sends it again."""
+        with self._lock:
+            self._db.execute("UPDATE subscribers SET last_sent = NULL WHERE token = ?", (token,))
+            self._db.commit()
+
+    def confirm(self, token):
+        """Activate the subscription with this token; ``True`` if there is one (pending and unexpired, or active)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT term, created, confirmed FROM subscribers WHERE token = ?",
+                                   (token,)).fetchone()
+            if row is None:
+                return False
+            term, created, confirmed = row
+            if confirmed:
+                return True
+            if created < now - config.NOTIFY_CONFIRM_TTL:
+                return False
+            self._db.execute("UPDATE subscribers SET confirmed = ? WHERE token = ?", (now, token))
+            # A new term starts from now: subscribers get what is published after they confirm.
+            self._db.execute("INSERT OR IGNORE INTO terms (term, polled_since) VALUES (?, ?)", (term, now))
+            self._db.commit()
+            return True
+
+    def unsubscribe(self, token):
+        """Remove the subscription with this token; ``True`` if there was one."""
+        with self._lock:
+            row = self._db.execute("SELECT id, term FROM subscribers WHERE token = ?", (token,)).fetchone()
+            if row is None:
+                return False
+            self._db.execute("DELETE FROM subscribers WHERE id = ?", (row[0],))
+            self._db.execute("DELETE FROM sent WHERE subscriber = ?", (row[0],))
+            self._db.execute(
+                "DELETE FROM terms WHERE term = ?"
+                " AND NOT EXISTS (SELECT 1 FROM subscribers WHERE term = ? AND confirmed IS NOT NULL)",
+                (row[1], row[1]))
+            self._db.commit()
+            return True
+
+    def subscribers_by_term(self):
+        """``{term: (polled_since, [subscriber, ...])}``; subscribers are dicts with id, email, label, token."""
+        grouped = {}
+        with self._lock:
+            for term, polled_since, sid, email, label, token in self._db.execute(
+                "SELECT t.term, t.polled_since, s.id, s.email, s.label, s.token FROM terms t"
+                " JOIN subscribers s ON s.term = t.term WHERE s.confirmed IS NOT NULL ORDER BY t.term, s.id"
+            ):
+                grouped.setdefault(term, (polled_since, []))[1].append(
+                    {"id": sid, "email": email, "term": term, "label": label, "token": token})
+        return grouped
+
+    def sent_pmids(self, subscriber_ids, pmids):
+        """``{subscriber id: set of pmids}``: which of ``pmids`` each subscriber was already sent."""
+        sent = {s: set() for s in subscriber_ids}
+        if not pmids:
+            return sent
+        with self._lock:
+            for start in range(0, len(pmids), 500):
+                chunk = pmids[start:start + 500]
+                for subscriber, pmid in self._db.execute(
+                    f"SELECT subscriber, pmid FROM sent WHERE pmid IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    if subscriber in sent:
+                        sent[subscriber].add(pmid)
+        return sent
+
+    def mark_sent(self, pairs):
+        """Record ``(subscriber id, pmid)`` pairs as delivered."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO sent (subscriber, pmid, sent) VALUES (?, ?, ?)",
+                                 [(s, p, now) for s, p in pairs])
+            self._db.commit()
+
+    def advance(self, cursors):
+        """Move each term's poll cursor: ``{term: timestamp}``."""
+        with self._lock:
+            self._db.executemany("UPDATE terms SET polled_since = ? WHERE term = ?",
+                                 [(since, term) for term, since in cursors.items()])
+            now = time.time()
+            self._db.execute("DELETE FROM sent WHERE sent < ?", (now - config.NOTIFY_SENT_RETENTION,))
+            self._db.execute("DELETE FROM subscribers WHERE confirmed IS NULL AND created < ?",
+                             (now - config.NOTIFY_CONFIRM_TTL,))
+            self._db.commit()
+
+    def counts(self):
+        with self._lock:
+            return {
+                "subscriptions": self._db.execute(
+                    "SELECT COUNT(*) FROM subscribers WHERE confirmed IS NOT NULL").fetchone()[0],
+                "pending": self._db.execute("SELECT COUNT(*) FROM subscribers WHERE confirmed IS NULL").fetchone()[0],
+                "addresses": self._db.execute(
+                    "SELECT COUNT(DISTINCT email) FROM subscribers WHERE confirmed IS NOT NULL").fetchone()[0],
+                "terms": self._db.execute("SELECT COUNT(*) FROM terms").fetchone()[0],
+            }
+
+
+_subscriptions = None
+_subscriptions_lock = threading.Lock()
+
+
+def get_subscriptions():
+    global _subscriptions
+    with _subscriptions_lock:
+        if _subscriptions is None:
+            _subscriptions = SubscriptionStore()
+        return _subscriptions
+
+
+# -------------------------------
+# Sending
+# -------------------------------
+class SMTPPool:
+    """Up to ``size`` SMTP connections, each reused for up to ``max_per_connection`` messages.
+
+    An idle connection the server has meanwhile dropped is replaced once,
+    transparently; any other error is the caller's.
+    """
+
+    def __init__(self, host=config.SMTP_HOST, port=config.SMTP_PORT, size=config.SMTP_POOL_SIZE,
+                 username=config.SMTP_USER, password=config.SMTP_PASSWORD, starttls=config.SMTP_STARTTLS,
+                 max_per_connection=config.SMTP_MAX_PER_CONNECTION, timeout=config.SMTP_TIMEOUT):
+        self.host, self.port, self.size = host, port, size
+        self.username, self.password, self.starttls = username, password, starttls
+        self.max_per_connection = max_per_connection
+        self.timeout = timeout
+        self.stats = {"connections": 0, "sent": 0, "failed": 0}
+        self._idle = queue.LifoQueue()   # (smtp, messages sent on it)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.stats["connections"] += 1
+        return smtp
+
+    def send(self, message):
+        with self._slots:
+            for attempt in range(2):
+                try:
+                    if attempt:
+                        raise queue.Empty  # the retry always gets a new connection
+                    smtp, used = self._idle.get_nowait()
+                    reused = True
+                except queue.Empty:
+                    smtp, used, reused = self._connect(), 0, False
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    smtp.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except smtplib.SMTPRecipientsRefused:
+                    self._idle.put((smtp, used))  # the connection itself is fine
+                    raise
+                except Exception:
+                    smtp.close()
+                    raise
+                if used + 1 >= self.max_per_connection:
+                    _quit(smtp)
+                else:
+                    self._idle.put((smtp, used + 1))
+                return
+
+    def send_many(self, messages):
+        """Send ``messages`` over up to ``size`` connections at once; returns one error (or ``None``) per message."""
+        def send(message):
+            try:
+                self.send(message)
+            except Exception as e:
+                with self._lock:
+                    self.stats["failed"] += 1
+                return e
+            with self._lock:
+                self.stats["sent"] += 1
+            return None
+
+        with metrics.span("smtp.send", messages=len(messages)):
+            with ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="smtp") as pool:
+                return list(pool.map(send, messages))
+
+    def close(self):
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _quit(smtp)
+
+
+def _quit(smtp):
+    try:
+        smtp.quit()
+    except Exception:
+        smtp.close()
+
+
+def compose(email, items, summaries):
+    """One digest for ``email``: ``items`` is ``[(subscriber, [pmid, ...]), ...]``, one per term."""
+    count = sum(len(pmids) for _, pmids in items)
+    labels = [subscriber["label"] for subscriber, _ in items]
+    lines = []
+    for subscriber, pmids in items:
+        lines.append(f'New on PubMed for "{subscriber["label"]}":\n')
+        for pmid in pmids:
+            record = summaries.get(pmid, {})
+            lines.append(f"- {record.get('title') or f'PMID {pmid}'}")
+            source = " · ".join(p for p in (record.get("journal"), record.get("pub_date")) if p)
+            if source:
+                lines.append(f"  {source}")
+            lines.append(f"  https://pubmed.ncbi.nlm.nih.gov/{pmid}/")
+        lines.append(f'\nStop emails for "{subscriber["label"]}": '
+                     f'{config.NOTIFY_APP_URL}/?unsubscribe={subscriber["token"]}\n')
+
+    message = EmailMessage()
+    message["From"] = config.NOTIFY_FROM
+    message["To"] = email
+    message["Subject"] = f"{count} new article{'s' if count != 1 else ''} on PubMed: {', '.join(labels)}"
+    if len(items) == 1:
+        message["List-Unsubscribe"] = f"<{config.NOTIFY_APP_URL}/?unsubscribe={items[0][0]['token']}>"
+    message.set_content("\n".join(lines))
+    return message
+
+
+def compose_confirmation(email, term, token):
+    """The email asking ``email`` to confirm its subscription to ``term``."""
+    label = " ".join(term.split())
+    message = EmailMessage()
+    message["From"] = config.NOTIFY_FROM
+    message["To"] = email
+    message["Subject"] = f'Confirm your PubMed alerts for "{label}"'
+    message.set_content(
+        f'Someone (hopefully you) asked for emails about new PubMed articles on "{label}".\n\n'
+        f"Confirm the subscription: {config.NOTIFY_APP_URL}/?confirm={token}\n\n"
+        "If it wasn't you, ignore this email: nothing will be sent without confirmation.\n"
+    )
+    return message
+
+
+# Confirmations are sent one at a time in the background, off the page's script run.
+_mailer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="confirm-mail")
+
+
+def _send_confirmation(subscriptions, message, token, pool):
+    own_pool = pool is None
+    pool = pool or SMTPPool(size=1)
+    try:
+        pool.send(message)
+    except Exception:
+        subscriptions.confirmation_failed(token)
+        raise
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def request_subscription(email, term, subscriptions=None, pool=None):
+    """Add a pending subscription and queue its confirmation email.
+
+    Returns the future of the send, or ``None`` if nothing is sent (already
+    active, or a confirmation went out too recently).
+    """
+    subscriptions = subscriptions or get_subscriptions()
+    token = subscriptions.subscribe(email, term)
+    if token is None:
+        return None
+    message = compose_confirmation(normalize_email(email), term, token)
+    return _mailer.submit(_send_confirmation, subscriptions, message, token, pool)
+
+
+# -------------------------------
+# Rounds
+# -------------------------------
+def poll_term(term, since, limit=config.NOTIFY_MAX_PER_TERM):
+    """PMIDs entered into PubMed for ``term`` since ``since`` (a timestamp, day precision), newest first."""
+    return esearch(term, retmax=limit, datetype="edat",
+                   mindate=time.strftime("%Y/%m/%d", time.gmtime(since)), maxdate="3000").get("idlist", [])
+
+
+def run_once(subscriptions=None, pool=None):
+    """One notification round. Returns counts of what was polled and sent."""
+    subscriptions = subscriptions or get_subscriptions()
+    own_pool = pool is None
+    pool = pool or SMTPPool()
+    result = {"terms": 0, "subscribers": 0, "digests": 0, "failed": 0, "poll_errors": 0, "articles": 0}
+    try:
+        with metrics.span("notify") as root:
+            by_term = subscriptions.subscribers_by_term()
+            polled, fresh = {}, defaultdict(list)   # term -> poll start; email -> [(subscriber, pmids)]
+            for term, (since, subscribers) in by_term.items():
+                started = time.time()
+                try:
+                    with metrics.span("notify.poll", subscribers=len(subscribers)):
+                        pmids = poll_term(term, since)
+                except Exception:
+                    result["poll_errors"] += 1
+                    continue
+                polled[term] = started
+                result["terms"] += 1
+                result["subscribers"] += len(subscribers)
+                sent = subscriptions.sent_pmids([s["id"] for s in subscribers], pmids)
+                for subscriber in subscribers:
+                    new = [p for p in pmids if p not in sent[subscriber["id"]]]
+                    if new:
+                        fresh[subscriber["email"]].append((subscriber, new))
+
+            wanted = list(dict.fromkeys(p for items in fresh.values() for _, pmids in items for p in pmids))
+            summaries = {}
+            if wanted:
+                try:
+                    summaries = {r["pmid"]: r for r in esummary(wanted)}
+                except Exception:
+                    pass  # digests still list the PMIDs and links
+            result["articles"] = len(wanted)
+
+            undelivered = set()
+            digests = list(fresh.items())
+            for start in range(0, len(digests), config.NOTIFY_BATCH_SIZE):
+                batch = digests[start:start + config.NOTIFY_BATCH_SIZE]
+                errors = pool.send_many([compose(email, items, summaries) for email, items in batch])
+                delivered = []
+                for (email, items), error in zip(batch, errors):
+                    if error is None:
+                        delivered += [(s["id"], p) for s, pmids in items for p in pmids]
+                        result["digests"] += 1
+                    else:
+                        undelivered.update(s["term"] for s, _ in items)
+                        result["failed"] += 1
+                subscriptions.mark_sent(delivered)
+            subscriptions.advance({t: s for t, s in polled.items() if t not in undelivered})
+            root.set(**result)
+    finally:
+        if own_pool:
+            pool.close()
+    LAST_ROUND.clear()
+    LAST_ROUND.update(result, finished=time.time())
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="poll PubMed and send digests")
+    run.add_argument("--every", type=float, nargs="?", const=config.NOTIFY_INTERVAL,
+                     help="keep running, one round every this many seconds")
+    add = sub.add_parser("subscribe")
+    add.add_argument("email")
+    add.add_argument("term")
+    confirm = sub.add_parser("confirm")
+    confirm.add_argument("token")
+    remove = sub.add_parser("unsubscribe")
+    remove.add_argument("token")
+    sub.add_parser("list", help="count active and pending subscriptions, addresses and distinct terms")
+    args = parser.parse_args(argv)
+
+    subscriptions = get_subscriptions()
+    if args.command == "subscribe":
+        sending = request_subscription(args.email, args.term, subscriptions)
+        if sending is None:
+            print("already subscribed, or a confirmation was sent recently", file=sys.stderr)
+            return 1
+        sending.result()
+    elif args.command == "confirm":
+        if not subscriptions.confirm(args.token):
+            print("no such pending subscription, or it expired", file=sys.stderr)
+            return 1
+    elif args.command == "unsubscribe":
+        if not subscriptions.unsubscribe(args.token):
+            print("no such subscription", file=sys.stderr)
+            return 1
+    elif args.command == "list":
+        print(subscriptions.counts())
+    else:
+        # One process per host sends, so overlapping cron runs can't double up digests.
+        lock = locks.hold("notifications.lock")
+        while True:
+            lock = lock or locks.hold("notifications.lock")
+            if lock:
+                print(run_once(subscriptions), flush=True)
+            elif not args.every:
+                print("another round is running", file=sys.stderr)
+                return 1
+            if not args.every:
+                return 0
+            time.sleep(args.every)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
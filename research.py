@@ -0,0 +1,369 @@
+"""PubMed search for the Latest Research section.
+
+:class:`ResearchStore` keeps the results per search term in SQLite and, once a
+term has been synced, only asks NCBI for records added since the last sync. Its
+list view uses the lightweight ESummary endpoint: one ESearch returns the PMIDs
+(up to ``RESEARCH_MAX_RESULTS``), and only ``ESUMMARY_BATCH_SIZE`` records are
+fetched and held at a time, so long lists need no history-server paging. Full
+abstracts are loaded on demand with EFetch, parsed incrementally while each batch downloads and
+discarded as soon as each article has been read, so memory stays flat no matter
+how many abstracts are requested.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import config
+import http_client
+import metrics
+import shared_cache
+from research_index import index_articles
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PubMedError(Exception):
+    pass
+
+
+def _params(**params):
+    params["db"] = "pubmed"
+    params["tool"] = "CancerSupportApp"
+    if config.NCBI_EMAIL:
+        params["email"] = config.NCBI_EMAIL
+    if config.NCBI_API_KEY:
+        params["api_key"] = config.NCBI_API_KEY
+    return params
+
+
+def esearch(term, retmax=config.RESEARCH_DEFAULT_RESULTS, **extra):
+    """Run ESearch. Returns the ``esearchresult`` dict (count, idlist)."""
+    params = _params(term=term, retmax=retmax, sort="pub date", retmode="json", **extra)
+    with metrics.span("pubmed.esearch"):
+        response = http_client.get(f"{config.EUTILS_URL}/esearch.fcgi", params=params)
+        response.raise_for_status()
+        result = response.json().get("esearchresult", {})
+    if "ERROR" in result:
+        raise PubMedError(result["ERROR"])
+    return result
+
+
+def _text(elem, path, default=""):
+    found = elem.find(path)
+    if found is None:
+        return default
+    return "".join(found.itertext()).strip() or default
+
+
+_MONTHS = {m: n for n, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+
+
+def sort_date(pub_date):
+    """"2024 Jan 5" / "2023 Nov-Dec" -> "2024-01-05" / "2023-11-00", for ordering."""
+    parts = re.findall(r"[A-Za-z]+|\d+", pub_date or "")
+    year = next((p for p in parts if len(p) == 4 and p.isdigit()), "0000")
+    rest = parts[parts.index(year) + 1:] if year in parts else []
+    month = day = 0
+    if rest:
+        month = _MONTHS.get(rest[0][:3].lower(), int(rest[0]) if rest[0].isdigit() else 0)
+        if len(rest) > 1 and rest[1].isdigit():
+            day = int(rest[1])
+    return f"{year}-{month:02d}-{day:02d}"
+
+
+def abstract_record(article):
+    """``{"pmid", "abstract"}`` from one ``<PubmedArticle>``; labelled sections keep their labels."""
+    sections = []
+    for part in article.iterfind("MedlineCitation/Article/Abstract/AbstractText"):
+        text = "".join(part.itertext()).strip()
+        label = part.get("Label")
+        sections.append(f"**{label.title()}:** {text}" if label and text else text)
+    return {"pmid": _text(article, "MedlineCitation/PMID"), "abstract": "\n\n".join(s for s in sections if s)}
+
+
+def parse_articles(chunks, record):
+    """Yield ``record(article)`` for an iterable of EFetch XML byte chunks, as they arrive."""
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "PubmedArticle":
+                yield record(elem)
+                root.clear()  # drop everything parsed so far
+    parser.close()
+
+
+def iter_efetch_ids(pmids, batch_size=config.EFETCH_BATCH_SIZE, record=abstract_record):
+    """Stream ``record`` dicts for explicit PMIDs, ``batch_size`` per request."""
+    for start in range(0, len(pmids), batch_size):
+        params = _params(id=",".join(pmids[start:start + batch_size]), retmode="xml", rettype="abstract")
+        with http_client.get(f"{config.EUTILS_URL}/efetch.fcgi", params=params, stream=True) as response:
+            response.raise_for_status()
+            yield from parse_articles(response.iter_content(CHUNK_SIZE), record)
+
+
+def esummary(pmids, batch_size=config.ESUMMARY_BATCH_SIZE):
+    """Title, journal and date for each PMID from the lightweight ESummary endpoint, in input order.
+
+    Summaries already in the shared cache are not requested again; the rest are
+    fetched ``batch_size`` at a time, all batches at once.
+    """
+    with metrics.span("pubmed.esummary") as span:
+        cache = shared_cache.get_cache()
+        found = cache.get_many(shared_cache.make_key("pubmed-summary", p) for p in pmids)
+        known = {r["pmid"]: r for r in found.values()}
+        missing = [p for p in pmids if p not in known]
+        span.set(cache="miss" if missing else "hit", requested=len(pmids), missing=len(missing))
+        # Sessions syncing the same term at once request the same batches; they share one call.
+        batches = [tuple(missing[start:start + batch_size]) for start in range(0, len(missing), batch_size)]
+        results = http_client.gather(*(
+            http_client.flights.ado(("esummary", batch), lambda batch=batch: _esummary_batch(batch))
+            for batch in batches
+        )) if batches else []
+        for fetched in results:
+            if isinstance(fetched, BaseException):
+                raise fetched
+            known.update((r["pmid"], r) for r in fetched)
+        return [known[p] for p in pmids if p in known]
+
+
+async def _esummary_batch(batch):
+    response = await http_client.aget(f"{config.EUTILS_URL}/esummary.fcgi",
+                                      params=_params(id=",".join(batch), retmode="json"))
+    response.raise_for_status()
+    result = response.json().get("result", {})
+    fetched = []
+    for pmid in batch:
+        doc = result.get(pmid)
+        if not doc or "error" in doc:
+            continue
+        fetched.append({
+            "pmid": pmid,
+            "title": doc.get("title") or "No Title",
+            "journal": doc.get("fulljournalname") or doc.get("source", ""),
+            "pub_date": doc.get("pubdate", ""),
+            "sort_date": (doc.get("sortpubdate") or "")[:10].replace("/", "-"),
+        })
+    shared_cache.get_cache().set_many(
+        ((shared_cache.make_key("pubmed-summary", r["pmid"]), r) for r in fetched), config.PUBMED_CACHE_TTL)
+    return fetched
+
+
+# -------------------------------
+# Per-term result store with delta refresh
+# -------------------------------
+def normalize_term(term):
+    return re.sub(r"\s+", " ", (term or "").casefold()).strip()
+
+
+class ResearchStore:
+    """PMIDs, titles and dates per search term, plus when each term was last synced.
+
+    A term synced within ``fresh_for`` seconds is answered from disk. Otherwise
+    ESearch is run for records added since the last sync date (``mindate``), and
+    only PMIDs not already stored are looked up with ESummary, in batches, then
+    merged in. Abstracts are fetched separately, only when asked for, and cached
+    per PMID.
+    """
+
+    def __init__(self, path=config.RESEARCH_STORE_PATH, fresh_for=config.RESEARCH_FRESH_FOR):
+        self.fresh_for = fresh_for
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (
+                pmid TEXT PRIMARY KEY, title TEXT, journal TEXT, pub_date TEXT, sort_date TEXT);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY, last_sync REAL, synced_limit INTEGER);
+            CREATE TABLE IF NOT EXISTS term_articles (
+                term TEXT, pmid TEXT, PRIMARY KEY (term, pmid));
+            CREATE TABLE IF NOT EXISTS abstracts (pmid TEXT PRIMARY KEY, abstract TEXT);
+        """)
+        self._db.commit()
+
+    def _term_state(self, term):
+        return self._db.execute(
+            "SELECT last_sync, synced_limit FROM terms WHERE term = ?", (term,)
+        ).fetchone()
+
+    def stored_pmids(self, pmids):
+        """The subset of ``pmids`` already in the store (under any term)."""
+        found = set()
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            found.update(r[0] for r in self._db.execute(
+                f"SELECT pmid FROM articles WHERE pmid IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def cached(self, term, limit):
+        """Stored records for a term, newest first, without touching the network."""
+        rows = self._db.execute(
+            "SELECT a.pmid, a.title, a.journal, a.pub_date FROM term_articles t"
+            " JOIN articles a ON a.pmid = t.pmid WHERE t.term = ?"
+            " ORDER BY a.sort_date DESC, CAST(a.pmid AS INTEGER) DESC LIMIT ?",
+            (term, limit),
+        ).fetchall()
+        return [dict(zip(("pmid", "title", "journal", "pub_date"), r)) for r in rows]
+
+    def records(self, pmids):
+        """Stored records for the given PMIDs, in that order; unknown PMIDs are skipped."""
+        rows = {}
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            for r in self._db.execute(
+                f"SELECT pmid, title, journal, pub_date FROM articles WHERE pmid IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                rows[r[0]] = dict(zip(("pmid", "title", "journal", "pub_date"), r))
+        return [rows[p] for p in pmids if p in rows]
+
+    def needs_sync(self, term, limit):
+        state = self._term_state(normalize_term(term))
+        return state is None or state[1] < limit or time.time() - state[0] >= self.fresh_for
+
+    def iter_sync(self, term, limit=config.RESEARCH_DEFAULT_RESULTS, stats=None, allow_stale=True):
+        """Bring ``term`` up to date, yielding its records as soon as each batch is ready.
+
+        Records come newest first. A term synced less than ``RESEARCH_STALE_FOR``
+        seconds past its freshness window is served from the store right away
+        and re-synced in the background (unless ``allow_stale`` is false).
+        ``stats``, if given, is filled with ``fetched`` (records downloaded now),
+        ``from_cache`` and ``stale``.
+        """
+        stats = stats if stats is not None else {}
+        stats.update(fetched=0, from_cache=False, stale=False)
+        key = normalize_term(term)
+        limit = min(limit, config.RESEARCH_MAX_RESULTS)
+        with self._lock:
+            state = self._term_state(key)
+        age = time.time() - state[0] if state is not None else None
+        covered = state is not None and state[1] >= limit
+        if covered and (age < self.fresh_for or (allow_stale and age < self.fresh_for + config.RESEARCH_STALE_FOR)):
+            stats["from_cache"] = True
+            if age >= self.fresh_for:
+                stats["stale"] = True
+                shared_cache.revalidate(shared_cache.make_key("research-sync", key, limit),
+                                        lambda: self.sync(term, limit, allow_stale=False))
+            with self._lock:
+                cached = self.cached(key, limit)
+            yield from cached
+            return
+
+        delta = state is not None and state[1] >= limit
+        if delta:
+            # Only records that entered PubMed since the last sync day. Always asked
+            # upstream: a cached answer would be older than the cursor it moves.
+            started = time.time()
+            ids = esearch(term, retmax=limit, datetype="edat",
+                          mindate=time.strftime("%Y/%m/%d", time.gmtime(state[0])), maxdate="3000").get("idlist", [])
+        else:
+            # A full search may come from another process's fetch, but never a stale one;
+            # the term counts as synced as of when that fetch was made.
+            search = shared_cache.cached(
+                "pubmed-search", (key, limit), config.RESEARCH_FRESH_FOR,
+                lambda: {"ids": esearch(term, retmax=limit).get("idlist", []),
+                         "fetched": time.time()},
+                stale_for=0,
+            )
+            ids, started = search["ids"], search["fetched"]
+        for start in range(0, len(ids), config.ESUMMARY_BATCH_SIZE):
+            batch = ids[start:start + config.ESUMMARY_BATCH_SIZE]
+            with self._lock:
+                stored = self.stored_pmids(batch)
+            records = esummary([p for p in batch if p not in stored])
+            stats["fetched"] += len(records)
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO articles (pmid, title, journal, pub_date, sort_date)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(r["pmid"], r["title"], r["journal"], r["pub_date"],
+                      r.get("sort_date") or sort_date(r["pub_date"])) for r in records],
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO term_articles (term, pmid) VALUES (?, ?)", [(key, p) for p in batch],
+                )
+                self._db.commit()
+                ready = self.records(batch)
+            if records:
+                index_articles([(r["pmid"], r["title"]) for r in records])
+            yield from ready
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO terms (term, last_sync, synced_limit) VALUES (?, ?, ?)",
+                (key, started, max(limit, state[1] if state else 0)),
+            )
+            self._db.commit()
+            rest = self.cached(key, limit) if delta else []
+        # After a delta sync the new records were yielded above; the rest comes from the store.
+        new = set(ids)
+        yield from [r for r in rest if r["pmid"] not in new][:max(0, limit - len(ids))]
+
+    def sync(self, term, limit=config.RESEARCH_DEFAULT_RESULTS, allow_stale=True):
+        """Bring ``term`` up to date and return ``(records, stats)``; see :meth:`iter_sync`."""
+        stats = {}
+        records = list(self.iter_sync(term, limit, stats, allow_stale))
+        return records, stats
+
+    def abstracts(self, pmids):
+        """``{pmid: abstract}``; anything not stored yet is fetched from EFetch in batches and kept."""
+        pmids = list(dict.fromkeys(pmids))
+        with self._lock:
+            found = {}
+            for start in range(0, len(pmids), 500):
+                chunk = pmids[start:start + 500]
+                found.update(self._db.execute(
+                    f"SELECT pmid, abstract FROM abstracts WHERE pmid IN ({','.join('?' * len(chunk))})", chunk))
+        missing = [p for p in pmids if p not in found]
+        if missing:
+            cache = shared_cache.get_cache()
+            fetched = {v["pmid"]: v["abstract"] for v in cache.get_many(
+                shared_cache.make_key("pubmed-abstract", p) for p in missing).values()}
+            remote = [p for p in missing if p not in fetched]
+            if remote:
+                fetched.update(http_client.flights.do(("abstracts", tuple(remote)), lambda: _fetch_abstracts(remote)))
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO abstracts (pmid, abstract) VALUES (?, ?)",
+                                     fetched.items())
+                self._db.commit()
+                titles = {r["pmid"]: r["title"] for r in self.records(list(fetched))}
+            index_articles([(p, f"{titles[p]}\n{text}") for p, text in fetched.items() if text and p in titles])
+            found.update(fetched)
+        return {p: found[p] for p in pmids}
+
+
+def _fetch_abstracts(pmids):
+    # The XML is parsed as it streams in, so this span covers download and parse together.
+    with metrics.span("pubmed.efetch", requested=len(pmids)):
+        downloaded = {r["pmid"]: r["abstract"] for r in iter_efetch_ids(pmids)}
+    # PMIDs without an abstract are stored as "" so they aren't requested again.
+    downloaded.update({p: "" for p in pmids if p not in downloaded})
+    shared_cache.get_cache().set_many(
+        ((shared_cache.make_key("pubmed-abstract", p), {"pmid": p, "abstract": text}) for p, text in downloaded.items()),
+        config.PUBMED_CACHE_TTL,
+    )
+    return downloaded
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResearchStore()
+        return _store
@@ -0,0 +1,318 @@
+"""Local BM25 index over the PubMed articles we have already fetched.
+
+Every article is one document (title, plus the abstract once it has been
+loaded). Postings are kept as parallel NumPy arrays: a "base" block sorted by
+term id, with a per-term pointer array, and an append-only "tail" for newly
+added documents. Adding documents only tokenizes the new ones and appends to the
+tail; the tail is merged into the base once it grows past a fraction of it.
+Scoring a query touches only the postings of its terms and accumulates scores
+with one ``np.bincount``.
+
+:func:`index_articles` doesn't write the index itself: it schedules a save
+``RESEARCH_INDEX_SAVE_DELAY`` seconds later on a background thread, so a burst
+of additions costs one write and none of it happens in the request. Every
+server process saves to the same file, so a save takes a file lock, first
+merges in documents another process has saved since, and writes through a
+private temporary file.
+"""
+import atexit
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+
+import config
+import locks
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the their this to was were "
+    "which with we our these those than then there been not no".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall((text or "").casefold()) if t not in _STOPWORDS and len(t) > 1]
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.pmids = []
+        self.doc_of = {}                              # pmid -> current doc number
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)          # replaced documents stay as tombstones
+        self.doc_sig = np.zeros(0, dtype=np.uint32)   # crc32 of the indexed text
+        # Base postings, sorted by term; term_ptr[t]:term_ptr[t + 1] slices term t.
+        self.term_ptr = np.zeros(1, dtype=np.int64)
+        self.base_doc = np.zeros(0, dtype=np.int32)
+        self.base_tf = np.zeros(0, dtype=np.float32)
+        # Tail postings for documents added since the last merge.
+        self._tail = []                               # list of (terms, docs, tfs) array triples
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _term_id(self, term):
+        tid = self.vocab.get(term)
+        if tid is None:
+            tid = self.vocab[term] = len(self.vocab)
+        return tid
+
+    def add_documents(self, docs):
+        """Add or replace ``(pmid, text)`` documents. Returns how many were (re)indexed."""
+        with self._lock:
+            lengths, sigs, terms, doc_ids, tfs = [], [], [], [], []
+            for pmid, text in dict(docs).items():
+                sig = zlib.crc32((text or "").encode("utf-8"))
+                old = self.doc_of.get(pmid)
+                if old is not None:
+                    if self.doc_sig[old] == sig:
+                        continue  # unchanged
+                    self.alive[old] = False
+                tokens = tokenize(text)
+                doc = len(self.pmids)
+                self.doc_of[pmid] = doc
+                self.pmids.append(pmid)
+                lengths.append(len(tokens))
+                sigs.append(sig)
+                ids, counts = np.unique(np.fromiter((self._term_id(t) for t in tokens), dtype=np.int32,
+                                                    count=len(tokens)), return_counts=True)
+                terms.append(ids)
+                doc_ids.append(np.full(len(ids), doc, dtype=np.int32))
+                tfs.append(counts.astype(np.float32))
+            if not lengths:
+                return 0
+            self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.float32)])
+            self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+            self.doc_sig = np.concatenate([self.doc_sig, np.asarray(sigs, dtype=np.uint32)])
+            self._tail.append((np.concatenate(terms), np.concatenate(doc_ids), np.concatenate(tfs)))
+            if sum(len(t[0]) for t in self._tail) > max(50_000, len(self.base_doc) // 4):
+                self._merge()
+            return len(lengths)
+
+    def _tail_arrays(self):
+        if not self._tail:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        if len(self._tail) > 1:
+            self._tail = [tuple(np.concatenate(parts) for parts in zip(*self._tail))]
+        return self._tail[0]
+
+    def _postings_arrays(self):
+        """Every posting, base and tail, as ``(terms, docs, tfs)``."""
+        tail_terms, tail_docs, tail_tf = self._tail_arrays()
+        base_terms = np.repeat(np.arange(len(self.term_ptr) - 1, dtype=np.int32), np.diff(self.term_ptr))
+        return (np.concatenate([base_terms, tail_terms]), np.concatenate([self.base_doc, tail_docs]),
+                np.concatenate([self.base_tf, tail_tf]))
+
+    def _merge(self):
+        """Fold the tail into the term-sorted base and drop postings of replaced documents."""
+        terms, docs, tfs = self._postings_arrays()
+        keep = self.alive[docs]
+        terms, docs, tfs = terms[keep], docs[keep], tfs[keep]
+        order = np.argsort(terms, kind="stable")
+        self.base_doc, self.base_tf = docs[order], tfs[order]
+        self.term_ptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        self.term_ptr[1:] = np.cumsum(np.bincount(terms, minlength=len(self.vocab)))
+        self._tail = []
+
+    def merge_from(self, other):
+        """Add the documents of ``other`` (e.g. another process's saved copy) that this index lacks.
+
+        Documents both have keep this index's version. Returns how many were added.
+        """
+        with self._lock:
+            new = [d for d, pmid in enumerate(other.pmids) if other.alive[d] and pmid not in self.doc_of]
+            if not new:
+                return 0
+            terms, docs, tfs = other._postings_arrays()
+            wanted = np.zeros(len(other.pmids), dtype=bool)
+            wanted[new] = True
+            keep = wanted[docs]
+            terms, docs, tfs = terms[keep], docs[keep], tfs[keep]
+            other_terms = sorted(other.vocab, key=other.vocab.get)
+            term_map = np.full(len(other_terms), -1, dtype=np.int32)
+            for tid in np.unique(terms).tolist():
+                term_map[tid] = self._term_id(other_terms[tid])
+            doc_map = np.full(len(other.pmids), -1, dtype=np.int32)
+            doc_map[new] = np.arange(len(self.pmids), len(self.pmids) + len(new), dtype=np.int32)
+            for d in new:
+                self.doc_of[other.pmids[d]] = len(self.pmids)
+                self.pmids.append(other.pmids[d])
+            self.doc_len = np.concatenate([self.doc_len, other.doc_len[new]])
+            self.alive = np.concatenate([self.alive, np.ones(len(new), dtype=bool)])
+            self.doc_sig = np.concatenate([self.doc_sig, other.doc_sig[new]])
+            self._tail.append((term_map[terms], doc_map[docs], tfs))
+            if sum(len(t[0]) for t in self._tail) > max(50_000, len(self.base_doc) // 4):
+                self._merge()
+            return len(new)
+
+    def _postings(self, tid, tail):
+        if tid + 1 < len(self.term_ptr):
+            lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+            docs, tfs = self.base_doc[lo:hi], self.base_tf[lo:hi]
+        else:
+            docs, tfs = self.base_doc[:0], self.base_tf[:0]
+        tail_terms, tail_docs, tail_tf = tail
+        if len(tail_terms):
+            mask = tail_terms == tid
+            docs, tfs = np.concatenate([docs, tail_docs[mask]]), np.concatenate([tfs, tail_tf[mask]])
+        alive = self.alive[docs]
+        return docs[alive], tfs[alive]
+
+    def scores(self, query):
+        """BM25 score of every document number for ``query`` (0 for non-matching and replaced ones)."""
+        with self._lock:
+            n_docs = len(self.pmids)
+            scores = np.zeros(n_docs, dtype=np.float64)
+            n_alive = int(self.alive.sum())
+            if not n_alive:
+                return scores
+            avgdl = float(self.doc_len[self.alive].mean()) or 1.0
+            tail = self._tail_arrays()
+            for term in set(tokenize(query)):
+                tid = self.vocab.get(term)
+                if tid is None:
+                    continue
+                docs, tfs = self._postings(tid, tail)
+                if not len(docs):
+                    continue
+                idf = np.log1p((n_alive - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / avgdl)
+                scores += np.bincount(docs, weights=idf * tfs * (self.k1 + 1) / (tfs + norm), minlength=n_docs)
+            return scores
+
+    def search(self, query, k=20, pmids=None):
+        """Top ``k`` ``(pmid, score)`` pairs with a positive score, best first.
+
+        ``pmids`` restricts the search to those articles (re-ranking an existing list).
+        """
+        scores = self.scores(query)
+        if pmids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[[self.doc_of[p] for p in pmids if p in self.doc_of]] = True
+            scores = np.where(allowed, scores, 0.0)
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(scores[hits], -k)[-k:]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.pmids[i], float(scores[i])) for i in hits]
+
+    def save(self, path):
+        with self._lock:
+            tail_terms, tail_docs, tail_tf = self._tail_arrays()
+            directory = os.path.dirname(path) or "."
+            os.makedirs(directory, exist_ok=True)
+            # A temporary name of our own, so concurrent writers never share one.
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(
+                        f, vocab=np.array(sorted(self.vocab, key=self.vocab.get), dtype=str),
+                        pmids=np.array(self.pmids, dtype=str), doc_len=self.doc_len, alive=self.alive,
+                        doc_sig=self.doc_sig,
+                        term_ptr=self.term_ptr, base_doc=self.base_doc, base_tf=self.base_tf,
+                        tail_terms=tail_terms, tail_docs=tail_docs, tail_tf=tail_tf,
+                        params=np.array([self.k1, self.b]),
+                    )
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(*data["params"].tolist())
+            index.vocab = {t: i for i, t in enumerate(data["vocab"].tolist())}
+            index.pmids = data["pmids"].tolist()
+            index.doc_len, index.alive, index.doc_sig = data["doc_len"], data["alive"], data["doc_sig"]
+            index.term_ptr, index.base_doc, index.base_tf = data["term_ptr"], data["base_doc"], data["base_tf"]
+            if len(data["tail_terms"]):
+                index._tail = [(data["tail_terms"], data["tail_docs"], data["tail_tf"])]
+        index.doc_of = {p: i for i, p in enumerate(index.pmids) if index.alive[i]}
+        return index
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+_index = None
+_index_lock = threading.Lock()
+_on_disk = {"version": None}  # the saved file as this process last read or wrote it
+
+
+def get_index():
+    """Process-wide index, loaded from ``RESEARCH_INDEX_PATH`` on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            path = config.RESEARCH_INDEX_PATH
+            _index = BM25Index.load(path) if os.path.exists(path) else BM25Index()
+            _on_disk["version"] = _file_version(path)
+        return _index
+
+
+def save_index(path=None):
+    """Merge in what other processes saved since, then write the index (under the file lock)."""
+    path = path or config.RESEARCH_INDEX_PATH
+    index = get_index()
+    with locks.locked(path + ".lock"):
+        version = _file_version(path)
+        if version is not None and version != _on_disk["version"]:
+            index.merge_from(BM25Index.load(path))
+        index.save(path)
+        _on_disk["version"] = _file_version(path)
+
+
+_save_timer = None
+_save_timer_lock = threading.Lock()
+
+
+def _save_later():
+    global _save_timer
+    with _save_timer_lock:
+        _save_timer = None
+    try:
+        save_index()
+    except Exception:
+        pass  # the next addition schedules another save
+
+
+def schedule_save(delay=None):
+    """Save the index after ``delay`` seconds (``RESEARCH_INDEX_SAVE_DELAY``) unless a save is already due."""
+    global _save_timer
+    with _save_timer_lock:
+        if _save_timer is None:
+            _save_timer = threading.Timer(config.RESEARCH_INDEX_SAVE_DELAY if delay is None else delay, _save_later)
+            _save_timer.daemon = True
+            _save_timer.start()
+
+
+@atexit.register
+def flush():
+    """Write a pending save now (also run at interpreter exit)."""
+    global _save_timer
+    with _save_timer_lock:
+        timer, _save_timer = _save_timer, None
+    if timer is not None:
+        timer.cancel()
+        save_index()
+
+
+def index_articles(docs):
+    """Add ``(pmid, text)`` documents to the shared index; it is saved shortly after, in the background."""
+    if get_index().add_documents(docs):
+        schedule_save()
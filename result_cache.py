@@ -0,0 +1,83 @@
+"""Streamlit-side memoization of the section searches.
+
+Results are keyed on normalized inputs and kept for ``RESULT_CACHE_TTL``
+(at most ``RESULT_CACHE_ENTRIES`` each), so repeating a search, or any rerun
+that happens to go through a search branch again, is answered without another
+Overpass, PubMed or ClinicalTrials.gov round trip.
+
+The hospital search is a plain ``st.cache_data`` function. Research and trials
+stream their results into the page while they download, so they use
+:func:`lookup`/:func:`remember` instead: a cache miss streams as before and the
+finished list is remembered afterwards, in a process-wide store keyed by
+``(section, key)``. Remembered values are shared between sessions and must not
+be modified.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+import config
+from geocoding import normalize_location
+from hospitals import find_hospitals, rank_hospitals
+from research import normalize_term
+
+
+@st.cache_data(ttl=config.RESULT_CACHE_TTL, max_entries=config.RESULT_CACHE_ENTRIES, show_spinner=False)
+def search_hospitals(lat, lon, oncology_only):
+    """``(hospitals, total, source)`` for a geocoded point: found, deduped and ranked nearest first."""
+    hospitals, source = find_hospitals(lat, lon, speciality="oncology" if oncology_only else None)
+    hospitals, total = rank_hospitals(lat, lon, hospitals)
+    return hospitals, total, source
+
+
+class ResultStore:
+    """``(section, key) -> value`` with a TTL, evicting the least recently used entry beyond ``maxsize``."""
+
+    def __init__(self, maxsize=config.RESULT_CACHE_ENTRIES, ttl=config.RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lru = OrderedDict()   # (section, key) -> (value, expires)
+        self._lock = threading.Lock()
+
+    def get(self, section, key):
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get((section, key))
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= now:
+                del self._lru[(section, key)]
+                return None
+            self._lru.move_to_end((section, key))
+            return value
+
+    def set(self, section, key, value):
+        with self._lock:
+            self._lru[(section, key)] = (value, time.time() + self.ttl)
+            self._lru.move_to_end((section, key))
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+
+_store = ResultStore()
+
+
+def lookup(section, key):
+    """The remembered result for ``key``, or ``None``."""
+    return _store.get(section, key)
+
+
+def remember(section, key, value):
+    _store.set(section, key, value)
+
+
+def research_key(term, limit):
+    return normalize_term(term), int(limit)
+
+
+def trials_key(condition, location, phase, status, near, radius_km, limit):
+    return (normalize_term(condition), normalize_location(location), phase, status,
+            bool(near), float(radius_km) if near else None, int(limit))
@@ -0,0 +1,484 @@
+"""The interactive parts of the page, each an ``st.fragment``.
+
+A widget inside one of these reruns only its own function, not the whole
+script, so typing a location or toggling an abstract doesn't re-render the
+other sections (or re-send the page CSS). Heavy dependencies (pandas, folium,
+streamlit-folium) are imported where they are first needed, so the first page
+load doesn't pay for a map nobody has asked for yet.
+
+Each section runs under a root tracing span (see ``metrics``); its spans from
+the latest run are kept in session state for the sidebar :func:`debug_panel`
+(shown with ``?debug=1`` when ``DEBUG_PANEL`` is enabled; it is off by default).
+"""
+import functools
+
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+
+import config
+import metrics
+from gazetteer import load_default_gazetteer
+from geocoding import geocode
+from hospital_index import load_default_index
+from hospitals import paginate
+from http_client import RateLimited
+from metrics import ResultTimer
+from notifications import get_subscriptions, request_subscription
+from research import get_store as get_research_store
+from research_index import get_index as get_research_index
+from result_cache import lookup, remember, research_key, search_hospitals, trials_key
+from trials import STATUSES, distance_key, iter_nearby_studies, iter_studies
+from trials_index import load_default_index as load_trials_index
+
+# Rendered in this order by app.py; bench/startup.py times each one on its own.
+FRAGMENTS = ("hospital_finder", "research_feed", "subscribe_form", "financial_calculator", "trial_finder", "checklist")
+
+
+def _traced(section):
+    """Run the decorated section under a root span named ``section`` and keep the spans for the debug panel."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            root = None
+            try:
+                with metrics.span(section) as root:
+                    return fn(*args, **kwargs)
+            finally:
+                if root is not None:
+                    st.session_state.setdefault("trace_spans", {})[section] = metrics.describe(root.trace)
+        return run
+    return decorate
+
+
+def _suggest(location):
+    """"Did you mean" captions for a location the gazetteer doesn't know."""
+    gazetteer = load_default_gazetteer()
+    if gazetteer is not None and location.strip() and gazetteer.lookup(location) is None:
+        suggestions = gazetteer.complete(location)
+        if suggestions:
+            st.caption("Did you mean: " + " · ".join(suggestions))
+
+
+# -------------------------------
+# Hospitals
+# -------------------------------
+@st.fragment
+@_traced("hospitals")
+def hospital_finder():
+    location = st.text_input("Enter your city or ZIP code:", "New York")
+    _suggest(location)
+    oncology_only = st.checkbox("Only hospitals tagged with an oncology speciality", key="hospital_oncology")
+    interactive_map = st.toggle("Interactive map (loads hospitals as you pan and zoom)", key="hospital_interactive")
+    if st.button("Find Hospitals"):
+        with st.spinner("Searching for hospitals..."):
+            _find_hospitals(location, oncology_only, interactive_map)
+
+    if not interactive_map and "hospital_results" in st.session_state:
+        results = st.session_state["hospital_results"]
+        st.iframe(results["map_html"], width=700, height=510)
+        if results["map_info"]["shown"] < results["map_info"]["total"]:
+            st.caption(f"Map shows the nearest {results['map_info']['shown']} of {results['map_info']['total']} hospitals.")
+        if results["source"] == "index":
+            st.caption("Served from the offline hospital index.")
+        _hospital_list(results["df"], results["total"])
+
+    if interactive_map and "hospital_viewport" in st.session_state:
+        _viewport_map(st.session_state["hospital_viewport"])
+
+
+def _find_hospitals(location, oncology_only, interactive_map):
+    try:
+        coords = geocode(location)
+    except RateLimited as e:
+        st.warning(str(e))
+        return
+    except Exception as e:
+        st.error(f"Geocoding error: {e}")
+        return
+    if not coords:
+        st.warning("Location not found. Please try again.")
+        return
+
+    lat, lon = coords
+    try:
+        with metrics.span("hospitals.search"):
+            hospitals, total, source = search_hospitals(lat, lon, oncology_only)
+    except RateLimited as e:
+        st.warning(str(e))
+        return
+    except Exception as e:
+        st.error(f"Overpass API error: {e}")
+        return
+    if not hospitals:
+        st.session_state.pop("hospital_results", None)
+        st.session_state.pop("hospital_viewport", None)
+        st.warning(f"No hospitals found within a {config.HOSPITAL_SEARCH_RADIUS_KM:g}km radius.")
+        return
+
+    st.session_state["hospital_page"] = 1
+    with metrics.span("hospitals.dataframe"):
+        import pandas as pd
+
+        df_hospitals = pd.DataFrame(hospitals)[["Name", "Distance (km)", "Latitude", "Longitude"]]
+    from hospital_map import ViewportSource, render_hospital_map
+
+    if interactive_map:
+        # Rendered outside the button branch, so panning (a rerun) keeps the map.
+        st.session_state.pop("hospital_results", None)
+        index = load_default_index() if source == "index" else None
+        st.session_state["hospital_viewport"] = {
+            "lat": lat, "lon": lon, "zoom": 12, "bounds": None,
+            "source": (ViewportSource(index=index, speciality="oncology" if oncology_only else None)
+                       if index is not None else ViewportSource.from_records(hospitals)),
+            "markers": {}, "layer": None, "df": df_hospitals, "total": total,
+        }
+    else:
+        st.session_state.pop("hospital_viewport", None)
+        with metrics.span("hospitals.map"):
+            map_html, map_info = render_hospital_map(
+                lat, lon,
+                df_hospitals["Latitude"].to_numpy(),
+                df_hospitals["Longitude"].to_numpy(),
+                df_hospitals["Name"].to_numpy(),
+            )
+        # Kept in session state (map HTML included) so other widgets' reruns don't lose it.
+        st.session_state["hospital_results"] = {
+            "map_html": map_html, "map_info": map_info, "source": source,
+            "df": df_hospitals, "total": total,
+        }
+
+
+def _viewport_map(view):
+    from streamlit_folium import st_folium
+
+    from hospital_map import base_map, estimate_bounds, leaflet_bounds, level_of_detail, viewport_delta, viewport_layer
+
+    with metrics.span("hospitals.viewport") as span:
+        bounds = view["bounds"] or estimate_bounds(view["lat"], view["lon"], view["zoom"])
+        visible = level_of_detail(*view["source"].in_bounds(*bounds), view["zoom"])
+        added, removed = viewport_delta(view["markers"], visible)
+        if added or removed or view["layer"] is None:
+            view["markers"], view["layer"] = visible, viewport_layer(visible)
+        span.set(markers=len(visible))
+    map_state = st_folium(
+        base_map(view["lat"], view["lon"]),
+        key="hospital_viewport_map", width=700, height=500,
+        feature_group_to_add=view["layer"], returned_objects=["bounds", "zoom"],
+    )
+    new_bounds = leaflet_bounds((map_state or {}).get("bounds"))
+    new_zoom = (map_state or {}).get("zoom") or view["zoom"]
+    if new_bounds and (new_bounds != view["bounds"] or new_zoom != view["zoom"]):
+        view["bounds"], view["zoom"] = new_bounds, new_zoom
+        try:
+            st.rerun(scope="fragment")
+        except StreamlitAPIException:
+            st.rerun()  # the move arrived in a full-script run, where only a full rerun is allowed
+    st.caption(f"{len(visible)} markers in view (+{len(added)} / -{len(removed)} since the last move).")
+    _hospital_list(view["df"], view["total"])
+
+
+def _hospital_list(df, total):
+    st.subheader("List of Hospitals")
+    # The page widget (below the table) keeps its value in session state; a new search resets it to 1.
+    rows, pages = paginate(df, st.session_state.get("hospital_page", 1))
+    st.dataframe(rows, hide_index=True)
+    page = 1
+    if pages > 1:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key="hospital_page")
+    st.caption(f"Nearest {len(df)} of {total} hospitals, page {page} of {pages}.")
+
+
+# -------------------------------
+# Research
+# -------------------------------
+@st.fragment
+@_traced("research")
+def research_feed():
+    cancer_type = st.text_input("Enter your cancer type (e.g., Breast Cancer):", "Breast Cancer")
+    article_count = st.number_input(
+        "Number of articles:", min_value=1, max_value=config.RESEARCH_MAX_RESULTS,
+        value=config.RESEARCH_DEFAULT_RESULTS, step=10,
+    )
+    if st.button("Get Latest Research"):
+        # Articles are written to a live placeholder as each batch arrives; once the
+        # sync is complete it is replaced by the interactive list below.
+        key = research_key(cancer_type, article_count)
+        articles = lookup("research", key)
+        if articles is None:
+            live = st.empty()
+            timer = ResultTimer("research", cancer_type)
+            articles = []
+            stats = {}
+            with live.container():
+                with st.spinner("Fetching latest research articles..."):
+                    try:
+                        for article in get_research_store().iter_sync(cancer_type, limit=article_count, stats=stats):
+                            if not articles:
+                                st.markdown("### Latest Research Articles")
+                            timer.hit()
+                            articles.append(article)
+                            link = f"https://pubmed.ncbi.nlm.nih.gov/{article['pmid']}/"
+                            st.markdown(f"#### [{article['title']}]({link})")
+                    except RateLimited as e:
+                        timer.finish(error=e)
+                        st.warning(str(e))
+                        return
+                    except Exception as e:
+                        timer.finish(error=e)
+                        st.error(f"Error searching PubMed: {e}")
+                        return
+            timer.finish()
+            live.empty()
+            metrics.annotate(cache="stale" if stats["stale"] else "hit" if stats["from_cache"] else "miss",
+                             fetched=stats["fetched"])
+            remember("research", key, articles)
+        # Kept in session state so expanding an abstract (a rerun) doesn't lose the list.
+        st.session_state["research_articles"] = articles
+        if not articles:
+            st.warning("No articles found for the specified cancer type.")
+
+    if not st.session_state.get("research_articles"):
+        return
+    articles = st.session_state["research_articles"]
+    relevance_query = st.text_input("Rank by relevance to (searched locally, e.g. HER2 immunotherapy):", key="research_rank")
+    search_all = st.checkbox("Search every article fetched so far, not just this list", key="research_rank_all")
+    if relevance_query:
+        if search_all:
+            hits = get_research_index().search(relevance_query, k=len(articles))
+            articles = get_research_store().records([pmid for pmid, _ in hits])
+        else:
+            ranked = [pmid for pmid, _ in get_research_index().search(
+                relevance_query, k=len(articles), pmids=[a["pmid"] for a in articles])]
+            position = {pmid: n for n, pmid in enumerate(ranked)}
+            articles = sorted(articles, key=lambda a: position.get(a["pmid"], len(position)))
+    # Abstracts are only fetched for articles whose toggle is on, all missing ones in one batch.
+    wanted = [a["pmid"] for a in articles if st.session_state.get(f"abstract_{a['pmid']}")]
+    abstracts = {}
+    if wanted:
+        try:
+            abstracts = get_research_store().abstracts(wanted)
+        except RateLimited as e:
+            st.warning(str(e))
+        except Exception as e:
+            st.error(f"Error fetching PubMed abstracts: {e}")
+
+    st.markdown("### Latest Research Articles")
+    for article in articles:
+        link = f"https://pubmed.ncbi.nlm.nih.gov/{article['pmid']}/"
+        st.markdown(f"#### [{article['title']}]({link})")
+        st.caption(" · ".join(p for p in (article["journal"], article["pub_date"]) if p))
+        if st.toggle("Show abstract", key=f"abstract_{article['pmid']}") and article["pmid"] in abstracts:
+            st.markdown(abstracts[article["pmid"]] or "*No abstract available.*")
+
+
+# -------------------------------
+# Stay informed
+# -------------------------------
+@st.fragment
+@_traced("subscriptions")
+def subscribe_form():
+    token = st.query_params.get("confirm")
+    if token:
+        # Link from a confirmation email.
+        if get_subscriptions().confirm(token):
+            st.success("Subscription confirmed. New articles will be emailed to you as a digest; "
+                       "every email has an unsubscribe link.")
+        else:
+            st.info("This confirmation link has expired or was cancelled; please subscribe again.")
+        del st.query_params["confirm"]
+    token = st.query_params.get("unsubscribe")
+    if token:
+        # Link from a digest email.
+        if get_subscriptions().unsubscribe(token):
+            st.success("You have been unsubscribed.")
+        else:
+            st.info("This subscription was already cancelled.")
+        del st.query_params["unsubscribe"]
+
+    with st.form("subscribe_form", clear_on_submit=True):
+        email = st.text_input("Email address:")
+        term = st.text_input("Search term (e.g., Breast Cancer):", "Breast Cancer")
+        if st.form_submit_button("Subscribe"):
+            try:
+                request_subscription(email, term)
+            except ValueError as e:
+                st.warning(f"Could not subscribe: {e}")
+            else:
+                # Same answer whether or not the address is already subscribed or was just sent a link.
+                st.success("Almost done: check your inbox for a link to confirm alerts on "
+                           f'"{" ".join(term.split())}".')
+
+
+# -------------------------------
+# Financial calculator
+# -------------------------------
+@st.fragment
+@_traced("financial_calculator")
+def financial_calculator():
+    with st.form("financial_calculator"):
+        income = st.number_input("Enter your annual income ($):", min_value=0, value=50000, step=1000)
+        retirement_withdraw = st.number_input("Enter amount to withdraw from retirement account ($):", min_value=0, value=10000, step=1000)
+        submitted = st.form_submit_button("Calculate")
+        if submitted:
+            # Placeholder calculation
+            tax = 0  # e.g., 0% for Stage IV
+            st.write(f"**Estimated Tax on Withdrawal:** ${tax}")
+            st.success("Calculation completed. Please consult a financial advisor for accurate information.")
+
+
+# -------------------------------
+# Clinical trials
+# -------------------------------
+@st.fragment
+@_traced("trials")
+def trial_finder():
+    cancer_type_ct = st.text_input("Enter your cancer type (e.g., Lung Cancer):", "Lung Cancer", key="ct_input")
+    location_ct = st.text_input("Enter your location or ZIP code:", "New York", key="ct_loc")
+    _suggest(location_ct)
+    phase_ct = st.selectbox("Select Trial Phase:", ["All", "Phase 1", "Phase 2", "Phase 3", "Phase 4"], key="ct_phase")
+    status_ct = st.selectbox("Recruitment Status:", ["All", *STATUSES], key="ct_status")
+    near_ct = st.checkbox("Search by distance from my location", value=True, key="ct_near")
+    radius_ct = st.number_input(
+        "Search radius (km):", min_value=5.0, max_value=500.0, value=config.CT_SEARCH_RADIUS_KM, step=5.0,
+        key="ct_radius", disabled=not near_ct,
+    )
+    max_trials = st.number_input(
+        "Maximum number of trials:", min_value=1, max_value=config.CT_MAX_RESULTS,
+        value=config.CT_DEFAULT_RESULTS, step=20, key="ct_max",
+    )
+
+    if st.button("Find Clinical Trials", key="ct_button"):
+        key = trials_key(cancer_type_ct, location_ct, phase_ct, status_ct, near_ct, radius_ct, max_trials)
+        trial_results = lookup("trials", key)
+        if trial_results is None:
+            # Trials are written to a live placeholder as they arrive, then shown from session state below.
+            live = st.empty()
+            timer = ResultTimer("trials", f"{cancer_type_ct} | {location_ct} | {phase_ct} | {status_ct}")
+            trial_results = {"studies": [], "note": None}
+            with live.container():
+                with st.spinner("Searching for clinical trials..."):
+                    try:
+                        for study in _find_trials(trial_results, cancer_type_ct, location_ct, phase_ct, status_ct,
+                                                  near_ct, radius_ct, max_trials):
+                            if not timer.count:
+                                st.markdown("### Found Clinical Trials")
+                            timer.hit()
+                            trial_results["studies"].append(study)
+                            st.markdown(f"#### [{study['title']}]({study['link']})")
+                    except RateLimited as e:
+                        timer.finish(error=e)
+                        st.warning(str(e))
+                        return
+                    except Exception as e:
+                        timer.finish(error=e)
+                        st.error(f"ClinicalTrials.gov error: {e}")
+                        return
+            timer.finish()
+            live.empty()
+            if trial_results["studies"] and "distance_km" in trial_results["studies"][0]:
+                trial_results["studies"].sort(key=distance_key)
+            remember("trials", key, trial_results)
+        st.session_state["trial_results"] = trial_results
+        if not trial_results["studies"]:
+            st.warning("No clinical trials found for the given criteria.")
+
+    if not st.session_state.get("trial_results"):
+        return
+    trial_results = st.session_state["trial_results"]
+    if trial_results["note"]:
+        st.info(trial_results["note"])
+    if trial_results["studies"]:
+        st.markdown("### Found Clinical Trials")
+    for study in trial_results["studies"]:
+        st.markdown(f"#### [{study['title']}]({study['link']})")
+        st.write(f"**Status:** {study['status']}")
+        st.write(f"**Phase:** {study['phase']}")
+        if "nearest_site" in study:
+            site = study["nearest_site"]
+            place = ", ".join(p for p in (site["facility"], site["label"]) if p)
+            st.write(f"**Nearest site:** {place} ({study['distance_km']:g} km)")
+        shown = study["locations"][:5]
+        more = len(study["locations"]) - len(shown)
+        st.write(f"**Locations:** {'; '.join(shown)}" + (f" (+{more} more)" if more > 0 else ""))
+        st.markdown("---")
+
+
+def _find_trials(trial_results, condition, location, phase, status, near, radius_km, max_trials):
+    """Matching studies, from the local index when there is one, else ClinicalTrials.gov."""
+    # Same geocoder (and cache) as the hospital finder.
+    coords = geocode(location) if near and location.strip() else None
+    if near and coords is None:
+        trial_results["note"] = "Couldn't place that location on the map; matching trial locations by name instead."
+    trial_index = load_trials_index()
+    if trial_index is not None and coords:
+        with metrics.span("trials_index.nearby"):
+            return trial_index.nearby(coords[0], coords[1], radius_km, condition, phase, status, limit=max_trials)
+    if trial_index is not None:
+        with metrics.span("trials_index.search"):
+            return trial_index.search(condition, location, phase, status, limit=max_trials)
+    if coords:
+        # Streamed ranked page by page; trial_finder sorts the whole list once it is complete.
+        return iter_nearby_studies(condition, coords[0], coords[1], radius_km, phase, max_results=max_trials,
+                                   status=status)
+    return iter_studies(condition, location, phase, max_results=max_trials, status=status)
+
+
+# -------------------------------
+# Checklist
+# -------------------------------
+@st.fragment
+@_traced("checklist")
+def checklist():
+    with st.form("checklist_form"):
+        financial_tasks = st.multiselect("Financial Tasks", [
+            "Apply for insurance",
+            "Meet with financial advisor",
+            "Fill out tax forms",
+            "Explore Corporate Angel Network",
+            "Plan budget for treatments"
+        ])
+        medical_appointments = st.multiselect("Medical Appointments", [
+            "Schedule doctor's visit",
+            "Radiation therapy session",
+            "Chemotherapy session",
+            "Follow-up consultations",
+            "Get second opinion"
+        ])
+        other_tasks = st.multiselect("Other Tasks", [
+            "Call support group",
+            "Arrange transportation",
+            "Update personal documents",
+            "Organize living space",
+            "Plan meals"
+        ])
+
+        submitted = st.form_submit_button("Generate Checklist")
+        if submitted:
+            st.markdown("### Your Personalized Checklist")
+            if financial_tasks:
+                st.markdown("**Financial Tasks:**")
+                for task in financial_tasks:
+                    st.write(f"- [ ] {task}")
+            if medical_appointments:
+                st.markdown("**Medical Appointments:**")
+                for task in medical_appointments:
+                    st.write(f"- [ ] {task}")
+            if other_tasks:
+                st.markdown("**Other Tasks:**")
+                for task in other_tasks:
+                    st.write(f"- [ ] {task}")
+
+
+# -------------------------------
+# Debug panel
+# -------------------------------
+@st.fragment(run_every=2)
+def debug_panel():
+    """Spans of each section's latest run (refreshed every 2 s, so fragment reruns show up too)."""
+    st.subheader("Spans")
+    traces = st.session_state.get("trace_spans", {})
+    if not traces:
+        st.caption("No section has run yet.")
+    for section, rows in traces.items():
+        st.caption(f"{section}: {rows[0]['ms']:g} ms" if rows else section)
+        st.dataframe(rows, hide_index=True)
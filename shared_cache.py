@@ -0,0 +1,308 @@
+"""Cache for upstream lookups that every server process (and host) can share.
+
+Geocoding, Overpass, PubMed and ClinicalTrials.gov results are stored here, so a
+lookup made by one Streamlit worker serves all of them. The backend is chosen by
+``SHARED_CACHE_URL``:
+
+* ``sqlite:///path/to/file`` (default): one SQLite file in WAL mode, shared by
+  every process on the host. Once it holds more than ``SHARED_CACHE_MAX_BYTES``
+  of values, the least recently used entries are evicted.
+* ``redis://host:port/db``: any Redis-compatible server, shared across hosts.
+  Needs the ``redis`` package; size limits are left to the server's
+  ``maxmemory`` / ``allkeys-lru`` settings.
+* ``none``: caching disabled.
+
+Values are JSON, zlib-compressed. Keys come from :func:`make_key`, which
+canonicalizes its parts (dict order, whitespace, float precision) and hashes them
+under a namespace, so equivalent lookups always map to the same entry.
+
+:func:`cached` is stale-while-revalidate: an entry past its TTL is still served
+for up to ``SHARED_CACHE_STALE_FOR`` seconds more, while a background thread
+fetches a fresh copy.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import http_client
+import metrics
+
+try:
+    import redis
+except ImportError:  # optional: only needed for a redis:// SHARED_CACHE_URL
+    redis = None
+
+
+def _canonical(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_canonical(v) for v in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    return value
+
+
+def make_key(namespace, *parts):
+    """``"<namespace>:<sha1>"`` for the canonical form of ``parts``.
+
+    Case is preserved; callers normalize text whose case doesn't matter (see
+    ``geocoding.normalize_location``, ``research.normalize_term``) beforehand.
+    """
+    blob = json.dumps(_canonical(parts), sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha1(blob.encode('utf-8')).hexdigest()}"
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+class SQLiteCache:
+    """Shared cache in one SQLite file (WAL), evicting least recently used entries over ``max_bytes``."""
+
+    # Reads refresh an entry's access time at most this often, to keep reads from writing.
+    TOUCH_EVERY = 60
+
+    def __init__(self, path, max_bytes=config.SHARED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL);
+            CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+        """)
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get_many(self, keys):
+        """``{key: value}`` for the keys present and unexpired."""
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found, touch = {}, []
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                for key, blob, expires, accessed in self._db.execute(
+                    f"SELECT key, value, expires, accessed FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ):
+                    if expires > now:
+                        found[key] = _decode(blob)
+                        if now - accessed > self.TOUCH_EVERY:
+                            touch.append((now, key))
+            if touch:
+                self._db.executemany("UPDATE cache SET accessed = ? WHERE key = ?", touch)
+                self._db.commit()
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        """The cached value, or ``None`` if missing or expired."""
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items, ttl):
+        now = time.time()
+        rows = []
+        for key, value in items:
+            blob = _encode(value)
+            rows.append((key, blob, len(blob), now + ttl, now))
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+            self.stats["writes"] += len(rows)
+            # Approximate: replaced entries and other processes' writes are reconciled in _evict().
+            self._size += sum(r[2] for r in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def set(self, key, value, ttl):
+        self.set_many([(key, value)], ttl)
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used ones until under 90% of the budget."""
+        self._db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if size > target:
+            doomed, freed = [], 0
+            for key, entry_size in self._db.execute("SELECT key, size FROM cache ORDER BY accessed"):
+                doomed.append((key,))
+                freed += entry_size
+                if size - freed <= target:
+                    break
+            self._db.executemany("DELETE FROM cache WHERE key = ?", doomed)
+            self.stats["evictions"] += len(doomed)
+            size -= freed
+        self._db.commit()
+        self._size = size
+
+    def purge_expired(self):
+        with self._lock:
+            self._evict()
+
+
+class RedisCache:
+    """Adapter for a Redis-compatible server. Expiry uses Redis TTLs; eviction is the server's."""
+
+    def __init__(self, url, prefix="cancer-app:"):
+        if redis is None:
+            raise ImportError("the redis package is required for a redis:// SHARED_CACHE_URL")
+        self.prefix = prefix
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._client = redis.Redis.from_url(url, socket_timeout=config.HTTP_CONNECT_TIMEOUT)
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        blobs = self._client.mget([self.prefix + k for k in keys])
+        found = {k: _decode(b) for k, b in zip(keys, blobs) if b is not None}
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items, ttl):
+        pipe = self._client.pipeline(transaction=False)
+        count = 0
+        for key, value in items:
+            pipe.set(self.prefix + key, _encode(value), ex=max(1, int(ttl)))
+            count += 1
+        pipe.execute()
+        self.stats["writes"] += count
+
+    def set(self, key, value, ttl):
+        self.set_many([(key, value)], ttl)
+
+    def purge_expired(self):
+        pass
+
+
+class NullCache:
+    stats = {}
+
+    def get_many(self, keys):
+        return {}
+
+    def get(self, key):
+        return None
+
+    def set_many(self, items, ttl):
+        pass
+
+    def set(self, key, value, ttl):
+        pass
+
+    def purge_expired(self):
+        pass
+
+
+def open_cache(url):
+    """Backend for a ``SHARED_CACHE_URL`` (see module docstring)."""
+    if not url or url == "none":
+        return NullCache()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            return RedisCache(url)
+        except ImportError as e:
+            warnings.warn(f"{e}; falling back to the local SQLite cache")
+            url = "sqlite:///" + config.SHARED_CACHE_PATH
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):])
+    raise ValueError(f"unsupported SHARED_CACHE_URL: {url}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide backend for ``SHARED_CACHE_URL``, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = open_cache(config.SHARED_CACHE_URL)
+        return _cache
+
+
+# Background revalidation; a key already being refreshed isn't queued again.
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def revalidate(key, fn):
+    """Run ``fn`` in the background (once per ``key`` at a time); errors are dropped."""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            with metrics.span("revalidate " + key.split(":", 1)[0]):
+                http_client.flights.do(key, fn)
+        except Exception:
+            pass  # the stale copy keeps being served until a refresh succeeds or it expires
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    _refresher.submit(run)
+
+
+def cached(namespace, parts, ttl, compute, stale_for=None):
+    """``compute()``'s result, from the shared cache when present; stored there on a miss.
+
+    Entries older than ``ttl`` are returned as they are for up to ``stale_for``
+    seconds more (default ``SHARED_CACHE_STALE_FOR``) while :func:`revalidate`
+    refreshes them. Concurrent misses for the same key in this process share one
+    ``compute()``. ``None`` results are not stored.
+    """
+    stale_for = config.SHARED_CACHE_STALE_FOR if stale_for is None else stale_for
+    key = make_key(namespace, *parts)
+    cache = get_cache()
+
+    def fill():
+        value = compute()
+        if value is not None:
+            cache.set(key, {"value": value, "fresh_until": time.time() + ttl}, ttl + stale_for)
+        return value
+
+    with metrics.span(namespace) as span:
+        entry = cache.get(key)
+        if isinstance(entry, dict) and "fresh_until" in entry:
+            if entry["fresh_until"] <= time.time():
+                span.set(cache="stale")
+                revalidate(key, fill)
+            else:
+                span.set(cache="hit")
+            return entry["value"]
+        span.set(cache="miss")
+        return http_client.flights.do(key, fill)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Keep caches, stores and traces written during tests out of the checkout.
+os.environ.setdefault("CANCER_APP_CACHE_DIR", tempfile.mkdtemp(prefix="cancer-app-tests-"))
+os.environ.setdefault("CACHE_WARMER", "0")
@@ -0,0 +1,55 @@
+from gazetteer import Gazetteer, build_gazetteer, normalize
+
+ROWS = [
+    ("Springfield, IL", 39.80, -89.64, 114000, ["springfield", "springfield il"]),
+    ("Springfield, MA", 42.10, -72.59, 155000, ["springfield", "springfield ma"]),
+    ("Springdale, AR", 36.19, -94.13, 87000, ["springdale", "springdale ar"]),
+    ("Boston, MA", 42.36, -71.06, 650000, ["boston", "boston ma"]),
+    ("ZIP 02115", 42.34, -71.10, 0, ["02115"]),
+]
+
+
+def _coords(point):
+    return None if point is None else tuple(round(x, 2) for x in point)
+
+
+def test_normalize():
+    assert normalize("  St. Louis,  MO ") == "st louis mo"
+    assert normalize("02115-1234") == "02115"
+    assert normalize(None) == ""
+
+
+def test_lookup_exact_names_zips_and_ties():
+    gazetteer = Gazetteer.from_rows(ROWS)
+    assert _coords(gazetteer.lookup("Boston")) == (42.36, -71.06)
+    assert _coords(gazetteer.lookup("02115-0001")) == (42.34, -71.10)
+    assert _coords(gazetteer.lookup("Springfield, IL")) == (39.80, -89.64)
+    assert _coords(gazetteer.lookup("springfield")) == (42.10, -72.59)  # most populous wins
+    assert gazetteer.lookup("Bost") is None
+    assert gazetteer.lookup("") is None
+
+
+def test_complete_orders_by_population_and_tolerates_typos():
+    gazetteer = Gazetteer.from_rows(ROWS)
+    assert gazetteer.complete("spring") == ["Springfield, MA", "Springfield, IL", "Springdale, AR"]
+    assert gazetteer.complete("spring", k=1) == ["Springfield, MA"]
+    assert gazetteer.complete("springfield i")[0] == "Springfield, IL"
+    assert gazetteer.complete("bostn")[:1] == ["Boston, MA"]
+    assert gazetteer.complete("zzzzzz") == []
+    assert gazetteer.complete("  ") == []
+
+
+def test_build_from_census_files_and_reload(tmp_path):
+    places = tmp_path / "2020_Gaz_place_national.txt"
+    places.write_text(
+        "USPS\tGEOID\tNAME\tALAND\tINTPTLAT\tINTPTLONG                                                  \n"
+        "IL\t1772000\tSpringfield city\t0\t39.79\t-89.64\n"
+        "TX\t4835000\tHouston city\t0\t29.78\t-95.39\n"
+    )
+    zctas = tmp_path / "2020_Gaz_zcta_national.txt"
+    zctas.write_text("GEOID\tALAND\tINTPTLAT\tINTPTLONG\n77030\t0\t29.70\t-95.40\n")
+    build_gazetteer([str(places), str(zctas)]).save(str(tmp_path / "gaz"))
+    gazetteer = Gazetteer.load(str(tmp_path / "gaz"))
+    assert _coords(gazetteer.lookup("Houston TX")) == (29.78, -95.39)
+    assert _coords(gazetteer.lookup("77030")) == (29.70, -95.40)
+    assert gazetteer.complete("springf") == ["Springfield, IL"]
@@ -0,0 +1,75 @@
+import numpy as np
+
+from geo import haversine_km
+from hospital_index import HospitalIndex, build_index
+
+_OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <bounds minlat="40.0" minlon="-75.0" maxlat="41.0" maxlon="-73.0"/>
+  <node id="1" lat="40.70" lon="-74.00"><tag k="amenity" v="hospital"/><tag k="name" v="Node Hospital"/></node>
+  <node id="2" lat="40.60" lon="-74.10"/>
+  <node id="3" lat="40.60" lon="-74.08"/>
+  <node id="4" lat="40.62" lon="-74.08"/>
+  <node id="5" lat="40.62" lon="-74.10"/>
+  <node id="6" lat="40.50" lon="-74.20"/>
+  <node id="7" lat="40.52" lon="-74.20"/>
+  <way id="10"><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="5"/>
+    <tag k="amenity" v="hospital"/><tag k="name" v="Way Hospital"/></way>
+  <way id="11"><nd ref="6"/><nd ref="7"/></way>
+  <way id="12"><nd ref="2"/><nd ref="3"/></way>
+  <relation id="20">
+    <member type="way" ref="11" role="outer"/>
+    <member type="way" ref="12" role="outer"/>
+    <tag k="type" v="multipolygon"/><tag k="amenity" v="hospital"/><tag k="name" v="Campus Hospital"/>
+    <tag k="healthcare:speciality" v="oncology"/>
+  </relation>
+</osm>
+"""
+
+
+def _names(index):
+    return sorted(index.name(i) for i in range(len(index)))
+
+
+def test_multipolygon_with_untagged_member_ways_is_indexed(tmp_path):
+    path = tmp_path / "extract.osm"
+    path.write_text(_OSM)
+    index = build_index(str(path))
+    assert _names(index) == ["Campus Hospital", "Node Hospital", "Way Hospital"]
+    [campus] = [i for i in range(len(index)) if index.name(i) == "Campus Hospital"]
+    assert index.speciality(campus) == "oncology"
+    # Mean of the two member way centres: (40.51, -74.2) and (40.6, -74.09).
+    assert np.isclose(index.lat[campus], 40.555, atol=1e-4) and np.isclose(index.lon[campus], -74.145, atol=1e-4)
+    assert index.covers(40.5, -74.0, 10) and not index.covers(40.05, -74.0, 10)
+
+
+def _grid_index():
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(40.0, 41.0, 500)
+    lon = rng.uniform(-75.0, -73.0, 500)
+    names = [f"H{i}" for i in range(500)]
+    return HospitalIndex(lat, lon, [0] * 500, range(500), names, [""] * 500, [(40.0, -75.0, 41.0, -73.0)])
+
+
+def test_within_matches_brute_force():
+    index = _grid_index()
+    for lat, lon, radius in ((40.5, -74.0, 8), (40.05, -74.95, 20), (40.9, -73.1, 3)):
+        positions, distances = index.within(lat, lon, radius)
+        expected = np.flatnonzero(haversine_km(lat, lon, index.lat, index.lon) <= radius)
+        assert sorted(positions.tolist()) == expected.tolist()
+        assert np.all(distances <= radius)
+
+
+def test_covers_needs_the_whole_circle_inside():
+    index = _grid_index()
+    assert index.covers(40.5, -74.0, 20)
+    assert not index.covers(40.02, -74.0, 20)   # reaches past the southern edge
+    assert not index.covers(45.0, -74.0, 1)
+
+
+def test_saved_index_reloads_identically(tmp_path):
+    index = _grid_index()
+    index.save(str(tmp_path / "h.npz"))
+    loaded = HospitalIndex.load(str(tmp_path / "h.npz"))
+    assert np.array_equal(loaded.lat, index.lat) and np.array_equal(loaded.osm_id, index.osm_id)
+    assert [loaded.name(i) for i in range(5)] == [index.name(i) for i in range(5)]
@@ -0,0 +1,28 @@
+from hospital_index import HospitalIndex
+from hospital_map import ViewportSource, hospital_layer
+
+
+def _index():
+    return HospitalIndex(
+        lat=[40.70, 40.71, 40.72], lon=[-74.00, -74.01, -74.02], osm_type=[0, 0, 1], osm_id=[1, 2, 3],
+        names=["General", "Cancer Center", "Clinic"], specialities=["", "oncology;surgery", "Oncology"],
+        coverage=[(40, -75, 41, -73)],
+    )
+
+
+def test_viewport_from_index_shows_every_hospital():
+    ids, lats, lons, names = ViewportSource(index=_index()).in_bounds(40.6, -74.1, 40.8, -73.9)
+    assert sorted(names) == ["Cancer Center", "Clinic", "General"]
+
+
+def test_viewport_from_index_applies_the_speciality_filter():
+    source = ViewportSource(index=_index(), speciality="oncology")
+    ids, lats, lons, names = source.in_bounds(40.6, -74.1, 40.8, -73.9)
+    assert sorted(names) == ["Cancer Center", "Clinic"]
+    assert len(source.in_bounds(0, 0, 1, 1)[0]) == 0
+
+
+def test_geojson_popup_names_are_escaped():
+    layer = hospital_layer([40.0], [-74.0], ['<img src=x onerror="alert(1)"> & Co'], "geojson")
+    [feature] = layer.data["features"]
+    assert feature["properties"]["name"] == "&lt;img src=x onerror=&quot;alert(1)&quot;&gt; &amp; Co"
@@ -0,0 +1,64 @@
+import numpy as np
+
+from geo import haversine_km
+from hospitals import dedupe_mask, paginate, rank_hospitals
+
+# Roughly 15 m north of (40.7, -74.0).
+_NEAR = 40.7 + 15 / 111_320
+
+
+def _hospital(name, lat, lon, osm_type="node", osm_id=0):
+    return {"Name": name, "Latitude": lat, "Longitude": lon, "osm_type": osm_type, "osm_id": osm_id}
+
+
+def test_same_hospital_as_node_way_and_relation_is_kept_once_preferring_the_node():
+    keep = dedupe_mask([40.7, _NEAR, 40.7], [-74.0, -74.0, -74.0001],
+                       ["St. Mary's Hospital", "st. mary's  hospital", "ST MARY'S HOSPITAL"], ["relation", "way", "node"])
+    assert keep.tolist() == [False, False, True]
+
+
+def test_different_names_at_the_same_spot_are_kept():
+    keep = dedupe_mask([40.7, 40.7], [-74.0, -74.0], ["General Hospital", "Children's Hospital"], ["node", "node"])
+    assert keep.all()
+
+
+def test_unnamed_hospitals_are_never_merged():
+    keep = dedupe_mask([40.7, _NEAR, 40.7], [-74.0, -74.0, -74.0],
+                       ["Unnamed Hospital", "Unnamed Hospital", ""], ["node", "node", "way"])
+    assert keep.all()
+
+
+def test_duplicates_straddling_a_cell_edge_are_merged():
+    # Points 10 m apart on both sides of many possible grid lines: some pair straddles one.
+    lats = np.repeat(np.linspace(40.0, 40.01, 50), 2)
+    lats[1::2] += 10 / 111_320
+    names = [f"Hospital {i // 2}" for i in range(100)]
+    keep = dedupe_mask(lats, np.full(100, -74.0), names, ["node", "way"] * 50)
+    assert keep.tolist() == [True, False] * 50
+
+
+def test_rank_hospitals_returns_the_nearest_k_sorted():
+    rng = np.random.default_rng(3)
+    hospitals = [_hospital(f"H{i}", 40 + rng.uniform(-0.2, 0.2), -74 + rng.uniform(-0.2, 0.2), osm_id=i)
+                 for i in range(200)]
+    ranked, total = rank_hospitals(40.0, -74.0, hospitals, k=10)
+    assert total == 200 and len(ranked) == 10
+    dist = haversine_km(40.0, -74.0, [h["Latitude"] for h in hospitals], [h["Longitude"] for h in hospitals])
+    assert [h["osm_id"] for h in ranked] == np.argsort(dist)[:10].tolist()
+    assert [h["Distance (km)"] for h in ranked] == sorted(h["Distance (km)"] for h in ranked)
+
+
+def test_rank_hospitals_counts_distinct_hospitals():
+    hospitals = [_hospital("A", 40.7, -74.0), _hospital("A", _NEAR, -74.0, "way"), _hospital("B", 40.8, -74.0)]
+    ranked, total = rank_hospitals(40.7, -74.0, hospitals)
+    assert total == 2 and [h["osm_type"] for h in ranked] == ["node", "node"]
+    assert rank_hospitals(40.7, -74.0, []) == ([], 0)
+
+
+def test_paginate_clamps_the_page():
+    items = list(range(23))
+    assert paginate(items, 1, 10) == (list(range(10)), 3)
+    assert paginate(items, 3, 10) == ([20, 21, 22], 3)
+    assert paginate(items, 9, 10) == ([20, 21, 22], 3)
+    assert paginate(items, 0, 10) == (list(range(10)), 3)
+    assert paginate([], 1, 10) == ([], 1)
@@ -0,0 +1,295 @@
+import time
+
+import pytest
+import requests
+
+import config
+import http_client
+from http_client import CircuitBreaker, EndpointGroup, RateLimited, TokenBucket, UpstreamError
+
+
+def _response(status=200, body=b"ok"):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+class FakeSession:
+    """Answers by URL: a number is a delay before a 200, an exception is raised, an int >= 100 is a status."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(url)
+        outcome = self.behaviour[url]
+        if isinstance(outcome, Exception):
+            raise outcome
+        if isinstance(outcome, int) and outcome >= 100:
+            return _response(outcome)
+        time.sleep(outcome)
+        return _response(body=url.encode())
+
+
+@pytest.fixture
+def group(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(config, "HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(http_client, "limiter_for", lambda url: None)
+
+    def make(behaviour):
+        session = FakeSession(behaviour)
+        monkeypatch.setattr(http_client, "get_session", lambda: session)
+        g = EndpointGroup("test", list(behaviour), timeout=2)
+        g.session = session
+        return g
+
+    return make
+
+
+# -------------------------------
+# CircuitBreaker
+# -------------------------------
+def test_breaker_opens_after_max_failures_and_allows_one_trial():
+    breaker = CircuitBreaker(max_failures=2, reset_after=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+
+
+def test_breaker_trial_outcomes():
+    breaker = CircuitBreaker(max_failures=1, reset_after=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()  # failed trial: open again for another reset_after
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_release_trial_frees_the_slot():
+    breaker = CircuitBreaker(max_failures=1, reset_after=0.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == "half-open" and breaker.allow()
+
+
+# -------------------------------
+# TokenBucket
+# -------------------------------
+def test_bucket_burst_then_empty():
+    bucket = TokenBucket("h", rate=1, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.stats["granted"] == 3
+
+
+def test_bucket_queues_within_max_wait():
+    bucket = TokenBucket("h", rate=20, burst=1, max_wait=1)
+    bucket.acquire()
+    started = time.monotonic()
+    bucket.acquire()
+    assert 0.03 <= time.monotonic() - started < 0.5
+    assert bucket.stats["queued"] == 1
+
+
+def test_bucket_rejects_beyond_max_wait():
+    bucket = TokenBucket("h", rate=1, burst=1, max_wait=0.5)
+    bucket.acquire()
+    with pytest.raises(RateLimited) as raised:
+        bucket.acquire()
+    assert raised.value.retry_after > 0.5
+    assert bucket.stats["rejected"] == 1
+
+
+def test_rate_limits_are_split_across_workers():
+    assert config._rate_limits("a.example=3:2,b.example=1", workers=2) == {"a.example": (1.5, 2), "b.example": (0.5, 1)}
+
+
+# -------------------------------
+# EndpointGroup: hedging and fallback
+# -------------------------------
+def test_fast_first_mirror_needs_no_hedge(group):
+    g = group({"http://a": 0, "http://b": 0})
+    assert g.get().content == b"http://a"
+    assert g.session.calls == ["http://a"] and g.stats["hedges"] == 0
+
+
+def test_slow_first_mirror_is_hedged(group):
+    g = group({"http://a": 0.5, "http://b": 0})
+    assert g.get().content == b"http://b"
+    assert g.stats["hedges"] == 1 and g.stats["hedge_wins"] == 1
+
+
+def test_failed_mirror_falls_back_to_the_next(group):
+    g = group({"http://a": requests.ConnectionError("down"), "http://b": 0})
+    assert g.get().content == b"http://b"
+    assert g.breakers["http://a"].failures == 1
+
+
+def test_5xx_counts_as_failure_and_4xx_is_returned(group):
+    g = group({"http://a": 503, "http://b": 0})
+    assert g.get().content == b"http://b"
+    g = group({"http://a": 404, "http://b": 0})
+    assert g.get().status_code == 404
+
+
+def test_all_mirrors_open_short_circuits(group):
+    g = group({"http://a": 0, "http://b": 0})
+    for breaker in g.breakers.values():
+        breaker.max_failures = 1
+        breaker.record_failure()
+    with pytest.raises(UpstreamError):
+        g.get()
+    assert g.session.calls == []
+
+
+# -------------------------------
+# Half-open trial slots are handed back when the rate limiter says no
+# -------------------------------
+def _half_open(breaker):
+    breaker.max_failures, breaker.reset_after = 1, 0.0
+    breaker.record_failure()
+
+
+def test_rate_limited_first_mirror_releases_its_trial(group, monkeypatch):
+    g = group({"http://a": 0})
+    _half_open(g.breakers["http://a"])
+    bucket = TokenBucket("a", rate=0.01, burst=1, max_wait=0)
+    bucket.try_acquire()
+    monkeypatch.setattr(http_client, "limiter_for", lambda url: bucket)
+    with pytest.raises(RateLimited):
+        g.get()
+    monkeypatch.setattr(http_client, "limiter_for", lambda url: None)
+    assert g.get().content == b"http://a"  # the trial goes out once the limiter allows it
+    assert g.breakers["http://a"].state == "closed"
+
+
+def test_rate_limited_hedge_releases_its_trial(group, monkeypatch):
+    g = group({"http://a": 0.2, "http://b": 0})
+    _half_open(g.breakers["http://b"])
+    monkeypatch.setattr(http_client, "try_acquire", lambda url: False)
+    assert g.get().content == b"http://a"
+    assert g.stats["hedges"] == 0
+    assert g.breakers["http://b"].allow()
+
+
+def test_rate_limited_fallback_releases_its_trial(group, monkeypatch):
+    g = group({"http://a": requests.ConnectionError("down"), "http://b": 0})
+    _half_open(g.breakers["http://b"])
+    monkeypatch.setattr(http_client, "try_acquire", lambda url: False)
+    with pytest.raises(UpstreamError):
+        g.get()
+    assert g.breakers["http://b"].allow()
+
+
+# -------------------------------
+# aget / gather
+# -------------------------------
+def test_gather_runs_agets_concurrently(group, monkeypatch):
+    monkeypatch.setattr(http_client, "httpx", None)
+    session = FakeSession({"https://a/": 0.2, "https://b/": 0.2, "https://c/": RuntimeError("down")})
+    monkeypatch.setattr(http_client, "get_session", lambda: session)
+    started = time.monotonic()
+    a, b, c = http_client.gather(*(http_client.aget(url) for url in session.behaviour))
+    assert time.monotonic() - started < 0.35
+    assert (a.content, b.content) == (b"https://a/", b"https://b/")
+    assert isinstance(c, RuntimeError)  # returned in place, not raised
+
+
+def test_async_single_flight_shares_one_call():
+    flights = http_client.SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await http_client.asyncio.sleep(0.1)
+        return "result"
+
+    assert http_client.gather(flights.ado("k", fetch), flights.ado("k", fetch)) == ["result", "result"]
+    assert len(calls) == 1 and flights.stats == {"calls": 1, "shared": 1}
+
+
+def test_aget_retries_spend_rate_limit_tokens(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    statuses = iter([503, 503, 200])
+    transport = httpx.MockTransport(lambda request: httpx.Response(next(statuses)))
+    monkeypatch.setattr(http_client, "_new_async_client", lambda: httpx.AsyncClient(transport=transport))
+    monkeypatch.setattr(config, "HTTP_BACKOFF", 0)
+    tokens = []
+    monkeypatch.setattr(http_client, "acquire", tokens.append)
+    [response] = http_client.gather(http_client.aget("https://api.example/"))
+    assert response.status_code == 200
+    assert len(tokens) == 3
+
+
+# -------------------------------
+# get(): retries go through the rate limiter
+# -------------------------------
+class SequenceSession:
+    """Answers each call with the next outcome: a status code or an exception to raise."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, retry_after = outcome if isinstance(outcome, tuple) else (outcome, None)
+        response = _response(status)
+        if retry_after is not None:
+            response.headers["Retry-After"] = str(retry_after)
+        return response
+
+
+@pytest.fixture
+def single_host(monkeypatch):
+    monkeypatch.setattr(config, "HTTP_BACKOFF", 0)
+    tokens = []
+    monkeypatch.setattr(http_client, "acquire", tokens.append)
+
+    def make(outcomes):
+        session = SequenceSession(outcomes)
+        monkeypatch.setattr(http_client, "get_session", lambda: session)
+        return session
+
+    return make, tokens
+
+
+def test_get_retries_take_a_token_each(single_host):
+    make, tokens = single_host
+    session = make([429, requests.ConnectionError("reset"), 200])
+    assert http_client.get("https://eutils.example/esearch").status_code == 200
+    assert session.calls == 3 and len(tokens) == 3
+
+
+def test_get_gives_up_after_http_retries(single_host, monkeypatch):
+    make, tokens = single_host
+    monkeypatch.setattr(config, "HTTP_RETRIES", 1)
+    make([503, 503, 200])
+    assert http_client.get("https://eutils.example/esearch").status_code == 503
+    assert len(tokens) == 2
+
+
+def test_get_does_not_wait_out_a_long_retry_after(single_host, monkeypatch):
+    make, tokens = single_host
+    monkeypatch.setattr(config, "RATE_LIMIT_MAX_WAIT", 5)
+    session = make([(429, 120), 200])
+    started = time.monotonic()
+    assert http_client.get("https://eutils.example/esearch").status_code == 429
+    assert session.calls == 1 and time.monotonic() - started < 1
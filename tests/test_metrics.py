@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import metrics
+from metrics import ResultTimer, StageStats
+
+
+@pytest.fixture
+def traces(tmp_path, monkeypatch):
+    path = str(tmp_path / "traces.jsonl")
+    monkeypatch.setattr(metrics.config, "TRACES_PATH", path)
+    monkeypatch.setattr(metrics, "STAGES", StageStats())
+    return path
+
+
+class _Response:
+    status_code = 200
+    url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?term=x"
+    headers = {"Content-Length": "999"}
+    content = b"x" * 42
+
+
+def test_nested_spans_export_one_trace(traces):
+    with metrics.span("search") as outer:
+        with metrics.span("upstream") as inner:
+            metrics.record_response(inner, _Response())
+        with pytest.raises(ValueError), metrics.span("parse"):
+            raise ValueError("bad xml")
+        metrics.annotate(cache="miss")
+    assert outer.attributes == {"cache": "miss"}
+    assert inner.attributes == {metrics.STATUS_CODE: 200, metrics.SERVER: "eutils.ncbi.nlm.nih.gov",
+                                metrics.BODY_SIZE: 42}
+
+    with open(traces) as f:
+        lines = f.readlines()
+    assert len(lines) == 1  # only the outermost span writes
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {s["name"]: s for s in spans}
+    assert set(by_name) == {"search", "upstream", "parse"}
+    assert {s["traceId"] for s in spans} == {outer.trace_id}
+    assert by_name["upstream"]["parentSpanId"] == by_name["search"]["spanId"]
+    assert "parentSpanId" not in by_name["search"]
+    assert by_name["upstream"]["kind"] == 3 and by_name["search"]["kind"] == 1
+    assert by_name["parse"]["status"] == {"code": 2, "message": "ValueError: bad xml"}
+
+    rows = metrics.describe(outer.trace)
+    assert [r["stage"] for r in rows] == ["search", "· upstream", "· parse"]
+    assert rows[1]["bytes"] == 42 and rows[2]["error"] == "ValueError: bad xml"
+
+
+def test_read_traces_matches_live_stats(traces):
+    for _ in range(3):
+        with metrics.span("geocode", cache="hit"):
+            pass
+    live, replayed = metrics.STAGES.summary(), metrics.read_traces(traces).summary()
+    assert live.keys() == replayed.keys() == {"geocode"}
+    for stats in (live, replayed):
+        assert stats["geocode"]["count"] == 3 and stats["geocode"]["cache"] == {"hit": 3}
+
+
+def test_prometheus_text():
+    stats = StageStats(buckets=(0.1, 1))
+    stats.observe("overpass", 0.05, {metrics.STATUS_CODE: 200, metrics.BODY_SIZE: 100})
+    stats.observe("overpass", 0.5, {metrics.STATUS_CODE: 429, metrics.BODY_SIZE: 10}, error="HTTPError")
+    stats.observe('say "hi"', 2.0, {metrics.CACHE: "stale"})
+    text = stats.prometheus_text(prefix="t").splitlines()
+    assert 't_stage_duration_seconds_bucket{stage="overpass",le="0.1"} 1' in text
+    assert 't_stage_duration_seconds_bucket{stage="overpass",le="1"} 2' in text
+    assert 't_stage_duration_seconds_bucket{stage="overpass",le="+Inf"} 2' in text
+    assert 't_stage_duration_seconds_bucket{stage="say \\"hi\\"",le="1"} 0' in text
+    assert 't_stage_errors_total{stage="overpass"} 1' in text
+    assert 't_upstream_responses_total{stage="overpass",code="429"} 1' in text
+    assert 't_upstream_bytes_total{stage="overpass"} 110' in text
+    assert 't_cache_lookups_total{stage="say \\"hi\\"",result="stale"} 1' in text
+    summary = stats.summary()["overpass"]
+    assert (summary["p50"], summary["p99"], summary["errors"]) == (0.5, 0.5, 1)
+
+
+def test_result_timer_records_first_result(tmp_path, monkeypatch):
+    path = tmp_path / "timings.jsonl"
+    monkeypatch.setattr(metrics.config, "QUERY_TIMINGS_PATH", str(path))
+    timer = ResultTimer("research", "melanoma")
+    timer.hit()
+    timer.hit()
+    entry = timer.finish()
+    assert entry["results"] == 2 and entry["first_result_ms"] <= entry["total_ms"]
+    assert ResultTimer("trials", "x").finish(error=RuntimeError("down"))["first_result_ms"] is None
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(e["section"], e.get("error")) for e in lines] == [("research", None), ("trials", "down")]
@@ -0,0 +1,92 @@
+import pytest
+
+import config
+import notifications
+from notifications import SubscriptionStore
+
+
+class FakePool:
+    def __init__(self, error=None):
+        self.messages = []
+        self.error = error
+
+    def send(self, message):
+        if self.error:
+            raise self.error
+        self.messages.append(message)
+
+    def send_many(self, messages):
+        self.messages += messages
+        return [None] * len(messages)
+
+
+@pytest.fixture
+def store():
+    return SubscriptionStore(":memory:")
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(notifications, "poll_term", lambda term, since: ["3", "2", "1"])
+    monkeypatch.setattr(notifications, "esummary", lambda pmids: [{"pmid": p, "title": f"T{p}"} for p in pmids])
+
+
+def test_only_confirmed_subscriptions_get_digests(store, upstream):
+    pool = FakePool()
+    notifications.request_subscription("A@example.com", "Breast  Cancer", store, pool).result()
+    [confirmation] = pool.messages
+    assert confirmation["To"] == "a@example.com"
+    token = confirmation.get_content().split("?confirm=")[1].split()[0]
+
+    assert notifications.run_once(store, pool)["digests"] == 0
+    assert store.counts()["pending"] == 1
+
+    assert store.confirm(token)
+    assert notifications.run_once(store, pool)["digests"] == 1
+    assert store.counts() == {"subscriptions": 1, "pending": 0, "addresses": 1, "terms": 1}
+
+
+def test_subscribing_again_sends_no_new_token_once_confirmed(store, monkeypatch):
+    monkeypatch.setattr(config, "NOTIFY_CONFIRM_COOLDOWN", 0)
+    token = store.subscribe("a@example.com", "melanoma")
+    assert store.subscribe("a@example.com", "Melanoma") == token  # still pending: same link
+    store.confirm(token)
+    assert store.subscribe("a@example.com", "melanoma") is None
+    assert notifications.request_subscription("a@example.com", "melanoma", store, FakePool()) is None
+
+
+def test_confirmations_are_not_resent_within_the_cooldown(store):
+    assert store.subscribe("a@example.com", "melanoma")
+    assert store.subscribe("a@example.com", "melanoma") is None
+
+
+def test_confirmations_per_address_are_capped(store, monkeypatch):
+    monkeypatch.setattr(config, "NOTIFY_CONFIRM_MAX", 2)
+    assert store.subscribe("a@example.com", "term one")
+    assert store.subscribe("a@example.com", "term two")
+    assert store.subscribe("a@example.com", "term three") is None
+    assert store.subscribe("b@example.com", "term three")
+
+
+def test_a_failed_send_can_be_retried(store):
+    sending = notifications.request_subscription("a@example.com", "glioma", store, FakePool(OSError("refused")))
+    with pytest.raises(OSError):
+        sending.result()
+    pool = FakePool()
+    notifications.request_subscription("a@example.com", "glioma", store, pool).result()
+    assert len(pool.messages) == 1
+
+
+def test_unconfirmed_sign_ups_expire(store, monkeypatch):
+    token = store.subscribe("a@example.com", "glioma")
+    monkeypatch.setattr(config, "NOTIFY_CONFIRM_TTL", -1)
+    assert not store.confirm(token)
+    store.advance({})
+    assert store.counts()["pending"] == 0
+    assert not store.unsubscribe(token)
+
+
+def test_sent_lookup_uses_the_pmid_index(store):
+    plan = store._db.execute("EXPLAIN QUERY PLAN SELECT subscriber, pmid FROM sent WHERE pmid IN (?, ?)",
+                             ("1", "2")).fetchall()
+    assert any("sent_pmid" in row[-1] for row in plan)
@@ -0,0 +1,92 @@
+import itertools
+import json
+
+import pytest
+
+import research
+from research import ResearchStore
+
+_terms = itertools.count()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake ESearch answering from ``state["ids"]`` (newest first); every call is logged."""
+    state = {"ids": [], "calls": []}
+
+    def esearch(term, retmax=10, **extra):
+        state["calls"].append(extra)
+        return {"idlist": state["ids"][:retmax]}
+
+    def esummary(pmids):
+        return [{"pmid": p, "title": f"Article {p}", "journal": "J", "pub_date": "2024",
+                 "sort_date": f"2024-01-{int(p):02d}"} for p in pmids]
+
+    monkeypatch.setattr(research, "esearch", esearch)
+    monkeypatch.setattr(research, "esummary", esummary)
+    monkeypatch.setattr(research, "index_articles", lambda articles: None)
+    return state
+
+
+def test_delta_syncs_always_ask_upstream(upstream):
+    store = ResearchStore(":memory:", fresh_for=0)
+    term = f"delta term {next(_terms)}"
+
+    upstream["ids"] = ["5", "4", "3"]
+    records, _ = store.sync(term, 3, allow_stale=False)
+    assert [r["pmid"] for r in records] == ["5", "4", "3"]
+
+    upstream["ids"] = ["6", "5", "4"]
+    store.sync(term, 3, allow_stale=False)
+    upstream["ids"] = ["7", "6", "5"]
+    records, _ = store.sync(term, 3, allow_stale=False)
+
+    assert [r["pmid"] for r in records] == ["7", "6", "5"]
+    assert [bool(c) for c in upstream["calls"]] == [False, True, True]  # one full search, then deltas
+    assert store.stored_pmids(["6", "7"]) == {"6", "7"}
+
+
+def test_full_search_is_shared_but_not_stale(upstream):
+    term = f"shared term {next(_terms)}"
+    upstream["ids"] = ["2", "1"]
+    ResearchStore(":memory:").sync(term, 2)
+    # Another process's store finds the fresh search in the shared cache.
+    records, _ = ResearchStore(":memory:").sync(term, 2)
+    assert [r["pmid"] for r in records] == ["2", "1"]
+    assert len(upstream["calls"]) == 1
+
+
+def test_esummary_fetches_batches_concurrently(monkeypatch):
+    in_flight, peak = [0], [0]
+
+    async def aget(url, params=None, **kwargs):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await research.http_client.asyncio.sleep(0.05)
+        in_flight[0] -= 1
+        ids = params["id"].split(",")
+        response = research.http_client.requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(
+            {"result": {p: {"title": f"Article {p}", "pubdate": "2024"} for p in ids}}).encode()
+        return response
+
+    monkeypatch.setattr(research.http_client, "aget", aget)
+    pmids = [str(900_000 + next(_terms) * 100 + i) for i in range(7)]
+    records = research.esummary(pmids, batch_size=2)
+    assert [r["pmid"] for r in records] == pmids
+    assert peak[0] == 4
+
+
+def test_store_file_is_shared_in_wal_mode(tmp_path, upstream):
+    path = str(tmp_path / "research.sqlite")
+    writer, reader = ResearchStore(path, fresh_for=3600), ResearchStore(path, fresh_for=3600)
+    assert writer._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    upstream["ids"] = ["2", "1"]
+    term = f"wal-{next(_terms)}"
+    writer.sync(term, 2)
+    writer._db.execute("BEGIN IMMEDIATE")  # another process mid-write doesn't block readers
+    try:
+        assert [r["pmid"] for r in reader.cached(term, 2)] == ["2", "1"]
+    finally:
+        writer._db.rollback()
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import research_index
+from research_index import BM25Index
+
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "research_index.npz")
+    monkeypatch.setattr(research_index.config, "RESEARCH_INDEX_PATH", path)
+    monkeypatch.setattr(research_index, "_index", None)
+    monkeypatch.setitem(research_index._on_disk, "version", None)
+    return path
+
+
+def test_save_leaves_no_temporary_files(index_path):
+    index = BM25Index()
+    index.add_documents([("1", "breast cancer screening")])
+    index.save(index_path)
+    index.save(index_path)
+    assert os.listdir(os.path.dirname(index_path)) == ["research_index.npz"]
+    assert [pmid for pmid, _ in BM25Index.load(index_path).search("screening")] == ["1"]
+
+
+def test_merge_from_adds_only_missing_documents():
+    ours, theirs = BM25Index(), BM25Index()
+    ours.add_documents([("1", "lung cancer immunotherapy"), ("2", "melanoma staging")])
+    theirs.add_documents([("2", "something else entirely"), ("3", "pancreatic cancer immunotherapy trial")])
+    assert ours.merge_from(theirs) == 1
+    assert len(ours) == 3
+    assert sorted(pmid for pmid, _ in ours.search("immunotherapy")) == ["1", "3"]
+    assert [pmid for pmid, _ in ours.search("melanoma")] == ["2"]
+    assert ours.search("entirely") == []
+    assert ours.merge_from(theirs) == 0
+
+
+def test_save_index_merges_another_process_save(index_path):
+    research_index.index_articles([("1", "glioblastoma radiotherapy")])
+    research_index.flush()
+
+    # Another process loads the same file, adds a document and saves.
+    other = BM25Index.load(index_path)
+    other.add_documents([("2", "leukemia radiotherapy outcomes")])
+    other.save(index_path)
+    os.utime(index_path, ns=(1, 1))  # make the change visible even on coarse mtimes
+
+    research_index.index_articles([("3", "sarcoma radiotherapy")])
+    research_index.flush()
+    saved = BM25Index.load(index_path)
+    assert sorted(pmid for pmid, _ in saved.search("radiotherapy")) == ["1", "2", "3"]
+
+
+def test_index_articles_defers_the_save(index_path, monkeypatch):
+    monkeypatch.setattr(research_index.config, "RESEARCH_INDEX_SAVE_DELAY", 3600)
+    research_index.index_articles([("1", "colorectal cancer")])
+    research_index.index_articles([("2", "prostate cancer")])
+    assert not os.path.exists(index_path)
+    research_index.flush()
+    assert len(BM25Index.load(index_path)) == 2
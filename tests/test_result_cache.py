@@ -0,0 +1,28 @@
+import time
+
+from result_cache import ResultStore
+
+
+def test_entries_are_keyed_by_section_and_key():
+    store = ResultStore()
+    store.set("research", ("melanoma", 10), ["a"])
+    assert store.get("research", ("melanoma", 10)) == ["a"]
+    assert store.get("trials", ("melanoma", 10)) is None
+    assert store.get("research", ("melanoma", 20)) is None
+
+
+def test_entries_expire():
+    store = ResultStore(ttl=0.05)
+    store.set("research", "k", ["a"])
+    time.sleep(0.06)
+    assert store.get("research", "k") is None
+    assert not store._lru
+
+
+def test_least_recently_used_is_evicted():
+    store = ResultStore(maxsize=2)
+    store.set("s", 1, "one")
+    store.set("s", 2, "two")
+    store.get("s", 1)
+    store.set("s", 3, "three")
+    assert [store.get("s", k) for k in (1, 2, 3)] == ["one", None, "three"]
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import pytest
+
+import shared_cache
+from shared_cache import SQLiteCache, make_key
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SQLiteCache(":memory:")
+    monkeypatch.setattr(shared_cache, "_cache", cache)
+    return cache
+
+
+def test_make_key_is_canonical():
+    assert make_key("geo", {"b": 1, "a": " x  y "}, 1.0000001) == make_key("geo", {"a": "x y", "b": 1}, 1.0)
+    assert make_key("geo", "Boston") != make_key("geo", "boston")
+    assert make_key("geo", "x") != make_key("overpass", "x")
+
+
+def test_expired_entries_are_misses():
+    cache = SQLiteCache(":memory:")
+    cache.set_many([("a", [1, 2]), ("b", {"x": 1})], ttl=60)
+    cache.set("c", "gone", ttl=-1)
+    assert cache.get_many(["a", "b", "c", "d"]) == {"a": [1, 2], "b": {"x": 1}}
+    assert cache.stats["hits"] == 2 and cache.stats["misses"] == 2
+
+
+def test_eviction_drops_expired_then_least_recently_used():
+    cache = SQLiteCache(":memory:")
+    cache.set_many([(f"k{i}", os.urandom(1000).hex()) for i in range(5)], ttl=60)
+    for i in range(5):  # k1 is the least recently used, k0 the most
+        cache._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (10 if i == 0 else i, f"k{i}"))
+    cache.set("expired", "old", ttl=-1)
+    size = cache._db.execute("SELECT MAX(size) FROM cache").fetchone()[0]
+    cache.max_bytes = int(size * 5.5)
+    cache.set("k5", os.urandom(1000).hex(), ttl=60)
+    keys = {k for (k,) in cache._db.execute("SELECT key FROM cache")}
+    assert keys == {"k0", "k3", "k4", "k5"}
+    assert cache._size <= cache.max_bytes * 0.9
+    assert cache.stats["evictions"] == 2
+
+
+def test_cached_serves_stale_values_while_revalidating(cache):
+    calls = []
+    refreshed = threading.Event()
+
+    def compute():
+        calls.append(len(calls))
+        if len(calls) > 1:
+            refreshed.set()
+        return {"n": len(calls)}
+
+    assert shared_cache.cached("demo", ("a",), 0.05, compute, stale_for=60) == {"n": 1}
+    assert shared_cache.cached("demo", ("a",), 0.05, compute, stale_for=60) == {"n": 1}
+    assert calls == [0]
+    time.sleep(0.1)
+    assert shared_cache.cached("demo", ("a",), 0.05, compute, stale_for=60) == {"n": 1}  # stale copy
+    assert refreshed.wait(5)
+    key = make_key("demo", "a")
+    deadline = time.time() + 5
+    while cache.get(key)["value"] != {"n": 2} and time.time() < deadline:
+        time.sleep(0.01)
+    assert shared_cache.cached("demo", ("a",), 0.05, compute, stale_for=60) == {"n": 2}
+    assert len(calls) == 2
+
+
+def test_cached_does_not_store_none(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+
+    assert shared_cache.cached("demo", ("none",), 60, compute) is None
+    assert shared_cache.cached("demo", ("none",), 60, compute) is None
+    assert len(calls) == 2
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+
+import pytest
+
+import trials
+from trials import distance_key, iter_nearby_studies, rank_by_distance, study_record
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+import fixtures  # noqa: E402
+
+NYC = (40.7128, -74.0060)
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """ClinicalTrials.gov pages from the bench fixture generator; ``fetched`` logs each page request."""
+    fetched = []
+
+    def fetch_page(params):
+        fetched.append(params.get("pageToken"))
+        _, body = fixtures.ct_studies({k: str(v) for k, v in params.items()}, 45)
+        page = json.loads(body)
+        return {"studies": page.get("studies", []), "next": page.get("nextPageToken")}
+
+    monkeypatch.setattr(trials, "_fetch_page", fetch_page)
+    return fetched
+
+
+def test_nearby_studies_stream_before_later_pages_load(pages):
+    stream = iter_nearby_studies("lung cancer", *NYC, 500, max_results=40, page_size=10)
+    first = next(stream)
+    assert "distance_km" in first and pages == [None]
+    list(stream)
+    assert len(pages) == 4
+
+
+def test_sorted_stream_matches_ranking_the_whole_set(pages):
+    streamed = sorted(iter_nearby_studies("lung cancer", *NYC, 500, max_results=40, page_size=10), key=distance_key)
+    raw = [study for params in [trials.search_params("lung cancer", near=(*NYC, 500))]
+           for studies in trials.iter_pages(params, 10, cache=False) for study in studies][:40]
+    whole = rank_by_distance(*NYC, [study_record(s) for s in raw], 500)
+    assert [r["nct_id"] for r in streamed] == [r["nct_id"] for r in whole]
@@ -0,0 +1,79 @@
+import pytest
+
+from trials import rank_by_distance
+from trials_index import TrialIndex
+
+
+def _study(nct_id, title, conditions, sites, status="Recruiting", phase="Phase 2", last_update="2024-01-01"):
+    sites = [{"facility": f, "label": label, "status": s, "lat": lat, "lon": lon} for f, label, s, lat, lon in sites]
+    return {"nct_id": nct_id, "title": title, "status": status, "phase": phase, "conditions": conditions,
+            "locations": list(dict.fromkeys(s["label"] for s in sites)), "sites": sites,
+            "last_update": last_update, "link": f"https://clinicaltrials.gov/study/{nct_id}"}
+
+
+BOSTON = ("Dana-Farber", "Boston, Massachusetts, United States", "RECRUITING", 42.337, -71.107)
+CAMBRIDGE = ("MIT Clinic", "Cambridge, Massachusetts, United States", "COMPLETED", 42.36, -71.09)
+NEW_YORK = ("Memorial Sloan Kettering", "New York, New York, United States", "RECRUITING", 40.764, -73.956)
+STUDIES = [
+    _study("NCT001", "Immunotherapy in non-small cell lung cancer", ["Lung Cancer"], [BOSTON, NEW_YORK]),
+    _study("NCT002", "Targeted therapy after surgery", ["Breast Cancer"], [NEW_YORK], phase="Phase 3",
+           last_update="2024-03-01"),
+    _study("NCT003", "Lung cancer screening", ["Lung Neoplasms"], [CAMBRIDGE], status="Completed",
+           phase="Not Applicable"),
+    _study("NCT004", "Radiotherapy for lung tumours", ["Lung Cancer"], [NEW_YORK, CAMBRIDGE],
+           status="Active, not recruiting", phase="Phase 1, Phase 2"),
+]
+
+
+@pytest.fixture
+def index():
+    index = TrialIndex(":memory:")
+    assert index.add(STUDIES) == len(STUDIES)
+    return index
+
+
+def _ids(records):
+    return [r["nct_id"] for r in records]
+
+
+def test_search_matches_every_condition_word(index):
+    assert sorted(_ids(index.search("lung cancer"))) == ["NCT001", "NCT003", "NCT004"]
+    assert _ids(index.search("breast")) == ["NCT002"]
+    assert index.search("pancreatic") == []
+
+
+def test_search_filters_by_location_phase_and_status(index):
+    assert sorted(_ids(index.search("lung", "boston"))) == ["NCT001"]
+    assert sorted(_ids(index.search("lung", phase="Phase 2"))) == ["NCT001", "NCT004"]
+    assert _ids(index.search("lung", phase="Phase 1")) == ["NCT004"]
+    assert _ids(index.search("lung", status="Completed")) == ["NCT003"]
+    assert _ids(index.search("", limit=2)) == ["NCT002", "NCT001"]  # no text: newest update first
+
+
+def test_re_adding_a_study_replaces_it(index):
+    index.add([_study("NCT003", "Lung cancer screening", ["Lung Neoplasms"], [NEW_YORK], status="Recruiting")])
+    assert len(index) == len(STUDIES)
+    assert _ids(index.search("lung", "cambridge")) == ["NCT004"]
+    assert [r["status"] for r in index.search("screening")] == ["Recruiting"]
+    assert "NCT003" in _ids(index.nearby(40.76, -73.95, 5))
+
+
+def test_nearby_matches_ranking_the_live_results(index):
+    lat, lon = 42.35, -71.1
+    nearby = index.nearby(lat, lon, 400, "lung")
+    expected = rank_by_distance(lat, lon, [s for s in STUDIES if "Lung" in " ".join(s["conditions"])], 400)
+    assert _ids(nearby) == _ids(expected)
+    assert [(r["distance_km"], r["nearest_site"]) for r in nearby] == \
+        [(r["distance_km"], r["nearest_site"]) for r in expected]
+
+
+def test_nearby_prefers_recruiting_sites_and_respects_radius_and_limit(index):
+    # NCT004's Cambridge site is closest but completed, so its recruiting New York site is reported.
+    records = {r["nct_id"]: r for r in index.nearby(42.36, -71.09, 400)}
+    assert records["NCT004"]["nearest_site"]["facility"] == "Memorial Sloan Kettering"
+    assert records["NCT003"]["nearest_site"]["facility"] == "MIT Clinic"  # no recruiting site: nearest one
+    assert records["NCT001"]["nearest_site"]["facility"] == "Dana-Farber"
+    assert list(records)[:1] == ["NCT001"]
+    assert _ids(index.nearby(42.36, -71.09, 10)) == ["NCT001", "NCT003", "NCT004"]
+    assert len(index.nearby(42.36, -71.09, 400, limit=2)) == 2
+    assert index.nearby(0.0, 0.0, 50) == []
@@ -0,0 +1,209 @@
+"""ClinicalTrials.gov search for the Clinical Trials Finder, against the v2 JSON API.
+
+Only the fields we display are requested, pages are followed with
+``pageToken`` one at a time, and each page is reduced to compact study records
+before the next one is requested, so memory is bounded by the page size rather
+than by the number of trials.
+"""
+import numpy as np
+
+import config
+import http_client
+import metrics
+import shared_cache
+from geo import haversine_km
+
+# Fields we display, plus site coordinates, conditions and the last update date
+# used by the offline index.
+FIELDS = ",".join((
+    "NCTId", "BriefTitle", "OfficialTitle", "OverallStatus", "Phase", "Condition", "LastUpdatePostDate",
+    "LocationFacility", "LocationCity", "LocationState", "LocationCountry",
+    "LocationStatus", "LocationGeoPoint",
+))
+
+PHASES = {
+    "Phase 1": "PHASE1",
+    "Phase 2": "PHASE2",
+    "Phase 3": "PHASE3",
+    "Phase 4": "PHASE4",
+}
+_PHASE_LABELS = {"EARLY_PHASE1": "Early Phase 1", "NA": "Not Applicable", **{v: k for k, v in PHASES.items()}}
+
+STATUSES = {
+    "Recruiting": "RECRUITING",
+    "Not yet recruiting": "NOT_YET_RECRUITING",
+    "Active, not recruiting": "ACTIVE_NOT_RECRUITING",
+    "Enrolling by invitation": "ENROLLING_BY_INVITATION",
+    "Completed": "COMPLETED",
+}
+_STATUS_LABELS = {v: k for k, v in STATUSES.items()}
+
+
+def search_params(condition, location=None, phase="All", status="All", near=None):
+    """API parameters. ``near=(lat, lon, radius_km)`` filters by site distance instead of location text."""
+    params = {"query.cond": condition, "fields": FIELDS, "format": "json"}
+    if near:
+        params["filter.geo"] = f"distance({near[0]:.5f},{near[1]:.5f},{near[2]:g}km)"
+    elif location:
+        params["query.locn"] = location
+    if phase in PHASES:
+        params["filter.advanced"] = f"AREA[Phase]{PHASES[phase]}"
+    if status in STATUSES:
+        params["filter.overallStatus"] = STATUSES[status]
+    return params
+
+
+def _site_label(loc):
+    return ", ".join(p for p in (loc.get("city"), loc.get("state"), loc.get("country")) if p)
+
+
+def study_record(study):
+    """Compact record from one v2 ``studies[]`` entry."""
+    protocol = study.get("protocolSection", {})
+    ident = protocol.get("identificationModule", {})
+    nct_id = ident.get("nctId", "")
+    sites = []
+    for loc in protocol.get("contactsLocationsModule", {}).get("locations", []):
+        geo = loc.get("geoPoint") or {}
+        sites.append({
+            "facility": loc.get("facility", ""),
+            "label": _site_label(loc),
+            "status": loc.get("status", ""),
+            "lat": geo.get("lat"),
+            "lon": geo.get("lon"),
+        })
+    phases = protocol.get("designModule", {}).get("phases", [])
+    status_module = protocol.get("statusModule", {})
+    status = status_module.get("overallStatus", "")
+    return {
+        "nct_id": nct_id,
+        "title": ident.get("officialTitle") or ident.get("briefTitle") or "No Title",
+        "status": _STATUS_LABELS.get(status) or status.replace("_", " ").capitalize() or "Status Unknown",
+        "phase": ", ".join(_PHASE_LABELS.get(p, p) for p in phases) or "N/A",
+        "conditions": protocol.get("conditionsModule", {}).get("conditions", []),
+        "locations": list(dict.fromkeys(s["label"] for s in sites if s["label"])),
+        "sites": sites,
+        "last_update": status_module.get("lastUpdatePostDateStruct", {}).get("date", ""),
+        "link": f"https://clinicaltrials.gov/study/{nct_id}" if nct_id else "#",
+    }
+
+
+def _fetch_page(params):
+    response = http_client.get(config.CT_API_URL, params=params)
+    response.raise_for_status()
+    with metrics.span("ct.parse"):
+        page = response.json()
+    return {"studies": page.get("studies", []), "next": page.get("nextPageToken")}
+
+
+def iter_pages(params, page_size=config.CT_PAGE_SIZE, cache=True):
+    """Yield the raw ``studies`` list of each page, following ``nextPageToken``.
+
+    With ``cache``, each page goes through the shared cache; query text is
+    case-insensitive there as in the API.
+    """
+    params = dict(params, pageSize=page_size)
+    while True:
+        if cache:
+            key_params = {k: v.casefold() if k.startswith("query.") else v for k, v in params.items()}
+            page = shared_cache.cached("ct-page", (config.CT_API_URL, key_params), config.CT_CACHE_TTL,
+                                       lambda: _fetch_page(params))
+        else:
+            page = _fetch_page(params)
+        yield page["studies"]
+        if not page["next"]:
+            return
+        params["pageToken"] = page["next"]
+
+
+def iter_studies(condition, location=None, phase="All", max_results=config.CT_DEFAULT_RESULTS,
+                 page_size=config.CT_PAGE_SIZE, status="All", near=None):
+    """Study records for a search, streamed page by page, up to ``max_results``."""
+    max_results = min(max_results, config.CT_MAX_RESULTS)
+    count = 0
+    params = search_params(condition, location, phase, status, near)
+    for studies in iter_pages(params, min(page_size, max_results)):
+        for study in studies:
+            yield study_record(study)
+            count += 1
+            if count >= max_results:
+                return
+
+
+# -------------------------------
+# Distance ranking
+# -------------------------------
+def site_is_recruiting(site_status, study_status):
+    """Sites without their own status inherit the study's."""
+    return site_status == "RECRUITING" or (not site_status and study_status == "Recruiting")
+
+
+def nearest_sites(owners, distances, recruiting):
+    """Pick one site per study: its nearest recruiting site, else its nearest site.
+
+    Takes parallel site arrays (owning study, distance, recruiting flag) and
+    returns the positions of the chosen sites, ordered best study first:
+    studies with a recruiting site come before those without, each by distance.
+    """
+    owners = np.asarray(owners)
+    if not len(owners):
+        return np.zeros(0, dtype=np.int64)
+    rank = np.where(recruiting, 0, 1)
+    order = np.lexsort((distances, rank, owners))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = owners[order][1:] != owners[order][:-1]
+    best = order[first]
+    return best[np.lexsort((distances[best], rank[best]))]
+
+
+def rank_by_distance(lat, lon, studies, radius_km=None):
+    """Studies sorted by nearest recruiting site, each with ``distance_km`` and ``nearest_site`` added.
+
+    Studies without a geocoded site (within ``radius_km``, if given) are dropped.
+    """
+    owners, lats, lons, recruiting, sites = [], [], [], [], []
+    for n, study in enumerate(studies):
+        for site in study["sites"]:
+            if site.get("lat") is not None and site.get("lon") is not None:
+                owners.append(n)
+                lats.append(site["lat"])
+                lons.append(site["lon"])
+                recruiting.append(site_is_recruiting(site["status"], study["status"]))
+                sites.append(site)
+    if not owners:
+        return []
+    owners = np.asarray(owners)
+    recruiting = np.asarray(recruiting)
+    dist = haversine_km(lat, lon, lats, lons)
+    keep = np.flatnonzero(dist <= radius_km) if radius_km is not None else np.arange(len(dist))
+    ranked = []
+    for i in keep[nearest_sites(owners[keep], dist[keep], recruiting[keep])]:
+        record = dict(studies[owners[i]], distance_km=round(float(dist[i]), 1), nearest_site=sites[i])
+        ranked.append(record)
+    return ranked
+
+
+def iter_nearby_studies(condition, lat, lon, radius_km, phase="All", max_results=config.CT_DEFAULT_RESULTS,
+                        page_size=config.CT_PAGE_SIZE, status="All"):
+    """Studies with a site within ``radius_km``, streamed page by page, each page ranked by distance.
+
+    Records carry ``distance_km`` and ``nearest_site``. Order is only by page;
+    sort the collected records with :func:`distance_key` for the overall ranking.
+    """
+    max_results = min(max_results, config.CT_MAX_RESULTS)
+    count = 0
+    params = search_params(condition, phase=phase, status=status, near=(lat, lon, radius_km))
+    for studies in iter_pages(params, min(page_size, max_results)):
+        records = [study_record(study) for study in studies[:max_results - count]]
+        count += len(records)
+        with metrics.span("trials.rank", studies=len(records)):
+            ranked = rank_by_distance(lat, lon, records, radius_km)
+        yield from ranked
+        if count >= max_results:
+            return
+
+
+def distance_key(record):
+    """Sort key of :func:`rank_by_distance`: studies with a recruiting nearest site first, then by distance."""
+    recruiting = site_is_recruiting(record["nearest_site"]["status"], record["status"])
+    return (not recruiting, record["distance_km"])
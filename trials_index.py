@@ -0,0 +1,271 @@
+"""Offline full-text index of ClinicalTrials.gov studies (SQLite FTS5).
+
+Load a registry snapshot once, then keep it current with an incremental sync:
+
+    python trials_index.py ingest ctg-studies.json.zip
+    python trials_index.py sync            # e.g. nightly from cron
+
+The snapshot can be the ZIP of per-study JSON files offered as the registry's
+bulk download, a directory of such files, a JSON file holding a list of studies
+(or an API page with a ``studies`` key), or one study per line (``.jsonl``).
+Every study is reduced to the same compact record the live search returns;
+conditions, title and site locations go into an FTS5 table, status and phase
+into plain columns for filtering, and every site with coordinates into an
+R*Tree for radius searches. ``sync`` asks the v2 API only for studies
+whose last update was posted on or after the newest date already stored.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zipfile
+
+import numpy as np
+
+import config
+from geo import bounding_box, haversine_km
+from trials import FIELDS, iter_pages, nearest_sites, site_is_recruiting, study_record
+
+_WORD = re.compile(r"\w+")
+_BATCH = 1000
+
+
+def _match_expr(condition, location=None):
+    """FTS5 query: every word of the condition in conditions/title, every word of the location in locations."""
+    def phrase(text):
+        return " AND ".join(f'"{w}"' for w in _WORD.findall(text.casefold()))
+
+    parts = []
+    if condition and phrase(condition):
+        parts.append(f"{{conditions title}} : ({phrase(condition)})")
+    if location and phrase(location):
+        parts.append(f"locations : ({phrase(location)})")
+    return " AND ".join(parts)
+
+
+class TrialIndex:
+    def __init__(self, path=config.TRIALS_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS studies (
+                id INTEGER PRIMARY KEY, nct_id TEXT UNIQUE, status TEXT, phase TEXT,
+                last_update TEXT, data TEXT);
+            CREATE INDEX IF NOT EXISTS studies_status ON studies (status);
+            CREATE VIRTUAL TABLE IF NOT EXISTS studies_fts USING fts5 (
+                conditions, title, locations, tokenize = 'unicode61 remove_diacritics 2');
+            CREATE TABLE IF NOT EXISTS sites (
+                id INTEGER PRIMARY KEY, study_id INTEGER, site INTEGER, lat REAL, lon REAL, recruiting INTEGER);
+            CREATE INDEX IF NOT EXISTS sites_study ON sites (study_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS sites_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+        """)
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM studies").fetchone()[0]
+
+    def last_update(self):
+        """Newest ``last_update`` date stored (``YYYY-MM-DD``), or ``None`` for an empty index."""
+        return self._db.execute("SELECT MAX(last_update) FROM studies").fetchone()[0]
+
+    def add(self, records):
+        """Insert or replace study records, committing every ``_BATCH``. Returns how many were written."""
+        count = 0
+        batch = []
+        for record in records:
+            if record["nct_id"]:
+                batch.append(record)
+            if len(batch) >= _BATCH:
+                count += self._write(batch)
+                batch = []
+        if batch:
+            count += self._write(batch)
+        return count
+
+    def _write(self, records):
+        with self._lock, self._db:
+            for r in records:
+                old = self._db.execute("SELECT id FROM studies WHERE nct_id = ?", (r["nct_id"],)).fetchone()
+                if old:
+                    self._db.execute("DELETE FROM studies_fts WHERE rowid = ?", old)
+                    self._db.execute("DELETE FROM sites_rtree WHERE id IN (SELECT id FROM sites WHERE study_id = ?)", old)
+                    self._db.execute("DELETE FROM sites WHERE study_id = ?", old)
+                    self._db.execute("DELETE FROM studies WHERE id = ?", old)
+                rowid = self._db.execute(
+                    "INSERT INTO studies (nct_id, status, phase, last_update, data) VALUES (?, ?, ?, ?, ?)",
+                    (r["nct_id"], r["status"], r["phase"], r.get("last_update", ""),
+                     json.dumps(r, separators=(",", ":"))),
+                ).lastrowid
+                places = r["locations"] + [s["facility"] for s in r.get("sites", []) if s.get("facility")]
+                self._db.execute(
+                    "INSERT INTO studies_fts (rowid, conditions, title, locations) VALUES (?, ?, ?, ?)",
+                    (rowid, " ; ".join(r.get("conditions", [])), r["title"], " ; ".join(places)),
+                )
+                for n, site in enumerate(r.get("sites", [])):
+                    if site.get("lat") is None or site.get("lon") is None:
+                        continue
+                    site_id = self._db.execute(
+                        "INSERT INTO sites (study_id, site, lat, lon, recruiting) VALUES (?, ?, ?, ?, ?)",
+                        (rowid, n, site["lat"], site["lon"], site_is_recruiting(site["status"], r["status"])),
+                    ).lastrowid
+                    self._db.execute("INSERT INTO sites_rtree VALUES (?, ?, ?, ?, ?)",
+                                     (site_id, site["lat"], site["lat"], site["lon"], site["lon"]))
+        return len(records)
+
+    def optimize(self):
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO studies_fts (studies_fts) VALUES ('optimize')")
+
+    @staticmethod
+    def _filters(phase, status):
+        where, args = [], []
+        if phase and phase != "All":
+            where.append("(', ' || s.phase || ',') LIKE ?")
+            args.append(f"%, {phase},%")
+        if status and status != "All":
+            where.append("s.status = ?")
+            args.append(status)
+        return where, args
+
+    def search(self, condition, location=None, phase="All", status="All", limit=config.CT_DEFAULT_RESULTS):
+        """Best-matching study records (BM25 order) for condition/location text plus phase/status filters."""
+        expr = _match_expr(condition, location)
+        sql = "SELECT s.data FROM studies s"
+        where, args = self._filters(phase, status)
+        if expr:
+            sql += " JOIN studies_fts f ON f.rowid = s.id"
+            where.insert(0, "studies_fts MATCH ?")
+            args.insert(0, expr)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += (" ORDER BY bm25(studies_fts)" if expr else " ORDER BY s.last_update DESC") + " LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def nearby(self, lat, lon, radius_km, condition=None, phase="All", status="All",
+               limit=config.CT_DEFAULT_RESULTS):
+        """Studies with a site within ``radius_km``, sorted by nearest recruiting site.
+
+        The R*Tree returns the sites in the bounding box (already restricted to
+        studies matching the condition and filters), one vectorized haversine
+        pass trims them to the circle, and only the top ``limit`` studies are
+        loaded. Records carry ``distance_km`` and ``nearest_site``.
+        """
+        south, west, north, east = bounding_box(lat, lon, radius_km)
+        sql = ("SELECT t.study_id, t.site, t.lat, t.lon, t.recruiting FROM sites_rtree r"
+               " JOIN sites t ON t.id = r.id JOIN studies s ON s.id = t.study_id"
+               " WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?")
+        args = [south, north, west, east]
+        where, filter_args = self._filters(phase, status)
+        expr = _match_expr(condition)
+        if expr:
+            where.append("t.study_id IN (SELECT rowid FROM studies_fts WHERE studies_fts MATCH ?)")
+            filter_args.append(expr)
+        sql += "".join(" AND " + w for w in where)
+        with self._lock:
+            rows = self._db.execute(sql, args + filter_args).fetchall()
+        if not rows:
+            return []
+        owners, site_nos, lats, lons, recruiting = (np.array(c) for c in zip(*rows))
+        dist = haversine_km(lat, lon, lats, lons)
+        inside = dist <= radius_km
+        owners, site_nos, dist, recruiting = owners[inside], site_nos[inside], dist[inside], recruiting[inside]
+        best = nearest_sites(owners, dist, recruiting.astype(bool))[:limit]
+        ids = [int(owners[i]) for i in best]
+        if not ids:
+            return []
+        with self._lock:
+            data = dict(self._db.execute(
+                f"SELECT id, data FROM studies WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+        records = []
+        for i, study_id in zip(best, ids):
+            record = json.loads(data[study_id])
+            record.update(distance_km=round(float(dist[i]), 1), nearest_site=record["sites"][site_nos[i]])
+            records.append(record)
+        return records
+
+    def sync(self, page_size=1000):
+        """Pull studies updated since the newest stored date from the live API. Returns how many were written."""
+        since = self.last_update()
+        if not since:
+            raise ValueError("index is empty; ingest a snapshot first")
+        params = {"fields": FIELDS, "format": "json",
+                  "filter.advanced": f"AREA[LastUpdatePostDate]RANGE[{since},MAX]"}
+        return self.add(study_record(s) for page in iter_pages(params, page_size, cache=False)
+                        for s in page)
+
+
+def iter_snapshot(path):
+    """Raw v2 study dicts from a snapshot file or directory (see module docstring)."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith(".json"):
+                    with open(os.path.join(root, name), encoding="utf-8") as f:
+                        yield from _studies(json.load(f))
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name.endswith(".json"):
+                    with z.open(name) as f:
+                        yield from _studies(json.load(f))
+    elif path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield from _studies(json.load(f))
+
+
+def _studies(data):
+    if isinstance(data, list):
+        return data
+    return data.get("studies", [data])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_default_index():
+    """The index at ``TRIALS_INDEX_PATH`` if one has been built, else ``None``."""
+    global _index
+    with _index_lock:
+        if _index is None and os.path.exists(config.TRIALS_INDEX_PATH):
+            index = TrialIndex(config.TRIALS_INDEX_PATH)
+            _index = index if len(index) else None
+        return _index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", default=config.TRIALS_INDEX_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="load a ClinicalTrials.gov snapshot")
+    ingest.add_argument("snapshot")
+    sub.add_parser("sync", help="fetch studies updated since the last ingest or sync")
+    args = parser.parse_args(argv)
+
+    index = TrialIndex(args.index)
+    if args.command == "ingest":
+        written = index.add(study_record(s) for s in iter_snapshot(args.snapshot))
+    else:
+        written = index.sync()
+    index.optimize()
+    print(f"Wrote {written} studies; index holds {len(index)} (last update {index.last_update()}) -> {args.index}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())